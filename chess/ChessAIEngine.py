@@ -1,9 +1,750 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
 import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from chess.ChessBitboard import KNIGHT_ATTACKS, bishop_attacks, rook_attacks
+
+CHECKMATE = 100000
+STALEMATE = 0
+DRAW = 0  # repetitions and the fifty move rule
+MATE_BOUND = CHECKMATE - 1000  # scores beyond this are mates, stored relative to the node in the transposition table
+ORDER_NOISE = 64  # lazy SMP helpers: up to this much is added at random to the history score of quiet moves
+
+piece_scores = {"K": 0, "Q": 900, "R": 500, "B": 330, "N": 320, "p": 100}
+mobility_score = 2  # for every square a knight, bishop, rook or queen attacks that isn't taken by its own side
+
+# Piece square tables from white perspective, row 0 is the 8th rank (same orientation as Game_state.board)
+knight_scores = [[-50, -40, -30, -30, -30, -30, -40, -50],
+                 [-40, -20, 0, 0, 0, 0, -20, -40],
+                 [-30, 0, 10, 15, 15, 10, 0, -30],
+                 [-30, 5, 15, 20, 20, 15, 5, -30],
+                 [-30, 0, 15, 20, 20, 15, 0, -30],
+                 [-30, 5, 10, 15, 15, 10, 5, -30],
+                 [-40, -20, 0, 5, 5, 0, -20, -40],
+                 [-50, -40, -30, -30, -30, -30, -40, -50]]
+
+bishop_scores = [[-20, -10, -10, -10, -10, -10, -10, -20],
+                 [-10, 0, 0, 0, 0, 0, 0, -10],
+                 [-10, 0, 5, 10, 10, 5, 0, -10],
+                 [-10, 5, 5, 10, 10, 5, 5, -10],
+                 [-10, 0, 10, 10, 10, 10, 0, -10],
+                 [-10, 10, 10, 10, 10, 10, 10, -10],
+                 [-10, 5, 0, 0, 0, 0, 5, -10],
+                 [-20, -10, -10, -10, -10, -10, -10, -20]]
+
+rook_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
+               [5, 10, 10, 10, 10, 10, 10, 5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [-5, 0, 0, 0, 0, 0, 0, -5],
+               [0, 0, 0, 5, 5, 0, 0, 0]]
+
+queen_scores = [[-20, -10, -10, -5, -5, -10, -10, -20],
+                [-10, 0, 0, 0, 0, 0, 0, -10],
+                [-10, 0, 5, 5, 5, 5, 0, -10],
+                [-5, 0, 5, 5, 5, 5, 0, -5],
+                [0, 0, 5, 5, 5, 5, 0, -5],
+                [-10, 5, 5, 5, 5, 5, 0, -10],
+                [-10, 0, 5, 0, 0, 0, 0, -10],
+                [-20, -10, -10, -5, -5, -10, -10, -20]]
+
+king_scores = [[-30, -40, -40, -50, -50, -40, -40, -30],
+               [-30, -40, -40, -50, -50, -40, -40, -30],
+               [-30, -40, -40, -50, -50, -40, -40, -30],
+               [-30, -40, -40, -50, -50, -40, -40, -30],
+               [-20, -30, -30, -40, -40, -30, -30, -20],
+               [-10, -20, -20, -20, -20, -20, -20, -10],
+               [20, 20, 0, 0, 0, 0, 20, 20],
+               [20, 30, 10, 0, 0, 10, 30, 20]]
+
+pawn_scores = [[0, 0, 0, 0, 0, 0, 0, 0],
+               [50, 50, 50, 50, 50, 50, 50, 50],
+               [10, 10, 20, 30, 30, 20, 10, 10],
+               [5, 5, 10, 25, 25, 10, 5, 5],
+               [0, 0, 0, 20, 20, 0, 0, 0],
+               [5, -5, -10, 0, 0, -10, -5, 5],
+               [5, 10, 10, -20, -20, 10, 10, 5],
+               [0, 0, 0, 0, 0, 0, 0, 0]]
+
+piece_position_scores = {"N": knight_scores, "B": bishop_scores, "R": rook_scores, "Q": queen_scores,
+                         "K": king_scores, "p": pawn_scores}
 
 
 def find_random_move(valid_moves):
     return valid_moves[random.randint(0, len(valid_moves) - 1)]
 
 
-def find_best_move():
-    return
+"""
+Static evaluation of the position from white perspective: material, piece square tables
+(black pieces use the tables mirrored vertically) and mobility of knights, bishops, rooks and queens.
+ChessEvaluation computes the same score for many positions at once with NumPy.
+"""
+
+
+def evaluate(game_state):
+    board = game_state.board
+    score = 0
+    occupied = {"w": 0, "b": 0}
+    mobile_pieces = []
+    for row in range(8):
+        board_row = board[row]
+        for column in range(8):
+            piece = board_row[column]
+            if piece != "--":
+                occupied[piece[0]] |= 1 << (row * 8 + column)
+                if piece[0] == "w":
+                    score += piece_scores[piece[1]] + piece_position_scores[piece[1]][row][column]
+                else:
+                    score -= piece_scores[piece[1]] + piece_position_scores[piece[1]][7 - row][column]
+                if piece[1] in "NBRQ":
+                    mobile_pieces.append((row * 8 + column, piece))
+    all_occupied = occupied["w"] | occupied["b"]
+    for square, piece in mobile_pieces:
+        if piece[1] == "N":
+            attacks = KNIGHT_ATTACKS[square]
+        elif piece[1] == "B":
+            attacks = bishop_attacks(square, all_occupied)
+        elif piece[1] == "R":
+            attacks = rook_attacks(square, all_occupied)
+        else:
+            attacks = rook_attacks(square, all_occupied) | bishop_attacks(square, all_occupied)
+        squares = bin(attacks & ~occupied[piece[0]]).count("1")
+        score += mobility_score * squares if piece[0] == "w" else -mobility_score * squares
+    return score
+
+
+"""
+Fixed size transposition table with depth preferred replacement.
+Entries live in flat typed arrays (16 bytes per entry) over one buffer, so the memory budget in MB is an actual bound.
+The buffer can be shared memory, so several processes can use the same table (lazy SMP).
+An entry is two 64 bit words: data (value, move, depth and flag packed) and check = key ^ data. Processes write
+entries without locks, an entry half written by another process doesn't give back its key and is treated as a miss
+(lockless hashing), so a probe never mixes the value of one position with another.
+Moves are stored with Move.encode().
+"""
+
+
+class TranspositionTable:
+    EXACT = 0
+    LOWER = 1  # fail high, value is a lower bound
+    UPPER = 2  # fail low, value is an upper bound
+    ENTRY_SIZE = 16  # check (8) + data (8): value + 2^31 (bits 0-31), move (32-47), depth + 1 (48-55), flag (56-63)
+    VALUE_OFFSET = 1 << 31
+
+    def __init__(self, size_mb=16, buffer=None):
+        self.size_mb = size_mb
+        entries = self.entries_for(size_mb)
+        self.mask = entries - 1
+        new_buffer = buffer is None
+        if new_buffer:
+            buffer = bytearray(entries * self.ENTRY_SIZE)
+        self.buffer = memoryview(buffer)[:entries * self.ENTRY_SIZE]
+        self.checks = self.buffer[:8 * entries].cast("Q")
+        self.data = self.buffer[8 * entries:16 * entries].cast("Q")
+        if new_buffer:
+            self.clear()  # a shared buffer is cleared once by its owner, not by every process attaching to it
+
+    @classmethod
+    def entries_for(cls, size_mb):
+        entries = 1
+        while entries * 2 * cls.ENTRY_SIZE <= size_mb * 1024 * 1024:
+            entries *= 2
+        return entries
+
+    @classmethod
+    def bytes_for(cls, size_mb):
+        return cls.entries_for(size_mb) * cls.ENTRY_SIZE
+
+    def __len__(self):
+        return self.mask + 1
+
+    def clear(self):
+        self.buffer[:] = bytes(len(self.buffer))  # data 0 marks an empty entry (stored depths are at least 1)
+
+    """
+    Returns (depth, value, flag, move code) for the position key or None
+    """
+
+    def probe(self, key):
+        index = key & self.mask
+        data = self.data[index]
+        if data and self.checks[index] ^ data == key:
+            return (data >> 48 & 0xFF) - 1, (data & 0xFFFFFFFF) - self.VALUE_OFFSET, data >> 56, data >> 32 & 0xFFFF
+        return None
+
+    def store(self, key, depth, value, flag, move_code):
+        index = key & self.mask
+        # depth preferred: keep the deeper result of another position, always refresh the same position
+        old = self.data[index]
+        if old and self.checks[index] ^ old != key and (old >> 48 & 0xFF) - 1 > depth:
+            return
+        data = (value + self.VALUE_OFFSET) | move_code << 32 | (min(depth, 127) + 1) << 48 | flag << 56
+        self.data[index] = data
+        self.checks[index] = key ^ data
+
+
+"""
+Negamax alpha-beta search with iterative deepening, quiescence search and a transposition table.
+Moves are ordered by: transposition table move, captures by MVV-LVA, killer moves, history heuristic.
+The search stops as soon as the time limit is reached, the result of the last finished work is used.
+"""
+
+
+class Searcher:
+    def __init__(self, table_size_mb=16, table=None, evaluator=evaluate):
+        self.table = table if table is not None else TranspositionTable(table_size_mb)
+        self.evaluator = evaluator  # static evaluation from white perspective, see evaluate()
+        self.tablebase = None  # ChessTablebase.Tablebase probed inside the tree, positions it covers are exact
+        self.killers = []
+        self.history = {}
+        self.nodes = 0
+        self.deadline = 0.0
+        self.stop_event = None  # optional threading/multiprocessing Event that cancels the search when set
+        self.stopped = False
+        self.best_move = None
+        self.best_score = 0
+        self.depth_reached = 0
+        self.root_moves = []
+        self.iterations = []
+        self.iteration_times = []  # seconds from the start of the search until each iteration finished
+        self.on_iteration = None  # optional callback(depth, score, best move) after every finished iteration
+        self.order_noise = None  # optional random.Random, lazy SMP helpers shuffle quiet moves of similar history
+
+    """
+    Searches the root moves in valid_moves (all valid moves, or a subset of them when the root is split between
+    processes). Every finished iteration is recorded in iterations as (depth, score, best move).
+    """
+
+    def search(self, game_state, valid_moves, time_limit=1.0, max_depth=64, stop_event=None, start_depth=1):
+        if len(valid_moves) == 0:
+            return None
+        self.stop_event = stop_event
+        self.root_moves = valid_moves
+        self.iterations = []
+        self.iteration_times = []
+        check_mate, stale_mate = game_state.check_mate, game_state.stale_mate
+        self.killers = [[None, None] for _ in range(max_depth + 1)]
+        self.history = {}
+        self.nodes = 0
+        self.stopped = False
+        self.best_move = valid_moves[0]
+        self.best_score = 0
+        self.depth_reached = 0
+        start = time.perf_counter()
+        self.deadline = start + time_limit
+        for depth in range(start_depth, max_depth + 1):
+            score = self.negamax(game_state, depth, -CHECKMATE - 1, CHECKMATE + 1, 0)
+            if self.stopped:
+                break
+            self.best_score = score
+            self.depth_reached = depth
+            self.iterations.append((depth, score, self.best_move))
+            self.iteration_times.append(time.perf_counter() - start)
+            if self.on_iteration is not None:
+                self.on_iteration(depth, score, self.best_move)
+            if abs(score) > MATE_BOUND:
+                break  # forced mate found, deeper search can't improve on it
+        game_state.check_mate, game_state.stale_mate = check_mate, stale_mate
+        # moves from the search are equal to (but not the same objects as) the moves passed in
+        for move in valid_moves:
+            if move == self.best_move and move.is_castle_move == self.best_move.is_castle_move:
+                return move
+        return self.best_move
+
+    def negamax(self, game_state, depth, alpha, beta, ply):
+        self.nodes += 1
+        if self.out_of_time():
+            return 0
+        # a position repeated once is scored as a draw, no need to wait for the third time (only inside the search,
+        # at the root the moves still have to be searched)
+        if ply > 0 and (game_state.is_repetition() or game_state.halfmove_clock >= 100):
+            return DRAW
+        if ply > 0 and self.tablebase is not None:
+            score = self.tablebase_score(game_state, ply)
+            if score is not None:
+                return score
+        key = game_state.hash()
+        alpha_original = alpha
+        hash_move_code = 0
+        entry = self.table.probe(key)
+        if entry is not None:
+            entry_depth, value, flag, hash_move_code = entry
+            if entry_depth >= depth and ply > 0:
+                value = self.score_from_table(value, ply)
+                if flag == TranspositionTable.EXACT or \
+                        (flag == TranspositionTable.LOWER and value >= beta) or \
+                        (flag == TranspositionTable.UPPER and value <= alpha):
+                    return value
+        if depth <= 0:
+            return self.quiescence(game_state, alpha, beta, ply)
+
+        moves = self.root_moves if ply == 0 else game_state.get_valid_moves()
+        if len(moves) == 0:
+            return -CHECKMATE + ply if game_state.check_mate else STALEMATE
+
+        best_value = -CHECKMATE - 1
+        best_move = None
+        for move in self.order_moves(moves, hash_move_code, ply):
+            game_state.make_move(move)
+            value = -self.negamax(game_state, depth - 1, -beta, -alpha, ply + 1)
+            game_state.undo_move()
+            if self.stopped:
+                return 0
+            if value > best_value:
+                best_value = value
+                best_move = move
+                if value > alpha:
+                    alpha = value
+                    if ply == 0:
+                        self.best_move = move
+            if alpha >= beta:
+                if move.piece_captured == "--":  # quiet move caused cutoff, remember it for ordering
+                    if ply < len(self.killers) and self.killers[ply][0] != move:
+                        self.killers[ply][1] = self.killers[ply][0]
+                        self.killers[ply][0] = move
+                    history_key = (move.piece_moved, move.end_row, move.end_column)
+                    self.history[history_key] = self.history.get(history_key, 0) + depth * depth
+                break
+
+        if best_value <= alpha_original:
+            flag = TranspositionTable.UPPER
+        elif best_value >= beta:
+            flag = TranspositionTable.LOWER
+        else:
+            flag = TranspositionTable.EXACT
+        self.table.store(key, depth, self.score_to_table(best_value, ply), flag, best_move.encode())
+        return best_value
+
+    """
+    Searches captures (and promotions) only, until the position is quiet, to avoid horizon effect.
+    The side to move in check can't stand pat, all its evasions are searched.
+    """
+
+    def quiescence(self, game_state, alpha, beta, ply):
+        self.nodes += 1
+        if self.out_of_time():
+            return 0
+        if self.tablebase is not None:
+            score = self.tablebase_score(game_state, ply)
+            if score is not None:
+                return score
+        moves = game_state.get_valid_moves()
+        if len(moves) == 0:
+            return -CHECKMATE + ply if game_state.check_mate else STALEMATE
+        if game_state.in_check():
+            captures = moves
+        else:
+            stand_pat = self.evaluator(game_state) if game_state.white_to_move else -self.evaluator(game_state)
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            captures = [move for move in moves if move.piece_captured != "--" or move.is_pawn_promotion]
+        captures.sort(key=self.mvv_lva, reverse=True)
+        for move in captures:
+            game_state.make_move(move)
+            value = -self.quiescence(game_state, -beta, -alpha, ply + 1)
+            game_state.undo_move()
+            if self.stopped:
+                return 0
+            if value >= beta:
+                return value
+            if value > alpha:
+                alpha = value
+        return alpha
+
+    """
+    Exact score from the tablebases (mates scored like the search scores them), None if the position isn't covered
+    """
+
+    def tablebase_score(self, game_state, ply):
+        result = self.tablebase.probe(game_state)
+        if result is None:
+            return None
+        wdl, plies = result
+        if wdl > 0:
+            return CHECKMATE - ply - plies
+        if wdl < 0:
+            return -CHECKMATE + ply + plies
+        return STALEMATE
+
+    def out_of_time(self):
+        if time.perf_counter() >= self.deadline or (self.stop_event is not None and self.stop_event.is_set()):
+            self.stopped = True
+        return self.stopped
+
+    @staticmethod
+    def mvv_lva(move):
+        # most valuable victim first, least valuable attacker breaks ties
+        victim = piece_scores[move.piece_captured[1]] if move.piece_captured != "--" else 0
+        return victim * 10 - piece_scores[move.piece_moved[1]] + (800 if move.is_pawn_promotion else 0)
+
+    def order_moves(self, moves, hash_move_code, ply):
+        killers = self.killers[ply] if ply < len(self.killers) else (None, None)
+        history = self.history
+
+        def move_order(move):
+            if hash_move_code and move.encode() == hash_move_code:
+                return 10000000
+            if move.piece_captured != "--" or move.is_pawn_promotion:
+                return 1000000 + self.mvv_lva(move)
+            if move == killers[0]:
+                return 900000
+            if move == killers[1]:
+                return 800000
+            return history.get((move.piece_moved, move.end_row, move.end_column), 0)
+
+        if self.order_noise is not None:
+            noise = self.order_noise.random
+            return sorted(moves, key=lambda move: move_order(move) + noise() * ORDER_NOISE, reverse=True)
+        return sorted(moves, key=move_order, reverse=True)
+
+    @staticmethod
+    def score_to_table(value, ply):
+        # mate scores are stored as distance from this node, not from the root
+        if value > MATE_BOUND:
+            return value + ply
+        if value < -MATE_BOUND:
+            return value - ply
+        return value
+
+    @staticmethod
+    def score_from_table(value, ply):
+        if value > MATE_BOUND:
+            return value - ply
+        if value < -MATE_BOUND:
+            return value + ply
+        return value
+
+
+searcher = None  # shared between calls so the transposition table survives from move to move
+
+
+tablebase = None  # endgame tablebases of this process, opened on first use
+
+
+"""
+Tablebases in directory (see ChessTablebase), None if there is no such directory
+"""
+
+
+def open_tablebase(directory):
+    global tablebase
+    if directory is None or not os.path.isdir(directory):
+        return None
+    if tablebase is None or tablebase.directory != directory:
+        from chess.ChessTablebase import Tablebase
+        if tablebase is not None:
+            tablebase.close()
+        tablebase = Tablebase(directory)
+    return tablebase
+
+
+"""
+Finds the best move for the side to move within time_limit seconds (wall clock).
+Setting stop_event (if given) cancels the search, the best move found so far is returned.
+With tablebase_directory, positions the tablebases cover are played from the tables right away
+and the search uses them for covered positions in the tree.
+"""
+
+
+def find_best_move(game_state, valid_moves, time_limit=1.0, max_depth=64, table_size_mb=16, stop_event=None,
+                   tablebase_directory=None):
+    global searcher
+    if searcher is None or searcher.table.size_mb != table_size_mb:  # a new budget needs a new table
+        searcher = Searcher(table_size_mb)
+    searcher.tablebase = open_tablebase(tablebase_directory)
+    if searcher.tablebase is not None:
+        result = searcher.tablebase.best_move(game_state, valid_moves)
+        if result is not None:
+            return result[0]
+    return searcher.search(game_state, valid_moves, time_limit, max_depth, stop_event)
+
+
+book = None  # opening book of this process, opened on first use
+
+
+"""
+Weighted random move from the Polyglot opening book at book_path, None if the position isn't in the book
+or there is no book. The book is memory mapped once per process, processes share the pages of the file.
+"""
+
+
+def book_move(game_state, valid_moves, book_path):
+    global book
+    if book_path is None or not os.path.exists(book_path):
+        return None
+    if book is None or book.path != book_path:
+        from chess.ChessBook import OpeningBook
+        if book is not None:
+            book.close()
+        book = OpeningBook(book_path)
+    return book.choose_move(game_state, valid_moves)
+
+
+"""
+Entry point for a worker process: plays from the opening book if it can (book_path), otherwise
+searches (with tablebases from tablebase_directory, if given) and puts (move, profile) on return_queue.
+Moves come back pickled, so the receiver has to match them against its own valid moves.
+profile is the snapshot of the worker's profiler (ChessProfiler) when game_state has one, otherwise None.
+"""
+
+
+def find_move_process(game_state, valid_moves, time_limit, return_queue, stop_event, book_path=None,
+                      tablebase_directory=None):
+    profiler = game_state.profiler
+    if profiler is not None:
+        profiler.reset()  # the copy of the caller's profiler, count only what happens here
+    move = book_move(game_state, valid_moves, book_path)
+    if move is None:
+        if searcher is not None:
+            searcher.nodes = 0  # stays 0 when the tablebases give the move without searching
+        move = find_best_move(game_state, valid_moves, time_limit, stop_event=stop_event,
+                              tablebase_directory=tablebase_directory)
+        if profiler is not None and searcher is not None:
+            profiler.counters["search_nodes"] += searcher.nodes
+    if move is None:
+        move = find_random_move(valid_moves)
+    return_queue.put((move, profiler.snapshot() if profiler is not None else None))
+
+
+shared_table = None  # lazy SMP worker processes: transposition table in shared memory, attached once per process
+shared_stop = None  # lazy SMP worker processes: Event set by the first worker that finishes, stops the others
+
+
+def create_searcher(table_size_mb):
+    global searcher
+    searcher = Searcher(table_size_mb)
+
+
+def attach_shared_table(name, table_size_mb, stop_event):
+    global shared_table, shared_stop, searcher
+    memory = shared_memory.SharedMemory(name=name)
+    shared_table = TranspositionTable(table_size_mb, memory.buf)
+    shared_table.memory = memory  # keep the mapping open as long as the table is used
+    shared_stop = stop_event
+    searcher = Searcher(table=shared_table)
+
+
+"""
+Runs in a worker process: searches root_moves until the (wall clock) deadline, returns statistics and
+every finished iteration as (depth, score, move code, wall clock time), so only small plain data travels back to
+the parent. Lazy SMP helpers (worker > 0) start at depth 2 every other worker and order quiet moves with their
+own random noise, so they search different parts of the tree first instead of repeating the main worker.
+"""
+
+
+def search_worker(worker, game_state, root_moves, deadline, max_depth, start_depth, helper=False):
+    global searcher
+    if searcher is None:
+        searcher = Searcher()
+    searcher.order_noise = random.Random(worker) if helper else None
+    started = time.time()
+    start = time.perf_counter()
+    searcher.search(game_state, root_moves, max(deadline - started, 0.0), max_depth, stop_event=shared_stop,
+                    start_depth=start_depth)
+    if shared_stop is not None and not searcher.stopped:
+        shared_stop.set()  # reached max_depth (or a mate), the others can't return anything deeper in time
+    return {"worker": worker, "pid": os.getpid(), "nodes": searcher.nodes, "seconds": time.perf_counter() - start,
+            "iterations": [(depth, score, move.encode(), started + seconds) for (depth, score, move), seconds
+                           in zip(searcher.iterations, searcher.iteration_times)]}
+
+
+"""
+Multi process search, two modes:
+- root splitting (ROOT_SPLIT): root moves are dealt out to the workers, each searches its share with its own
+  transposition table, the best move is picked at the deepest depth every worker finished
+- lazy SMP (LAZY_SMP): every worker searches the whole position, they share one transposition table in shared
+  memory. Helpers vary their start depth and move order, so they fill the table for each other; the first worker
+  to finish max_depth stops the rest and the deepest result wins
+After each search worker_stats holds nodes, time and nodes per second for every worker, and time_to_depth the
+seconds from the start of the search until a depth was first finished (by any worker, or by all of them for
+root splitting).
+"""
+
+
+class ParallelSearcher:
+    ROOT_SPLIT = "root"
+    LAZY_SMP = "lazy"
+
+    def __init__(self, workers=None, mode=LAZY_SMP, table_size_mb=16):
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.mode = mode
+        self.table_size_mb = table_size_mb
+        self.memory = None
+        self.stop_event = None
+        self.worker_stats = []
+        self.time_to_depth = {}
+        self.best_score = 0
+        self.depth_reached = 0
+        if mode == self.LAZY_SMP:
+            self.memory = shared_memory.SharedMemory(create=True, size=TranspositionTable.bytes_for(table_size_mb))
+            self.clear_table()
+            self.stop_event = multiprocessing.Event()
+            self.executor = ProcessPoolExecutor(self.workers, initializer=attach_shared_table,
+                                                initargs=(self.memory.name, table_size_mb, self.stop_event))
+        elif mode == self.ROOT_SPLIT:
+            self.executor = ProcessPoolExecutor(self.workers, initializer=create_searcher, initargs=(table_size_mb,))
+        else:
+            raise ValueError("Unknown parallel search mode: {}".format(mode))
+
+    """
+    Empties the shared transposition table (lazy SMP), e.g. before a new game
+    """
+
+    def clear_table(self):
+        if self.memory is not None:
+            TranspositionTable(self.table_size_mb, self.memory.buf).clear()
+
+    def search(self, game_state, valid_moves, time_limit=1.0, max_depth=64):
+        if len(valid_moves) == 0:
+            return None
+        started = time.time()
+        deadline = started + time_limit
+        if self.mode == self.ROOT_SPLIT:
+            shares = [valid_moves[worker::self.workers] for worker in range(min(self.workers, len(valid_moves)))]
+            futures = [self.executor.submit(search_worker, worker, game_state, share, deadline, max_depth, 1)
+                       for worker, share in enumerate(shares)]
+        else:
+            self.stop_event.clear()
+            futures = [self.executor.submit(search_worker, worker, game_state, valid_moves, deadline, max_depth,
+                                            1 + worker % 2, worker > 0)
+                       for worker in range(self.workers)]
+        results = [future.result() for future in futures]
+        self.worker_stats = [{"worker": result["worker"], "pid": result["pid"], "nodes": result["nodes"],
+                              "seconds": result["seconds"],
+                              "nps": result["nodes"] / result["seconds"] if result["seconds"] > 0 else 0.0,
+                              "depth": result["iterations"][-1][0] if result["iterations"] else 0}
+                             for result in results]
+        finished = {}  # depth -> wall clock time every worker that finished it did so
+        for result in results:
+            for depth, _, _, finish_time in result["iterations"]:
+                finished.setdefault(depth, []).append(finish_time)
+        if self.mode == self.ROOT_SPLIT:
+            self.time_to_depth = {depth: max(times) - started for depth, times in sorted(finished.items())
+                                  if len(times) == len(results)}
+        else:
+            self.time_to_depth = {depth: min(times) - started for depth, times in sorted(finished.items())}
+
+        best = None  # (depth, score, move code, time)
+        if self.mode == self.ROOT_SPLIT:
+            finished = [result["iterations"] for result in results if result["iterations"]]
+            if finished:
+                depth = min(iterations[-1][0] for iterations in finished)
+                for iterations in finished:
+                    iteration = iterations[depth - 1]  # iterations start at depth 1
+                    if best is None or iteration[1] > best[1]:
+                        best = iteration
+        else:
+            for result in results:
+                if result["iterations"] and (best is None or result["iterations"][-1][0] > best[0]):
+                    best = result["iterations"][-1]
+        if best is None:
+            return valid_moves[0]
+        self.depth_reached, self.best_score = best[0], best[1]
+        for move in valid_moves:
+            if move.encode() == best[2]:
+                return move
+        return valid_moves[0]
+
+    def close(self):
+        self.executor.shutdown()
+        if self.memory is not None:
+            self.memory.close()
+            self.memory.unlink()
+            self.memory = None
+
+
+"""
+Time to depth of the single process search against ParallelSearcher with each of worker_counts workers, on the
+positions (name -> FEN). Every search starts with an empty transposition table. Returns one result per position
+and worker count with the seconds until depth was finished, nodes and the speedup over one process.
+"""
+
+
+def benchmark_parallel(positions, depth, worker_counts, mode=ParallelSearcher.LAZY_SMP, table_size_mb=16):
+    from chess import ChessEngine
+
+    results = []
+    single = {}
+    for name, fen in positions.items():
+        game_state = ChessEngine.Game_state.from_fen(fen)
+        searcher = Searcher(table_size_mb)
+        start = time.perf_counter()
+        searcher.search(game_state, game_state.get_valid_moves(), 1e9, depth)
+        single[name] = searcher.iteration_times[-1] if searcher.iteration_times else time.perf_counter() - start
+        results.append({"position": name, "workers": 0, "seconds": single[name], "nodes": searcher.nodes,
+                        "speedup": 1.0})
+    for workers in worker_counts:
+        parallel = ParallelSearcher(workers, mode, table_size_mb)
+        try:
+            warm_up = ChessEngine.Game_state()
+            parallel.search(warm_up, warm_up.get_valid_moves(), 1e9, 1)  # start the worker processes untimed
+            for name, fen in positions.items():
+                game_state = ChessEngine.Game_state.from_fen(fen)
+                parallel.clear_table()
+                start = time.time()
+                parallel.search(game_state, game_state.get_valid_moves(), 1e9, depth)
+                seconds = parallel.time_to_depth.get(depth, time.time() - start)
+                results.append({"position": name, "workers": workers, "seconds": seconds,
+                                "nodes": sum(stats["nodes"] for stats in parallel.worker_stats),
+                                "speedup": single[name] / seconds if seconds > 0 else 0.0})
+        finally:
+            parallel.close()
+    return results
+
+
+def main(argv=None):
+    from chess import ChessPerft
+
+    parser = argparse.ArgumentParser(prog="search", description="time to depth of the single and multi process search")
+    parser.add_argument("positions", nargs="*", default=["initial", "kiwipete", "middlegame"],
+                        help="positions: {} (default: %(default)s)".format(", ".join(ChessPerft.POSITIONS)))
+    parser.add_argument("--depth", type=int, default=4, help="depth every search has to finish (default: %(default)s)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[2, 4], help="worker counts (default: %(default)s)")
+    parser.add_argument("--mode", choices=(ParallelSearcher.LAZY_SMP, ParallelSearcher.ROOT_SPLIT),
+                        default=ParallelSearcher.LAZY_SMP)
+    parser.add_argument("--hash", type=int, default=16, help="transposition table MB (default: %(default)s)")
+    parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+    unknown = [name for name in args.positions if name not in ChessPerft.POSITIONS]
+    if unknown:
+        parser.error("unknown positions: {}".format(", ".join(unknown)))
+
+    positions = {name: ChessPerft.POSITIONS[name][0] for name in args.positions}
+    results = benchmark_parallel(positions, args.depth, args.workers, args.mode, args.hash)
+    for result in results:
+        print("{:<12} {:>8}  depth {}  {:8.3f}s  nodes {:>9}  speedup {:5.2f}".format(
+            result["position"], "{} proc".format(result["workers"]) if result["workers"] else "single",
+            args.depth, result["seconds"], result["nodes"], result["speedup"]))
+    for workers in args.workers:
+        total = sum(result["seconds"] for result in results if result["workers"] == workers)
+        baseline = sum(result["seconds"] for result in results if result["workers"] == 0)
+        print("{} workers: time to depth {} {:.3f}s, {:.2f}x the single process search".format(
+            workers, args.depth, total, baseline / total if total > 0 else 0.0))
+    if args.json_file:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "cpus": os.cpu_count(),
+            "depth": args.depth,
+            "mode": args.mode,
+            "results": results,
+        }
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_file, "w") as file:
+                json.dump(report, file, indent=2)
+    return 0
@@ -0,0 +1,350 @@
+"""
+Binary game archive (.pcga): games stored as 16 bit move codes (Move.encode: from square, to square, flags),
+with an index of game offsets at the end of the file. The file is memory mapped, any game and ply is reached
+through the index without reading the games before it, and positions are rebuilt with Move.decode and make_move
+only, no move generation and no text parsing, so scanning an archive is bound by reading the file.
+Codes are used instead of indexes into the legal move list: an index would be one byte instead of two, but
+decoding it needs the legal moves of every position.
+
+Layout (little-endian):
+    header   magic "PCGA", version (H), move encoding (H), game count (Q), index offset (Q)
+    games    plies (H), result (B, index in ChessPgn.RESULTS), reserved (B), tags length (I),
+             tags (UTF-8 "name\\0value\\0..."), plies move codes (H each)
+    index    game count offsets (Q each) of the games
+Games are numbered from 0 in the order they were added. Appending rewrites only the index and the header.
+
+Usage:
+    python main.py archive convert PGN... --output games.pcga [--append]
+    python main.py archive info games.pcga
+    python main.py archive show games.pcga GAME [--ply N]
+    python main.py archive scan games.pcga [--pgn PGN] [--json FILE]     replay speed, archive against PGN
+"""
+
+import argparse
+import json
+import mmap
+import os
+import platform
+import struct
+import sys
+import time
+from array import array
+
+from chess import ChessEngine, ChessPgn
+
+MAGIC = b"PCGA"
+VERSION = 1
+MOVE_CODES = 0  # move encoding: Move.encode() codes
+HEADER = struct.Struct("<4sHHQQ")
+GAME = struct.Struct("<HBBI")
+MAX_PLIES = 0xFFFF
+
+
+def encode_tags(headers):
+    return "".join("{}\0{}\0".format(name, value) for name, value in headers.items()).encode("utf-8")
+
+
+def decode_tags(data):
+    fields = data.decode("utf-8").split("\0")
+    return dict(zip(fields[0:-1:2], fields[1::2]))
+
+
+def _codes(data):
+    codes = array("H")
+    codes.frombytes(data)
+    if sys.byteorder == "big":
+        codes.byteswap()
+    return codes
+
+
+def _offsets(data):
+    offsets = array("Q")
+    offsets.frombytes(data)
+    if sys.byteorder == "big":
+        offsets.byteswap()
+    return offsets
+
+
+"""
+Writes games to a new archive, or adds them to an existing one with append=True
+"""
+
+
+class ArchiveWriter:
+    def __init__(self, path, append=False):
+        self.path = path
+        if append and os.path.exists(path):
+            self.file = open(path, "r+b")
+            magic, version, encoding, count, index_offset = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or encoding != MOVE_CODES:
+                raise ValueError("{} is not a game archive this version can append to".format(path))
+            self.file.seek(index_offset)
+            self.offsets = _offsets(self.file.read(8 * count))
+            self.file.seek(index_offset)
+            self.file.truncate()
+        else:
+            self.file = open(path, "wb")
+            self.file.write(HEADER.pack(MAGIC, VERSION, MOVE_CODES, 0, 0))
+            self.offsets = array("Q")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    """
+    Adds a game from its move codes, returns its number
+    """
+
+    def add_game(self, codes, headers=None, result="*"):
+        if len(codes) > MAX_PLIES:
+            raise ValueError("Games are limited to {} plies".format(MAX_PLIES))
+        tags = encode_tags(headers or {})
+        codes = array("H", codes)
+        if sys.byteorder == "big":
+            codes.byteswap()
+        self.offsets.append(self.file.tell())
+        self.file.write(GAME.pack(len(codes), ChessPgn.RESULTS.index(result), 0, len(tags)))
+        self.file.write(tags)
+        self.file.write(codes.tobytes())
+        return len(self.offsets) - 1
+
+    """
+    Adds the game played on game_state (from the position before its first move), the result from the position
+    unless headers have one
+    """
+
+    def add_game_state(self, game_state, headers=None):
+        headers = dict(headers or {})
+        moves = list(game_state.game_log)
+        if "FEN" not in headers:
+            for _ in moves:
+                game_state.undo_move()
+            start_fen = game_state.to_fen()
+            for move in moves:
+                game_state.make_move(move)
+            if start_fen != ChessPgn.INITIAL_FEN:
+                headers["FEN"] = start_fen
+        result = ChessPgn.game_result(game_state)
+        if result == "*":
+            result = headers.get("Result", "*")
+        return self.add_game([move.encode() for move in moves], headers, result)
+
+    def close(self):
+        if self.file.closed:
+            return
+        index_offset = self.file.tell()
+        offsets = array("Q", self.offsets)
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        self.file.write(offsets.tobytes())
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, MOVE_CODES, len(self.offsets), index_offset))
+        self.file.close()
+
+
+"""
+Memory mapped archive, games are read only when they are asked for
+"""
+
+
+class GameArchive:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, encoding, count, index_offset = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION or encoding != MOVE_CODES:
+            self.data.close()
+            raise ValueError("{} is not a game archive".format(path))
+        self.offsets = _offsets(self.data[index_offset:index_offset + 8 * count])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def close(self):
+        self.data.close()
+
+    def _record(self, game):
+        offset = self.offsets[game]
+        plies, result, _, tags_length = GAME.unpack_from(self.data, offset)
+        return offset + GAME.size, plies, result, tags_length
+
+    def plies(self, game):
+        return self._record(game)[1]
+
+    def result(self, game):
+        return ChessPgn.RESULTS[self._record(game)[2]]
+
+    def headers(self, game):
+        start, _, result, tags_length = self._record(game)
+        headers = decode_tags(self.data[start:start + tags_length])
+        headers["Result"] = ChessPgn.RESULTS[result]
+        return headers
+
+    def start_fen(self, game):
+        return self.headers(game).get("FEN", ChessPgn.INITIAL_FEN)
+
+    """
+    Move codes of the game (Move.encode), only these bytes of the file are read
+    """
+
+    def codes(self, game):
+        start, plies, _, tags_length = self._record(game)
+        start += tags_length
+        return _codes(self.data[start:start + 2 * plies])
+
+    """
+    Yields (game_state, move) after every move like PgnGame.replay(), the same Game_state is updated in place
+    """
+
+    def replay(self, game, game_state=None):
+        if game_state is None:
+            game_state = ChessEngine.Game_state.from_fen(self.start_fen(game))
+            game_state.disable_move_cache()  # moves come from the archive, nothing is generated
+        board = game_state.board
+        for code in self.codes(game):
+            move = ChessEngine.Move.decode(code, board)
+            game_state.make_move(move)
+            yield game_state, move
+
+    """
+    Game_state after ply plies of the game (all of them if ply is None)
+    """
+
+    def game_state(self, game, ply=None):
+        game_state = ChessEngine.Game_state.from_fen(self.start_fen(game))
+        codes = self.codes(game)
+        for code in codes[:len(codes) if ply is None else ply]:
+            game_state.make_move(ChessEngine.Move.decode(code, game_state.board))
+        return game_state
+
+    def moves(self, game):
+        return [move for _, move in self.replay(game)]
+
+    def pgn_game(self, game):
+        headers = self.headers(game)
+        game_state = ChessEngine.Game_state.from_fen(self.start_fen(game))
+        moves = ChessPgn.san_moves(game_state, self.moves(game))
+        return ChessPgn.PgnGame(headers, list(moves), headers["Result"])
+
+
+"""
+Converts PGN files into the archive at output_path, returns (games, plies, errors).
+Games with illegal moves are skipped and counted as errors.
+"""
+
+
+def convert_pgn(pgn_paths, output_path, append=False):
+    games = plies = errors = 0
+    with ArchiveWriter(output_path, append) as writer:
+        for path in pgn_paths:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                for game in ChessPgn.read_games(file):
+                    try:
+                        codes = [move.encode() for _, move in game.replay()]
+                    except ValueError:
+                        errors += 1
+                        continue
+                    headers = dict(game.headers)
+                    headers.pop("Result", None)
+                    writer.add_game(codes, headers, game.result if game.result in ChessPgn.RESULTS else "*")
+                    games += 1
+                    plies += len(codes)
+    return games, plies, errors
+
+
+"""
+Replays every game of the archive, returns (games, plies)
+"""
+
+
+def scan(archive):
+    games = plies = 0
+    for game in range(len(archive)):
+        games += 1
+        for _ in archive.replay(game):
+            plies += 1
+    return games, plies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="archive", description="binary game archive tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="convert PGN files into an archive")
+    convert.add_argument("pgn_files", nargs="+")
+    convert.add_argument("--output", "-o", required=True, help="archive file to write")
+    convert.add_argument("--append", action="store_true", help="add the games to an existing archive")
+    info = commands.add_parser("info", help="games and plies of an archive")
+    info.add_argument("archive_file")
+    show = commands.add_parser("show", help="print one game as PGN, or its position after some plies")
+    show.add_argument("archive_file")
+    show.add_argument("game", type=int)
+    show.add_argument("--ply", type=int, help="print the FEN after this many plies instead")
+    scan_parser = commands.add_parser("scan", help="replay speed of the archive (and of the same games as PGN)")
+    scan_parser.add_argument("archive_file")
+    scan_parser.add_argument("--pgn", help="PGN file with the same games, replayed for comparison")
+    scan_parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        start = time.perf_counter()
+        games, plies, errors = convert_pgn(args.pgn_files, args.output, args.append)
+        print("{} games, {} plies, {} skipped in {:.2f}s, {} bytes".format(
+            games, plies, errors, time.perf_counter() - start, os.path.getsize(args.output)))
+        return 0
+
+    with GameArchive(args.archive_file) as archive:
+        if args.command == "info":
+            plies = sum(archive.plies(game) for game in range(len(archive)))
+            size = os.path.getsize(args.archive_file)
+            print("{} games, {} plies, {} bytes ({:.1f} bytes per ply)".format(
+                len(archive), plies, size, size / plies if plies else 0.0))
+        elif args.command == "show":
+            if not 0 <= args.game < len(archive):
+                parser.error("the archive has games 0 to {}".format(len(archive) - 1))
+            if args.ply is not None:
+                print(archive.game_state(args.game, args.ply).to_fen())
+            else:
+                ChessPgn.write_game(sys.stdout, archive.game_state(args.game), archive.headers(args.game))
+        else:
+            results = []
+            start = time.perf_counter()
+            games, plies = scan(archive)
+            results.append({"name": args.archive_file, "format": "archive", "games": games, "plies": plies,
+                            "seconds": time.perf_counter() - start})
+            if args.pgn:
+                start = time.perf_counter()
+                with open(args.pgn, encoding="utf-8", errors="replace") as file:
+                    games, plies, _ = ChessPgn.replay_games(file)
+                results.append({"name": args.pgn, "format": "pgn", "games": games, "plies": plies,
+                                "seconds": time.perf_counter() - start})
+            for result in results:
+                seconds = result["seconds"]
+                result["plies_per_second"] = result["plies"] / seconds if seconds > 0 else 0.0
+                print("{:<8} games {:>8}  plies {:>10}  {:8.3f}s  {:>9.0f} plies/s".format(
+                    result["format"], result["games"], result["plies"], seconds, result["plies_per_second"]))
+            if args.json_file:
+                report = {
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                    "results": results,
+                }
+                if args.json_file == "-":
+                    json.dump(report, sys.stdout, indent=2)
+                    print()
+                else:
+                    with open(args.json_file, "w") as file:
+                        json.dump(report, file, indent=2)
+    return 0
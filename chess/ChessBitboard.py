@@ -0,0 +1,329 @@
+"""
+Bitboard backend for Game_state.
+Every piece type of every color is stored as a 64 bit Python int, where square (row, column) is bit row * 8 + column
+(same numbering as the attack bitmaps in ChessEngine). Knight, king and pawn attacks come from precomputed tables,
+sliding attacks are computed from occupancy with a hyperbola quintessence style subtraction (rank attacks come from a
+lookup table).
+Game_state keeps the bitboards in sync with its 8x8 board in make_move and undo_move, so the board (and everything
+drawing it) keeps working, while legal move generation works on whole sets of squares at once.
+Experimental: moves are still built from the 8x8 board squares, so generation is only slightly faster than the
+board backend and every make_move and undo_move pays for the bitboard update. Nothing enables it by default,
+perft --backend bitboard compares the two.
+"""
+
+from chess.ChessEngine import Move, KNIGHT_MOVES, KING_MOVES, ROOK_DIRECTIONS, BISHOP_DIRECTIONS
+
+FULL = 0xFFFFFFFFFFFFFFFF
+FILE_A = 0x0101010101010101
+FILE_H = FILE_A << 7
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+
+
+def _bit(row, column):
+    return 1 << (row * 8 + column)
+
+
+def _offset_table(offsets):
+    table = []
+    for square in range(64):
+        row, column = divmod(square, 8)
+        bitmap = 0
+        for offset in offsets:
+            end_row = row + offset[0]
+            end_column = column + offset[1]
+            if 0 <= end_row < 8 and 0 <= end_column < 8:
+                bitmap |= _bit(end_row, end_column)
+        table.append(bitmap)
+    return table
+
+
+KNIGHT_ATTACKS = _offset_table(KNIGHT_MOVES)
+KING_ATTACKS = _offset_table(KING_MOVES)
+# squares attacked by a pawn of the given color standing on the square
+PAWN_ATTACKS = {"w": _offset_table(((-1, -1), (-1, 1))), "b": _offset_table(((1, -1), (1, 1)))}
+
+
+def _ray(square, direction):
+    row, column = divmod(square, 8)
+    bitmap = 0
+    row += direction[0]
+    column += direction[1]
+    while 0 <= row < 8 and 0 <= column < 8:
+        bitmap |= _bit(row, column)
+        row += direction[0]
+        column += direction[1]
+    return bitmap
+
+
+# Rays towards increasing square numbers (positive) and decreasing square numbers (negative) for every square
+FILE_RAYS = ([_ray(square, (1, 0)) for square in range(64)], [_ray(square, (-1, 0)) for square in range(64)])
+DIAGONAL_RAYS = ([_ray(square, (1, -1)) for square in range(64)], [_ray(square, (-1, 1)) for square in range(64)])
+ANTI_DIAGONAL_RAYS = ([_ray(square, (1, 1)) for square in range(64)], [_ray(square, (-1, -1)) for square in range(64)])
+
+
+def _first_rank_attacks(column, occupancy):
+    bitmap = 0
+    for step in (-1, 1):
+        end_column = column + step
+        while 0 <= end_column < 8:
+            bitmap |= 1 << end_column
+            if occupancy >> end_column & 1:
+                break
+            end_column += step
+    return bitmap
+
+
+RANK_ATTACKS = [[_first_rank_attacks(column, occupancy) for occupancy in range(256)] for column in range(8)]
+
+
+"""
+Attacks along a file or diagonal. Towards higher squares this is the subtraction half of hyperbola quintessence
+(o ^ (o - 2s) marks everything up to the first blocker). The mirrored half would need a 64 bit byte swap, which is
+slow on Python ints, so towards lower squares the first blocker is found directly as the highest set bit instead.
+"""
+
+
+def _line_attacks(square, occupied, rays):
+    positive = rays[0][square]
+    blockers = occupied & positive
+    attacks = (blockers ^ (blockers - (2 << square))) & positive
+    negative = rays[1][square]
+    blockers = occupied & negative
+    if blockers:
+        return attacks | (negative ^ rays[1][blockers.bit_length() - 1])
+    return attacks | negative
+
+
+def rook_attacks(square, occupied):
+    shift = square & 56
+    rank = RANK_ATTACKS[square & 7][(occupied >> shift) & 0xFF] << shift
+    return rank | _line_attacks(square, occupied, FILE_RAYS)
+
+
+def bishop_attacks(square, occupied):
+    return _line_attacks(square, occupied, DIAGONAL_RAYS) | _line_attacks(square, occupied, ANTI_DIAGONAL_RAYS)
+
+
+def _line_tables():
+    between = [[0] * 64 for _ in range(64)]
+    line = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        for direction in ROOK_DIRECTIONS + BISHOP_DIRECTIONS:
+            full_line = _ray(square, direction) | _ray(square, (-direction[0], -direction[1])) | (1 << square)
+            row, column = divmod(square, 8)
+            path = 0
+            row += direction[0]
+            column += direction[1]
+            while 0 <= row < 8 and 0 <= column < 8:
+                target = row * 8 + column
+                between[square][target] = path
+                line[square][target] = full_line
+                path |= 1 << target
+                row += direction[0]
+                column += direction[1]
+    return between, line
+
+
+# BETWEEN[a][b] - squares strictly between aligned squares a and b, LINE[a][b] - whole line through both
+BETWEEN, LINE = _line_tables()
+
+
+def _squares(bitmap):
+    while bitmap:
+        lowest = bitmap & -bitmap
+        yield lowest.bit_length() - 1
+        bitmap ^= lowest
+
+
+"""
+Converts bitboards into the 8x8 board of two character strings used by Game_state and ChessMain
+"""
+
+
+def to_board(bitboards):
+    board = [["--"] * 8 for _ in range(8)]
+    for piece in PIECES:
+        for square in _squares(bitboards[piece]):
+            board[square >> 3][square & 7] = piece
+    return board
+
+
+class Bitboards:
+    def __init__(self, board):
+        self.pieces = {piece: 0 for piece in PIECES}
+        self.occupied = {"w": 0, "b": 0}
+        self.squares = ["--"] * 64  # what the bitboards currently hold on every square
+        for row in range(8):
+            for column in range(8):
+                if board[row][column] != "--":
+                    self.set_piece(row * 8 + column, board[row][column])
+
+    def set_piece(self, square, piece):
+        self.pieces[piece] |= 1 << square
+        self.occupied[piece[0]] |= 1 << square
+        self.squares[square] = piece
+
+    def remove_piece(self, square):
+        piece = self.squares[square]
+        self.pieces[piece] &= ~(1 << square)
+        self.occupied[piece[0]] &= ~(1 << square)
+        self.squares[square] = "--"
+
+    """
+    Brings the given (row, column) squares in sync with the board after a move was made or undone
+    """
+
+    def update(self, board, squares):
+        for row, column in squares:
+            square = row * 8 + column
+            if self.squares[square] != "--":
+                self.remove_piece(square)
+            if board[row][column] != "--":
+                self.set_piece(square, board[row][column])
+
+    def to_board(self):
+        return to_board(self.pieces)
+
+    """
+    Determines if the square is attacked by attacker_color, with the given occupancy (allows "removing" pieces)
+    """
+
+    def square_attacked(self, square, attacker_color, occupied=None):
+        pieces = self.pieces
+        if occupied is None:
+            occupied = self.occupied["w"] | self.occupied["b"]
+        defender_color = "b" if attacker_color == "w" else "w"
+        if PAWN_ATTACKS[defender_color][square] & pieces[attacker_color + "p"] & occupied:
+            return True
+        if KNIGHT_ATTACKS[square] & pieces[attacker_color + "N"] & occupied:
+            return True
+        if KING_ATTACKS[square] & pieces[attacker_color + "K"]:
+            return True
+        queens = pieces[attacker_color + "Q"]
+        if rook_attacks(square, occupied) & (pieces[attacker_color + "R"] | queens) & occupied:
+            return True
+        return bool(bishop_attacks(square, occupied) & (pieces[attacker_color + "B"] | queens) & occupied)
+
+    """
+    All legal moves for the side to move in game_state, returns (moves, in_check)
+    """
+
+    def get_valid_moves(self, game_state):
+        board = game_state.board
+        pieces = self.pieces
+        if game_state.white_to_move:
+            ally_color, enemy_color = "w", "b"
+        else:
+            ally_color, enemy_color = "b", "w"
+        own = self.occupied[ally_color]
+        enemy = self.occupied[enemy_color]
+        occupied = own | enemy
+        king_square = pieces[ally_color + "K"].bit_length() - 1
+        enemy_queens = pieces[enemy_color + "Q"]
+        enemy_rooks = pieces[enemy_color + "R"] | enemy_queens
+        enemy_bishops = pieces[enemy_color + "B"] | enemy_queens
+
+        checkers = (KNIGHT_ATTACKS[king_square] & pieces[enemy_color + "N"]) | \
+                   (PAWN_ATTACKS[ally_color][king_square] & pieces[enemy_color + "p"]) | \
+                   (rook_attacks(king_square, occupied) & enemy_rooks) | \
+                   (bishop_attacks(king_square, occupied) & enemy_bishops)
+        # pinned pieces: exactly one own piece between the king and an enemy slider looking at it
+        pinned = 0
+        snipers = (rook_attacks(king_square, enemy) & enemy_rooks) | (bishop_attacks(king_square, enemy) & enemy_bishops)
+        for sniper in _squares(snipers):
+            blockers = BETWEEN[king_square][sniper] & occupied
+            if blockers & own and not blockers & (blockers - 1):
+                pinned |= blockers
+
+        moves = []
+        king_row, king_column = divmod(king_square, 8)
+        occupied_without_king = occupied & ~(1 << king_square)
+        for target in _squares(KING_ATTACKS[king_square] & ~own):
+            if not self.square_attacked(target, enemy_color, occupied_without_king):
+                moves.append(Move((king_row, king_column), divmod(target, 8), board))
+        if checkers & (checkers - 1):  # double check, king has to move
+            return moves, True
+
+        if checkers:
+            checker = checkers.bit_length() - 1
+            target_mask = BETWEEN[king_square][checker] | checkers  # capture the checker or block it
+        else:
+            target_mask = FULL
+        not_own = ~own & target_mask
+
+        for piece, attacks in (("N", None), ("B", bishop_attacks), ("R", rook_attacks), ("Q", None)):
+            for square in _squares(pieces[ally_color + piece]):
+                if piece == "N":
+                    if pinned >> square & 1:
+                        continue  # pinned knight can never move
+                    targets = KNIGHT_ATTACKS[square]
+                elif piece == "Q":
+                    targets = rook_attacks(square, occupied) | bishop_attacks(square, occupied)
+                else:
+                    targets = attacks(square, occupied)
+                targets &= not_own
+                if pinned >> square & 1:
+                    targets &= LINE[king_square][square]
+                start = divmod(square, 8)
+                for target in _squares(targets):
+                    moves.append(Move(start, divmod(target, 8), board))
+
+        self.get_pawn_moves(game_state, ally_color, enemy, occupied, king_square, pinned, target_mask, moves)
+        if not checkers:
+            self.get_castle_moves(game_state, enemy_color, occupied, king_square, moves)
+        return moves, bool(checkers)
+
+    def get_pawn_moves(self, game_state, ally_color, enemy, occupied, king_square, pinned, target_mask, moves):
+        board = game_state.board
+        pawns = self.pieces[ally_color + "p"]
+        empty = ~occupied & FULL
+        if ally_color == "w":
+            single = (pawns >> 8) & empty
+            double = ((single & (0xFF << 40)) >> 8) & empty
+            left = ((pawns & ~FILE_A) >> 9) & enemy
+            right = ((pawns & ~FILE_H) >> 7) & enemy
+            push, left_offset, right_offset = -8, -9, -7
+        else:
+            single = (pawns << 8) & empty
+            double = ((single & (0xFF << 16)) << 8) & empty
+            left = ((pawns & ~FILE_A) << 7) & enemy
+            right = ((pawns & ~FILE_H) << 9) & enemy
+            push, left_offset, right_offset = 8, 7, 9
+        line = LINE[king_square]
+        for targets, offset in ((single, push), (double, 2 * push), (left, left_offset), (right, right_offset)):
+            for target in _squares(targets & target_mask):
+                square = target - offset
+                if pinned >> square & 1 and not line[square] >> target & 1:
+                    continue  # pinned pawn can only move along the pin
+                if target < 8 or target >= 56:
+                    for promotion_piece in Move.promotion_pieces:
+                        moves.append(Move(divmod(square, 8), divmod(target, 8), board, promotion_piece=promotion_piece))
+                else:
+                    moves.append(Move(divmod(square, 8), divmod(target, 8), board))
+
+        if game_state.enpassant_possible != ():
+            target = game_state.enpassant_possible[0] * 8 + game_state.enpassant_possible[1]
+            captured = target - push
+            enemy_color = "b" if ally_color == "w" else "w"
+            for square in _squares(PAWN_ATTACKS[enemy_color][target] & pawns):
+                # play the capture on the occupancy and see if the king is attacked (covers pins, checks and the
+                # two pawns leaving the same rank at once)
+                after = (occupied & ~(1 << square) & ~(1 << captured)) | (1 << target)
+                if not self.square_attacked(king_square, enemy_color, after):
+                    moves.append(Move(divmod(square, 8), divmod(target, 8), board, enpassant_possible=True))
+
+    def get_castle_moves(self, game_state, enemy_color, occupied, king_square, moves):
+        rights = game_state.current_castling_rights
+        if game_state.white_to_move:
+            king_side, queen_side = rights.white_king_side, rights.white_queen_side
+        else:
+            king_side, queen_side = rights.black_king_side, rights.black_queen_side
+        start = divmod(king_square, 8)
+        if king_side and king_square & 7 <= 5 and not (occupied >> (king_square + 1) & 3) and \
+                not self.square_attacked(king_square + 1, enemy_color) and \
+                not self.square_attacked(king_square + 2, enemy_color):
+            moves.append(Move(start, divmod(king_square + 2, 8), game_state.board, is_castle_move=True))
+        if queen_side and king_square & 7 >= 3 and not (occupied >> (king_square - 3) & 7) and \
+                not self.square_attacked(king_square - 1, enemy_color) and \
+                not self.square_attacked(king_square - 2, enemy_color):
+            moves.append(Move(start, divmod(king_square - 2, 8), game_state.board, is_castle_move=True))
@@ -1,3 +1,24 @@
+import functools
+import random
+import time
+from array import array
+from collections import OrderedDict
+
+# Offsets used by move generation and attack detection
+KNIGHT_MOVES = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+KING_MOVES = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
+BISHOP_DIRECTIONS = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # top-left, top-right, bottom-left, bottom-right
+
+# Zobrist keys, fixed seed so that position hashes are the same in every process and every run
+_zobrist_random = random.Random(20230518)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")}
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]  # indexed by CastleRights.bits()
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]  # indexed by en passant column
+
+
 class Move:
     ranks_to_rows = {
         "1": 7,
@@ -29,33 +50,67 @@ class Move:
         v: k for k, v in files_to_columns.items()  # reversing a dictionary
     }
 
-    def __init__(self, start_position, end_position, board, enpassant_possible=False, is_castle_move=False):
-        self.start_row = start_position[0]
-        self.start_column = start_position[1]
-        self.end_row = end_position[0]
-        self.end_column = end_position[1]
-        self.piece_moved = board[self.start_row][self.start_column]
-        self.piece_captured = board[self.end_row][self.end_column]
+    # Moves are created for every pseudo legal move, __slots__ keeps them small and fast to construct
+    __slots__ = ("start_row", "start_column", "end_row", "end_column", "piece_moved", "piece_captured",
+                 "is_pawn_promotion", "promotion_piece", "is_enpassant_move", "is_castle_move", "moveID")
+
+    promotion_pieces = ("Q", "R", "B", "N")  # index is part of moveID and encode(), queen is 0 (the default)
+
+    def __init__(self, start_position, end_position, board, enpassant_possible=False, is_castle_move=False,
+                 promotion_piece="Q"):
+        self.start_row = start_row = start_position[0]
+        self.start_column = start_column = start_position[1]
+        self.end_row = end_row = end_position[0]
+        self.end_column = end_column = end_position[1]
+        self.piece_moved = piece_moved = board[start_row][start_column]
         #  pawn promotion
-        self.is_pawn_promotion = False
-        if (self.piece_moved == "wp" and self.end_row == 0) or (self.piece_moved == "bp" and self.end_row == 7):
-            self.is_pawn_promotion = True
+        self.is_pawn_promotion = (piece_moved == "wp" and end_row == 0) or (piece_moved == "bp" and end_row == 7)
+        self.promotion_piece = promotion_piece if self.is_pawn_promotion else None
 
         #  en passant
         self.is_enpassant_move = enpassant_possible
-        # if self.piece_moved[1] == "p" and (self.end_row, self.end_column) == enpassant_possible:
-        #    self.is_enpassant_move = True
-        if self.is_enpassant_move:
-            self.piece_captured = "wp" if self.piece_moved == "bp" else "bp"
+        if enpassant_possible:
+            self.piece_captured = "wp" if piece_moved == "bp" else "bp"
+        else:
+            self.piece_captured = board[end_row][end_column]
 
-        self.moveID = self.start_row * 1000 + self.start_column * 100 + self.end_row * 10 + self.end_column
+        self.moveID = start_row * 1000 + start_column * 100 + end_row * 10 + end_column
+        if self.is_pawn_promotion and promotion_piece != "Q":  # under promotions are different moves
+            self.moveID += 10000 * self.promotion_pieces.index(promotion_piece)
 
         # castle move
         self.is_castle_move = is_castle_move
 
+    """
+    Packs the move into a 16 bit int: bits 0-5 start square, bits 6-11 end square (square = row * 8 + column),
+    bits 12-13 promotion piece (index in promotion_pieces), bit 14 en passant, bit 15 castle move.
+    Whether the move is a promotion follows from the board, so it doesn't need a bit of its own.
+    """
+
+    def encode(self):
+        flags = (self.promotion_pieces.index(self.promotion_piece) if self.is_pawn_promotion else 0) | \
+                (4 if self.is_enpassant_move else 0) | (8 if self.is_castle_move else 0)
+        return (self.start_row * 8 + self.start_column) | (self.end_row * 8 + self.end_column) << 6 | flags << 12
+
+    """
+    Rebuilds a move packed by encode() for the position on the given board
+    """
+
+    @classmethod
+    def decode(cls, code, board):
+        start_square = code & 63
+        end_square = code >> 6 & 63
+        return cls((start_square >> 3, start_square & 7), (end_square >> 3, end_square & 7), board,
+                   enpassant_possible=bool(code >> 12 & 4), is_castle_move=bool(code >> 12 & 8),
+                   promotion_piece=cls.promotion_pieces[code >> 12 & 3])
+
     def get_chess_notation(self):
-        # Note this is not real chess notation, but simplification
-        return self.get_rank_file(self.start_row, self.start_column) + self.get_rank_file(self.end_row, self.end_column)
+        # Note this is not real chess notation, but simplification (long algebraic, promotion piece in lower case)
+        notation = self.get_rank_file(self.start_row, self.start_column) + \
+            self.get_rank_file(self.end_row, self.end_column)
+        if self.is_pawn_promotion:
+            notation += self.promotion_piece.lower()
+        return notation
 
     def get_rank_file(self, row, column):
         return self.columns_to_files[column] + self.rows_to_ranks[row]
@@ -65,6 +120,9 @@ class Move:
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        return self.moveID  # consistent with __eq__, so moves can be used in sets and as dictionary keys
+
 
 class CastleRights:
     def __init__(self, white_king_side, black_king_side, white_queen_side, black_queen_side):
@@ -73,6 +131,258 @@ class CastleRights:
         self.white_queen_side = white_queen_side
         self.black_queen_side = black_queen_side
 
+    """
+    Castling rights as a 4 bit int (1 - white king side, 2 - white queen side, 4 - black king side,
+    8 - black queen side)
+    """
+
+    def bits(self):
+        return (1 if self.white_king_side else 0) | (2 if self.white_queen_side else 0) | \
+               (4 if self.black_king_side else 0) | (8 if self.black_queen_side else 0)
+
+    """
+    Sets the rights from bits() in place
+    """
+
+    def set_bits(self, bits):
+        self.white_king_side = bits & 1 != 0
+        self.white_queen_side = bits & 2 != 0
+        self.black_king_side = bits & 4 != 0
+        self.black_queen_side = bits & 8 != 0
+
+    def copy(self):
+        return CastleRights(self.white_king_side, self.black_king_side, self.white_queen_side, self.black_queen_side)
+
+
+"""
+Returns bitmap of squares attacked by the piece at (row, column), square (row, column) is bit row * 8 + column.
+Sliding pieces attack up to and including the first occupied square in each direction.
+"""
+
+
+def piece_attack_bitmap(board, row, column):
+    piece = board[row][column]
+    bitmap = 0
+    if piece[1] == "p":
+        end_row = row - 1 if piece[0] == "w" else row + 1
+        if 0 <= end_row < 8:
+            if column > 0:
+                bitmap |= 1 << (end_row * 8 + column - 1)
+            if column < 7:
+                bitmap |= 1 << (end_row * 8 + column + 1)
+    elif piece[1] == "N" or piece[1] == "K":
+        for move in (KNIGHT_MOVES if piece[1] == "N" else KING_MOVES):
+            end_row = row + move[0]
+            end_column = column + move[1]
+            if 0 <= end_row < 8 and 0 <= end_column < 8:
+                bitmap |= 1 << (end_row * 8 + end_column)
+    else:
+        if piece[1] == "R":
+            directions = ROOK_DIRECTIONS
+        elif piece[1] == "B":
+            directions = BISHOP_DIRECTIONS
+        else:
+            directions = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+        for direction in directions:
+            end_row = row + direction[0]
+            end_column = column + direction[1]
+            while 0 <= end_row < 8 and 0 <= end_column < 8:
+                bitmap |= 1 << (end_row * 8 + end_column)
+                if board[end_row][end_column] != "--":
+                    break
+                end_row += direction[0]
+                end_column += direction[1]
+    return bitmap
+
+
+"""
+Squares whose content is changed by making (or undoing) the move
+"""
+
+
+def squares_changed_by(move):
+    squares = [(move.start_row, move.start_column), (move.end_row, move.end_column)]
+    if move.is_enpassant_move:
+        squares.append((move.start_row, move.end_column))
+    elif move.is_castle_move:
+        if move.end_column - move.start_column == 2:  # king side
+            squares += [(move.end_row, move.end_column + 1), (move.end_row, move.end_column - 1)]
+        else:  # queen side
+            squares += [(move.end_row, move.end_column - 2), (move.end_row, move.end_column + 1)]
+    return squares
+
+
+"""
+Attack bitmaps for both sides, kept per piece so that a move only recomputes the pieces it affects:
+pieces on the squares the move changed, and sliders whose rays pass through those squares.
+"""
+
+
+class AttackMap:
+    def __init__(self, board):
+        self.piece_attacks = {}  # (row, column) -> (color, attack bitmap of the piece on that square)
+        for row in range(8):
+            for column in range(8):
+                if board[row][column] != "--":
+                    self.piece_attacks[(row, column)] = (board[row][column][0],
+                                                         piece_attack_bitmap(board, row, column))
+
+    def update(self, board, squares):
+        changed = 0
+        for row, column in squares:
+            changed |= 1 << (row * 8 + column)
+            if board[row][column] == "--":
+                self.piece_attacks.pop((row, column), None)
+            else:
+                self.piece_attacks[(row, column)] = (board[row][column][0],
+                                                     piece_attack_bitmap(board, row, column))
+        # sliders that see a changed square were blocked or unblocked by the move
+        for square, (color, bitmap) in self.piece_attacks.items():
+            if bitmap & changed and board[square[0]][square[1]][1] in "RBQ":
+                self.piece_attacks[square] = (color, piece_attack_bitmap(board, square[0], square[1]))
+
+    def attacks(self, color):
+        bitmap = 0
+        for piece_color, piece_bitmap in self.piece_attacks.values():
+            if piece_color == color:
+                bitmap |= piece_bitmap
+        return bitmap
+
+
+"""
+LRU cache of legal moves by Zobrist key. Castling rights, the en passant file and the side to move are part of
+the key, so positions that differ in any of them never share an entry.
+Entries hold (moves as a tuple, in check). A pickled cache (game state sent to another process) arrives empty.
+"""
+
+
+class MoveCache:
+    DEFAULT_CAPACITY = 4096
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getstate__(self):
+        return {"capacity": self.capacity}
+
+    def __setstate__(self, state):
+        self.__init__(state["capacity"])
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    """
+    Entry for key without counting it or changing its place in the LRU order
+    """
+
+    def peek(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, moves, in_check):
+        self.entries[key] = (tuple(moves), in_check)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"capacity": self.capacity, "size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+"""
+State of the positions before each move made, for undo_move(): one fixed size record per ply, stored in
+preallocated typed arrays (captured piece code, castling bits, en passant square, Zobrist key, halfmove clock),
+so making and undoing moves doesn't create objects. The arrays double when a game gets longer than the capacity.
+En passant square is row * 8 + column, -1 when there is none.
+"""
+
+
+class UndoStack:
+    PIECES = ("--", "wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+    PIECE_CODES = {piece: code for code, piece in enumerate(PIECES)}
+    ENPASSANT_SQUARES = tuple((square >> 3, square & 7) for square in range(64))  # square -> enpassant_possible
+    DEFAULT_CAPACITY = 256
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.size = 0
+        self.captured = array("b", bytes(capacity))
+        self.castling = array("b", bytes(capacity))
+        self.enpassant = array("b", bytes(capacity))
+        self.zobrist_keys = array("Q", bytes(8 * capacity))
+        self.halfmove_clocks = array("I", bytes(4 * capacity))
+        self.repetition_starts = array("I", bytes(4 * capacity))
+
+    def __len__(self):
+        return self.size
+
+    def grow(self):
+        for column in (self.captured, self.castling, self.enpassant, self.zobrist_keys, self.halfmove_clocks,
+                       self.repetition_starts):
+            column.frombytes(bytes(len(column) * column.itemsize))  # appends as many zeros as there are
+
+    def push(self, captured, castling, enpassant, zobrist_key, halfmove_clock, repetition_start):
+        ply = self.size
+        if ply == len(self.zobrist_keys):
+            self.grow()
+        self.captured[ply] = self.PIECE_CODES[captured]
+        self.castling[ply] = castling
+        self.enpassant[ply] = enpassant
+        self.zobrist_keys[ply] = zobrist_key
+        self.halfmove_clocks[ply] = halfmove_clock
+        self.repetition_starts[ply] = repetition_start
+        self.size = ply + 1
+
+
+FEN_PIECES = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+              "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+
+"""
+Board row for one rank of FEN piece placement. The same ranks turn up over and over in large position sets
+("8", "pppppppp", ...), so parsed ranks are cached.
+"""
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_fen_rank(rank):
+    row = []
+    for character in rank:
+        if character in FEN_PIECES:
+            row.append(FEN_PIECES[character])
+        elif "1" <= character <= "8":
+            row += ["--"] * int(character)
+        else:
+            raise ValueError("Invalid character in FEN rank: {!r}".format(rank))
+    if len(row) != 8:
+        raise ValueError("FEN rank must have 8 squares: {!r}".format(rank))
+    return tuple(row)
+
+
+@functools.lru_cache(maxsize=16384)
+def fen_rank_zobrist_key(rank, row):
+    key = 0
+    for column, piece in enumerate(parse_fen_rank(rank)):
+        if piece != "--":
+            key ^= ZOBRIST_PIECES[piece][row * 8 + column]
+    return key
+
 
 """
 Chess engine is responsible for storing all information about chess game.
@@ -86,7 +396,7 @@ class Game_state:
         # Board is represented with 2D array of strings. Blank position is denoted by "--" string.
         # Regularly, position is denoted with two letters. First letter (b or w) stands for color
         # Second letter is the piece (Rook, Knight, Bishop, Queen, King)
-        self.board = [
+        board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
             ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
             ["--", "--", "--", "--", "--", "--", "--", "--"],
@@ -97,6 +407,91 @@ class Game_state:
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]
         ]
 
+        self.set_up_position(board, True, CastleRights(True, True, True, True), (), 0, 1)
+
+    """
+    Creates a game state from a FEN string (piece placement, side to move, castling rights, en passant square
+    and optionally halfmove clock and fullmove number). Raises ValueError for malformed FEN.
+    """
+
+    @classmethod
+    def from_fen(cls, fen):
+        fields = fen.split()
+        if len(fields) != 6 and len(fields) != 4:
+            raise ValueError("FEN must have 4 or 6 fields: {!r}".format(fen))
+        ranks = fields[0].split("/")
+        if len(ranks) != 8:
+            raise ValueError("FEN piece placement must have 8 ranks: {!r}".format(fen))
+        board = []
+        key = 0
+        for row in range(8):
+            board.append(list(parse_fen_rank(ranks[row])))
+            key ^= fen_rank_zobrist_key(ranks[row], row)
+        if fields[1] == "w":
+            white_to_move = True
+        elif fields[1] == "b":
+            white_to_move = False
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        else:
+            raise ValueError("FEN side to move must be 'w' or 'b': {!r}".format(fen))
+        castling = fields[2]
+        if castling.strip("KQkq") != "" and castling != "-":
+            raise ValueError("Invalid FEN castling rights: {!r}".format(fen))
+        castle_rights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        key ^= ZOBRIST_CASTLING[castle_rights.bits()]
+        if fields[3] == "-":
+            enpassant_possible = ()
+        elif len(fields[3]) == 2 and fields[3][0] in Move.files_to_columns and fields[3][1] in "36":
+            enpassant_possible = (Move.ranks_to_rows[fields[3][1]], Move.files_to_columns[fields[3][0]])
+            key ^= ZOBRIST_ENPASSANT[enpassant_possible[1]]
+        else:
+            raise ValueError("Invalid FEN en passant square: {!r}".format(fen))
+        halfmove_clock, fullmove_number = (int(fields[4]), int(fields[5])) if len(fields) == 6 else (0, 1)
+
+        game_state = cls.__new__(cls)  # skip __init__, it would set up the starting position first
+        game_state.set_up_position(board, white_to_move, castle_rights, enpassant_possible, halfmove_clock,
+                                   fullmove_number, key)
+        if game_state.white_king_location is None or game_state.black_king_location is None:
+            raise ValueError("FEN must have a king of each color: {!r}".format(fen))
+        return game_state
+
+    """
+    FEN string of the current position
+    """
+
+    def to_fen(self):
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                else:
+                    if empty:
+                        rank += str(empty)
+                        empty = 0
+                    rank += piece[1].lower() if piece[0] == "b" else piece[1].upper()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.current_castling_rights
+        castling = ("K" if rights.white_king_side else "") + ("Q" if rights.white_queen_side else "") + \
+                   ("k" if rights.black_king_side else "") + ("q" if rights.black_queen_side else "")
+        if self.enpassant_possible != ():
+            enpassant = Move.columns_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        else:
+            enpassant = "-"
+        return "{} {} {} {} {} {}".format("/".join(ranks), "w" if self.white_to_move else "b", castling or "-",
+                                          enpassant, self.halfmove_clock, self.fullmove_number)
+
+    """
+    Initializes all state for the position on board, zobrist_key is computed if not given
+    """
+
+    def set_up_position(self, board, white_to_move, castle_rights, enpassant_possible, halfmove_clock,
+                        fullmove_number, zobrist_key=None):
+        self.board = board
         self.moveFunctions = {
             'p': self.get_pawn_moves,
             'R': self.get_rook_moves,
@@ -105,27 +500,72 @@ class Game_state:
             'Q': self.get_queen_moves,
             'K': self.get_king_moves
         }
-        self.white_to_move = True
+        self.white_to_move = white_to_move
         self.game_log = []
 
         # Check for pinned pieces, for simplicity and efficiency king position is tracked
-        self.white_king_location = (7, 4)
-        self.black_king_location = (0, 4)
+        self.white_king_location = None
+        self.black_king_location = None
+        for row in range(8):
+            if "wK" in board[row]:
+                self.white_king_location = (row, board[row].index("wK"))
+            if "bK" in board[row]:
+                self.black_king_location = (row, board[row].index("bK"))
 
         self.check_mate = False
         self.stale_mate = False
-        self.enpassant_possible = ()  # coordinates for the square where en passant capture is possible
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.white_king_side,
-                                               self.current_castling_rights.black_king_side,
-                                               self.current_castling_rights.white_queen_side,
-                                               self.current_castling_rights.black_king_side)]
+        self.pins = {}  # pinned pieces of the side to move, filled in only during legal move generation
+        self.attack_map = None  # optional incrementally maintained AttackMap, see enable_attack_map()
+        self.bitboards = None  # optional bitboard backend for move generation, see enable_bitboards()
+        self.move_cache = MoveCache()  # legal moves of recently seen positions, see enable_move_cache()
+        self.profiler = None  # optional ChessProfiler.Profiler counting hot path calls, see enable_profiler()
+        self.enpassant_possible = enpassant_possible  # coordinates for the square where en passant capture is possible
+        self.current_castling_rights = castle_rights  # updated in place by make_move and undo_move
+        # halfmove clock counts moves since the last capture or pawn move, fullmove number starts at 1
+        # and increases after every black move
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.zobrist_key = self.compute_zobrist_key() if zobrist_key is None else zobrist_key
+        self.undo_stack = UndoStack()  # state of the positions before the moves in game_log
+        # times each Zobrist key occurred in the game, kept by make_move and undo_move so that most positions are
+        # known not to repeat without looking at the history
+        self.position_counts = {self.zobrist_key: 1}
+        # ply of the first position since the last capture or pawn move, positions before it can't occur again
+        self.repetition_start = 0
 
     """
-    Takes a Move as parameter and executes it (this will not work for castling, pawn promotion, en-passant)
+    Takes a Move as parameter and executes it (including castling, pawn promotion and en-passant)
     """
 
     def make_move(self, move: Move):
+        if self.profiler is not None:
+            self.profiler.counters["make_move"] += 1
+        # Zobrist key is updated from the move itself: remove the moved and captured pieces, add the piece placed
+        key = self.zobrist_key ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.piece_moved][move.start_row * 8 + move.start_column]
+        if move.is_enpassant_move:
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.start_row * 8 + move.end_column]
+        elif move.piece_captured != "--":
+            key ^= ZOBRIST_PIECES[move.piece_captured][move.end_row * 8 + move.end_column]
+        placed_piece = move.piece_moved[0] + move.promotion_piece if move.is_pawn_promotion else move.piece_moved
+        key ^= ZOBRIST_PIECES[placed_piece][move.end_row * 8 + move.end_column]
+        castling = self.current_castling_rights.bits()
+        key ^= ZOBRIST_CASTLING[castling]
+        if self.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+            enpassant = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+        else:
+            enpassant = -1
+        self.undo_stack.push(move.piece_captured, castling, enpassant, self.zobrist_key, self.halfmove_clock,
+                             self.repetition_start)
+        if move.piece_moved[1] == "p" or move.piece_captured != "--":
+            self.halfmove_clock = 0
+            self.repetition_start = self.undo_stack.size
+        else:
+            self.halfmove_clock += 1
+        if move.piece_moved[0] == "b":
+            self.fullmove_number += 1
+
         self.board[move.start_row][move.start_column] = "--"
         self.board[move.end_row][move.end_column] = move.piece_moved
         self.game_log.append(move)  # logs moves for undoing or history
@@ -140,7 +580,7 @@ class Game_state:
         if move.is_pawn_promotion:
             # NOTE: Here is not the best place to ask user for piece selection because of legal move generation(check
             # for checks)
-            self.board[move.end_row][move.end_column] = move.piece_moved[0] + "Q"
+            self.board[move.end_row][move.end_column] = move.piece_moved[0] + move.promotion_piece
 
         # en passant
         if move.is_enpassant_move:
@@ -149,6 +589,7 @@ class Game_state:
         # update en passant possible variable
         if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # only on 2 square advance
             self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_column)
+            key ^= ZOBRIST_ENPASSANT[move.start_column]
         else:
             self.enpassant_possible = ()
 
@@ -157,18 +598,25 @@ class Game_state:
             if move.end_column - move.start_column == 2: #king side castle
                 self.board[move.end_row][move.end_column - 1] = self.board[move.end_row][move.end_column + 1] # copies the rook in new square
                 self.board[move.end_row][move.end_column + 1] = "--" # erase the old rook
+                rook_squares = (move.end_row * 8 + move.end_column + 1, move.end_row * 8 + move.end_column - 1)
             else:  # queen side castle
                 self.board[move.end_row][move.end_column + 1] = self.board[move.end_row][move.end_column - 2] # copies the rook in new square
-                self.board[move.end_column][move.end_column - 2] = "--" # erase the old rook
+                self.board[move.end_row][move.end_column - 2] = "--" # erase the old rook
+                rook_squares = (move.end_row * 8 + move.end_column - 2, move.end_row * 8 + move.end_column + 1)
+            rook_keys = ZOBRIST_PIECES[move.piece_moved[0] + "R"]
+            key ^= rook_keys[rook_squares[0]] ^ rook_keys[rook_squares[1]]
+
+        if self.attack_map is not None:
+            self.attack_map.update(self.board, squares_changed_by(move))
+        if self.bitboards is not None:
+            self.bitboards.update(self.board, squares_changed_by(move))
 
         # update castling rights - whenever a king or rook move
         self.update_castle_rights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.white_king_side,
-                                                   self.current_castling_rights.black_king_side,
-                                                   self.current_castling_rights.white_queen_side,
-                                                   self.current_castling_rights.black_king_side))
-
-
+        key ^= ZOBRIST_CASTLING[self.current_castling_rights.bits()]
+        self.zobrist_key = key
+        position_counts = self.position_counts
+        position_counts[key] = position_counts.get(key, 0) + 1
 
     """
     Undo the last move
@@ -176,9 +624,14 @@ class Game_state:
 
     def undo_move(self):
         if len(self.game_log) != 0:  # make sure there is a move to undo
+            if self.profiler is not None:
+                self.profiler.counters["undo_move"] += 1
             move = self.game_log.pop()
+            undo_stack = self.undo_stack
+            ply = undo_stack.size = undo_stack.size - 1
+            piece_captured = UndoStack.PIECES[undo_stack.captured[ply]]
             self.board[move.start_row][move.start_column] = move.piece_moved
-            self.board[move.end_row][move.end_column] = move.piece_captured
+            self.board[move.end_row][move.end_column] = piece_captured
             self.white_to_move = not self.white_to_move  # switch turns back
             # update kings locations
             if move.piece_moved == "wK":
@@ -189,16 +642,22 @@ class Game_state:
             # undo en passant move
             if move.is_enpassant_move:
                 self.board[move.end_row][move.end_column] = "--"
-                self.board[move.start_row][move.end_column] = move.piece_captured
-                self.enpassant_possible = (move.end_row, move.end_column)
-            # undo a 2 pawn square advance
-            if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:
-                self.enpassant_possible = ()
-
-            # undo castling rights
-            self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            castle_rights = self.castle_rights_log[-1]
-            self.current_castling_rights = castle_rights  # set the current castle rights to the last one in the list
+                self.board[move.start_row][move.end_column] = piece_captured
+            # en passant square, castling rights, key and clock of the previous position (after any move,
+            # not just en passant, a 2 square advance or a king or rook move)
+            enpassant = undo_stack.enpassant[ply]
+            self.enpassant_possible = UndoStack.ENPASSANT_SQUARES[enpassant] if enpassant >= 0 else ()
+            self.current_castling_rights.set_bits(undo_stack.castling[ply])
+            count = self.position_counts[self.zobrist_key] - 1
+            if count:
+                self.position_counts[self.zobrist_key] = count
+            else:
+                del self.position_counts[self.zobrist_key]
+            self.zobrist_key = undo_stack.zobrist_keys[ply]
+            self.halfmove_clock = undo_stack.halfmove_clocks[ply]
+            self.repetition_start = undo_stack.repetition_starts[ply]
+            if move.piece_moved[0] == "b":
+                self.fullmove_number -= 1
 
             # undo castle move
             if move.is_castle_move:
@@ -209,6 +668,143 @@ class Game_state:
                     self.board[move.end_row][move.end_column - 2] = self.board[move.end_row][move.end_column + 1]
                     self.board[move.end_row][move.end_column + 1] = "--"
 
+            if self.attack_map is not None:
+                self.attack_map.update(self.board, squares_changed_by(move))
+            if self.bitboards is not None:
+                self.bitboards.update(self.board, squares_changed_by(move))
+
+    """
+    Times the current position occurred since the last capture or pawn move, this time included. The first
+    position after a double pawn push counts as the same position when its en passant capture isn't legal.
+    """
+
+    def repetition_count(self):
+        if self.enpassant_possible != ():
+            return 1  # a double pawn push starts the window
+        key = self.zobrist_key
+        undo_stack = self.undo_stack
+        start = self.repetition_start
+        count = 1
+        if self.position_counts[key] > 1:
+            zobrist_keys = undo_stack.zobrist_keys
+            for ply in range(undo_stack.size - 2, start - 1, -2):
+                if zobrist_keys[ply] == key:
+                    count += 1
+        if start < undo_stack.size:
+            enpassant = undo_stack.enpassant[start]
+            if enpassant >= 0 and undo_stack.zobrist_keys[start] ^ ZOBRIST_ENPASSANT[enpassant & 7] == key and \
+                    not self.enpassant_capture_legal(UndoStack.ENPASSANT_SQUARES[enpassant]):
+                count += 1
+        return count
+
+    """
+    Whether the current position occurred before, the search scores it as a draw (repeating once more can't
+    be prevented by the side that is worse off)
+    """
+
+    def is_repetition(self):
+        return self.repetition_count() > 1
+
+    """
+    Neither side can checkmate: kings only, a single knight or bishop, or bishops all on squares of one color
+    """
+
+    def insufficient_material(self):
+        minor_pieces = []
+        for row in range(8):
+            for column, piece in enumerate(self.board[row]):
+                kind = piece[1]
+                if kind in "pRQ":
+                    return False
+                if kind in "NB":
+                    minor_pieces.append((kind, (row + column) % 2))
+        if len(minor_pieces) <= 1:
+            return True
+        return all(kind == "B" for kind, _ in minor_pieces) and len({color for _, color in minor_pieces}) == 1
+
+    """
+    Draw the position is in apart from stalemate: "threefold repetition", "fifty move rule" (100 plies without
+    a capture or pawn move), "insufficient material", or None. Checkmate and stalemate come first, they are
+    known only after get_valid_moves().
+    """
+
+    def draw_reason(self):
+        if self.repetition_count() >= 3:
+            return "threefold repetition"
+        if self.halfmove_clock >= 100:
+            return "fifty move rule"
+        if self.insufficient_material():
+            return "insufficient material"
+        return None
+
+    """
+    64 bit Zobrist key of the current position (pieces, side to move, castling rights and en passant square)
+    """
+
+    def hash(self):
+        return self.zobrist_key
+
+    """
+    Whether the side to move can capture en passant: a pawn next to the pawn that just advanced two squares,
+    and the capture doesn't leave the own king attacked. enpassant_square is enpassant_possible unless given.
+    """
+
+    def enpassant_capture_legal(self, enpassant_square=None):
+        if enpassant_square is None:
+            enpassant_square = self.enpassant_possible
+        if enpassant_square == ():
+            return False
+        row, column = enpassant_square
+        if self.white_to_move:
+            pawn, pawn_row = "wp", row + 1
+            king_row, king_column = self.white_king_location
+        else:
+            pawn, pawn_row = "bp", row - 1
+            king_row, king_column = self.black_king_location
+        board = self.board
+        bitboards, self.bitboards = self.bitboards, None  # the attack test has to see the board changed below
+        try:
+            for start_column in (column - 1, column + 1):
+                if 0 <= start_column < 8 and board[pawn_row][start_column] == pawn:
+                    captured = board[pawn_row][column]
+                    board[pawn_row][start_column] = board[pawn_row][column] = "--"
+                    board[row][column] = pawn
+                    legal = not self.square_under_attack(king_row, king_column)
+                    board[row][column] = "--"
+                    board[pawn_row][start_column], board[pawn_row][column] = pawn, captured
+                    if legal:
+                        return True
+        finally:
+            self.bitboards = bitboards
+        return False
+
+    """
+    Zobrist key with the en passant square only when an en passant capture is legal (as in Polyglot keys), so
+    positions FIDE treats as the same have the same key. hash() keeps the square after every double pawn push.
+    """
+
+    def position_key(self):
+        if self.enpassant_possible == () or self.enpassant_capture_legal():
+            return self.zobrist_key
+        return self.zobrist_key ^ ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+
+    """
+    Computes the Zobrist key of the current position from scratch, make_move and undo_move keep it up to date
+    """
+
+    def compute_zobrist_key(self):
+        key = 0
+        for row in range(8):
+            for column in range(8):
+                piece = self.board[row][column]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + column]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        if self.enpassant_possible != ():
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        return key ^ ZOBRIST_CASTLING[self.current_castling_rights.bits()]
+
     """
     Update the castle rights given the move
     """
@@ -232,51 +828,50 @@ class Game_state:
                     self.current_castling_rights.black_queen_side = False
                 elif move.start_column == 7:  # right rook
                     self.current_castling_rights.black_king_side = False
+        # capturing a rook on its starting square takes away the castling right of that rook
+        if move.piece_captured == "wR" and move.end_row == 7:
+            if move.end_column == 0:
+                self.current_castling_rights.white_queen_side = False
+            elif move.end_column == 7:
+                self.current_castling_rights.white_king_side = False
+        elif move.piece_captured == "bR" and move.end_row == 0:
+            if move.end_column == 0:
+                self.current_castling_rights.black_queen_side = False
+            elif move.end_column == 7:
+                self.current_castling_rights.black_king_side = False
 
     """
-    All moves considering checks.
-    Basic algorithm is the following:
-    - get all possible moves
-    - for each possible move, check to see if it is a valid move by doing the following:
-        - make the move
-        - generate all possible moves for the opposing player
-        - see if any of the moves attack your king
-        - if your king is safe, it is a valid move and add it to a list
-    - return the list of valid moves only
+    All moves considering checks, also updates check_mate and stale_mate.
+    Positions in the move cache aren't generated again, otherwise the bitboard backend is used if it is enabled,
+    or the board based generator below.
     """
 
     def get_valid_moves(self):
-        # Naive algorithm (very inefficient)
-
-        # Since generating moves changes en_passant_possible variable
-        # it is crucial to save its state and return it back after move generation
-        temp_enpassant_possible = self.enpassant_possible
-        temp_castle_rights = CastleRights(self.current_castling_rights.white_king_side,
-                                          self.current_castling_rights.black_king_side,
-                                          self.current_castling_rights.white_queen_side,
-                                          self.current_castling_rights.black_queen_side)
-        # Generate all possible moves
-        moves = self.get_all_possible_moves()
-        if self.white_to_move:
-            self.get_castle_moves(self.white_king_location[0], self.white_king_location[1], moves)
+        profiler = self.profiler
+        if profiler is not None:
+            start = time.perf_counter()
+        cached = self.move_cache.get(self.zobrist_key) if self.move_cache is not None else None
+        if cached is not None:
+            moves, in_check = list(cached[0]), cached[1]  # callers get their own list, the entry stays as it is
         else:
-            self.get_castle_moves(self.black_king_location[0], self.black_king_location[1], moves)
-        # For each move, make a move
-        # We will be removing items from list, to avoid bugs (because indices will shift) we iterate on reverse order
-        for i in range(len(moves) - 1, -1, -1):
-            self.make_move(moves[i])
-
-            # Generate all of my opponents moves, and for each check if they can attack your king
-            self.white_to_move = not self.white_to_move  # make_move() method switches turns internally!
-            if self.in_check():
-                # If here we are in check this is not a valid move! We need to remove it from valid moves
-                moves.remove(moves[i])
-            self.white_to_move = not self.white_to_move
-            self.undo_move()
+            if self.bitboards is not None:
+                moves, in_check = self.bitboards.get_valid_moves(self)
+            else:
+                moves, in_check = self.get_valid_moves_from_board()
+            if self.move_cache is not None:
+                self.move_cache.put(self.zobrist_key, moves, in_check)
+        if profiler is not None:
+            if cached is not None:
+                profiler.counters["cache_hits"] += 1
+            else:
+                profiler.counters["moves_generated"] += len(moves)
+                if self.move_cache is not None:
+                    profiler.counters["cache_misses"] += 1
+            profiler.add_time("get_valid_moves", time.perf_counter() - start)
 
         # Check for checkmate or stalemate (if there are no valid moves)
         if len(moves) == 0:
-            if self.in_check():
+            if in_check:
                 self.check_mate = True
             else:
                 self.stale_mate = True
@@ -284,34 +879,268 @@ class Game_state:
             self.check_mate = False
             self.stale_mate = False
 
-        self.enpassant_possible = temp_enpassant_possible  # return saved state
-        self.current_castling_rights = temp_castle_rights
         return moves
 
+    """
+    Legal move generation on the 8x8 board, returns (moves, in_check).
+    Instead of making every possible move and looking for replies that capture the king, checks and pins are
+    computed once by scanning outward from the king:
+    - pieces pinned to the king may only move along the pin ray
+    - in double check only the king may move
+    - in single check a move must capture the checking piece or block the ray between it and the king
+    - king moves (and castling) are only allowed to squares that are not attacked
+    - en passant is validated separately, since it removes two pieces from the same rank at once
+    """
+
+    def get_valid_moves_from_board(self):
+        in_check, self.pins, checks = self.check_for_pins_and_checks()
+        if self.white_to_move:
+            king_row, king_column = self.white_king_location
+        else:
+            king_row, king_column = self.black_king_location
+
+        if in_check:
+            if len(checks) == 1:  # only one check, block the check, capture the checker or move the king
+                moves = self.get_all_possible_moves()
+                check_row, check_column, direction_row, direction_column = checks[0]
+                if self.board[check_row][check_column][1] == "N":  # knight must be captured or king must move
+                    valid_squares = {(check_row, check_column)}
+                else:  # any square between the king and the checking piece (checker included)
+                    valid_squares = set()
+                    for i in range(1, 8):
+                        square = (king_row + direction_row * i, king_column + direction_column * i)
+                        valid_squares.add(square)
+                        if square == (check_row, check_column):
+                            break
+                # King moves and en passant captures are already fully validated by their generators
+                moves = [move for move in moves if move.piece_moved[1] == "K" or move.is_enpassant_move or
+                         (move.end_row, move.end_column) in valid_squares]
+            else:  # double check, king has to move
+                moves = []
+                self.get_king_moves(king_row, king_column, moves)
+        else:
+            moves = self.get_all_possible_moves()
+            self.get_castle_moves(king_row, king_column, moves)
+        self.pins = {}  # pins only restrict the side to move while its legal moves are generated
+        return moves, in_check
+
+    """
+    Scans outward from the king of the side to move and returns (in_check, pins, checks).
+    pins maps the square of a pinned piece to the direction of the pin (from the king outwards),
+    checks is a list of (row, column, direction_row, direction_column) tuples for every checking piece.
+    """
+
+    def check_for_pins_and_checks(self):
+        pins = {}
+        checks = []
+        in_check = False
+        if self.white_to_move:
+            enemy_color = "b"
+            ally_color = "w"
+            start_row, start_column = self.white_king_location
+        else:
+            enemy_color = "w"
+            ally_color = "b"
+            start_row, start_column = self.black_king_location
+        # first four directions are orthogonal (rook like), last four are diagonal (bishop like)
+        directions = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+        for j in range(8):
+            direction = directions[j]
+            possible_pin = ()  # reset possible pins
+            for i in range(1, 8):
+                end_row = start_row + direction[0] * i
+                end_column = start_column + direction[1] * i
+                if not (0 <= end_row < 8 and 0 <= end_column < 8):
+                    break  # off board
+                end_piece = self.board[end_row][end_column]
+                if end_piece[0] == ally_color and end_piece[1] != "K":  # king is ignored so it can be "moved" away
+                    if possible_pin == ():  # first allied piece could be pinned
+                        possible_pin = (end_row, end_column)
+                    else:  # second allied piece, so no pin or check possible in this direction
+                        break
+                elif end_piece[0] == enemy_color:
+                    piece_type = end_piece[1]
+                    # Enemy piece attacks the king if it is:
+                    # - a rook orthogonally or a bishop diagonally (any distance)
+                    # - a pawn one square diagonally in front of the king (depends on pawn color)
+                    # - a queen in any direction (any distance)
+                    # - a king one square away in any direction
+                    if (j <= 3 and piece_type == "R") or (4 <= j and piece_type == "B") or \
+                            (i == 1 and piece_type == "p" and ((enemy_color == "w" and 6 <= j <= 7) or
+                                                               (enemy_color == "b" and 4 <= j <= 5))) or \
+                            piece_type == "Q" or (i == 1 and piece_type == "K"):
+                        if possible_pin == ():  # no piece blocking, so check
+                            in_check = True
+                            checks.append((end_row, end_column, direction[0], direction[1]))
+                        else:  # piece blocking, so pin
+                            pins[possible_pin] = direction
+                    break  # enemy piece blocks any further attack in this direction
+        # knight checks
+        for move in KNIGHT_MOVES:
+            end_row = start_row + move[0]
+            end_column = start_column + move[1]
+            if 0 <= end_row < 8 and 0 <= end_column < 8:
+                end_piece = self.board[end_row][end_column]
+                if end_piece[0] == enemy_color and end_piece[1] == "N":
+                    in_check = True
+                    checks.append((end_row, end_column, move[0], move[1]))
+        return in_check, pins, checks
+
+    """
+    Determines if the king of the side to move would be safe on the square at position (row, column)
+    """
+
+    def king_square_is_safe(self, row, column):
+        if self.white_to_move:
+            king_row, king_column = self.white_king_location
+        else:
+            king_row, king_column = self.black_king_location
+        king = self.board[king_row][king_column]
+        self.board[king_row][king_column] = "--"  # king must not shield the square it is moving to from sliders
+        under_attack = self.square_under_attack(row, column)
+        self.board[king_row][king_column] = king
+        return not under_attack
+
+    """
+    Determines if en passant capture of the pawn at (row, end_column) by the pawn at (row, column) leaves the king safe.
+    Two pawns leave the same rank at once, which can expose the king to a rook or queen (not detectable as a pin).
+    """
+
+    def enpassant_is_safe(self, row, column, end_row, end_column):
+        piece_moved = self.board[row][column]
+        piece_captured = self.board[row][end_column]
+        self.board[row][column] = "--"
+        self.board[row][end_column] = "--"
+        self.board[end_row][end_column] = piece_moved
+        if self.white_to_move:
+            in_check = self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
+        else:
+            in_check = self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
+        self.board[row][column] = piece_moved
+        self.board[row][end_column] = piece_captured
+        self.board[end_row][end_column] = "--"
+        return not in_check
+
     """
     Determines if current player is in check
     """
 
     def in_check(self):
+        cached = self.move_cache.peek(self.zobrist_key) if self.move_cache is not None else None
+        if cached is not None:
+            return cached[1]
         if self.white_to_move:
             return self.square_under_attack(self.white_king_location[0], self.white_king_location[1])
         else:
             return self.square_under_attack(self.black_king_location[0], self.black_king_location[1])
 
     """
-    Determines if the enemy can attack the square at position (row, column)
+    Determines if the enemy (or attacker_color, if given) can attack the square at position (row, column).
+    Looks outward from the square for pieces that could reach it, so no moves are generated and the game state
+    (including white_to_move) is never modified.
     """
 
-    def square_under_attack(self, row, column) -> bool:
-        # Switch to the opponent turn to see its perspective (opponents moves)
-        self.white_to_move = not self.white_to_move
-        opponent_moves = self.get_all_possible_moves()
-        self.white_to_move = not self.white_to_move  # Switch turns back
-        for move in opponent_moves:
-            if move.end_row == row and move.end_column == column:  # square is under attack
+    def square_under_attack(self, row, column, attacker_color=None) -> bool:
+        if self.profiler is not None:
+            self.profiler.counters["legality_checks"] += 1
+        if attacker_color is None:
+            attacker_color = "b" if self.white_to_move else "w"
+        if self.bitboards is not None:
+            return self.bitboards.square_attacked(row * 8 + column, attacker_color)
+        board = self.board
+        # pawns attack diagonally forward, so attacking pawn is one row "behind" the square from its perspective
+        pawn_row = row + 1 if attacker_color == "w" else row - 1
+        if 0 <= pawn_row < 8:
+            pawn = attacker_color + "p"
+            if (column > 0 and board[pawn_row][column - 1] == pawn) or \
+                    (column < 7 and board[pawn_row][column + 1] == pawn):
                 return True
+        knight = attacker_color + "N"
+        for move in KNIGHT_MOVES:
+            end_row = row + move[0]
+            end_column = column + move[1]
+            if 0 <= end_row < 8 and 0 <= end_column < 8 and board[end_row][end_column] == knight:
+                return True
+        king = attacker_color + "K"
+        for move in KING_MOVES:
+            end_row = row + move[0]
+            end_column = column + move[1]
+            if 0 <= end_row < 8 and 0 <= end_column < 8 and board[end_row][end_column] == king:
+                return True
+        # sliding pieces, first blocker in each direction decides
+        for directions, slider in ((ROOK_DIRECTIONS, "R"), (BISHOP_DIRECTIONS, "B")):
+            for direction in directions:
+                end_row = row + direction[0]
+                end_column = column + direction[1]
+                while 0 <= end_row < 8 and 0 <= end_column < 8:
+                    end_piece = board[end_row][end_column]
+                    if end_piece != "--":
+                        if end_piece[0] == attacker_color and (end_piece[1] == slider or end_piece[1] == "Q"):
+                            return True
+                        break
+                    end_row += direction[0]
+                    end_column += direction[1]
         return False
 
+    """
+    Bitmap of all squares attacked by the given color ("w" or "b"), square (row, column) is bit row * 8 + column.
+    Uses the incrementally maintained attack map if it is enabled, otherwise it is computed from the board.
+    """
+
+    def attacked_squares(self, color):
+        if self.attack_map is not None:
+            return self.attack_map.attacks(color)
+        return AttackMap(self.board).attacks(color)
+
+    """
+    Turns on incremental attack map maintenance in make_move and undo_move.
+    Useful when attacked squares are queried a lot (evaluation, search), otherwise it is just overhead.
+    """
+
+    def enable_attack_map(self):
+        self.attack_map = AttackMap(self.board)
+
+    def disable_attack_map(self):
+        self.attack_map = None
+
+    """
+    Switches move generation and attack detection to the bitboard backend (see ChessBitboard), experimental.
+    The 8x8 board stays the authoritative position, bitboards are kept in sync by make_move and undo_move.
+    """
+
+    def enable_bitboards(self):
+        from chess.ChessBitboard import Bitboards
+        self.bitboards = Bitboards(self.board)
+
+    def disable_bitboards(self):
+        self.bitboards = None
+
+    """
+    Legal move cache (on by default): get_valid_moves() reuses the moves of positions seen recently,
+    e.g. after undo or when the search reaches a position again. capacity is the number of positions kept.
+    """
+
+    def enable_move_cache(self, capacity=MoveCache.DEFAULT_CAPACITY):
+        self.move_cache = MoveCache(capacity)
+
+    def disable_move_cache(self):
+        self.move_cache = None
+
+    """
+    Counts hot path calls and times move generation in profiler (a ChessProfiler.Profiler, a new one if not given).
+    Disabled, the hooks cost one attribute test per call.
+    """
+
+    def enable_profiler(self, profiler=None):
+        if profiler is None:
+            from chess.ChessProfiler import Profiler
+            profiler = Profiler()
+        self.profiler = profiler
+        return profiler
+
+    def disable_profiler(self):
+        self.profiler = None
+
     """
     All moves without considering checks
     """
@@ -332,47 +1161,58 @@ class Game_state:
     """
 
     def get_pawn_moves(self, row, column, moves):
+        pin_direction = self.pins.get((row, column))
         if self.white_to_move:  # focus on white pawn moves
-            if self.board[row - 1][column] == "--":  # if one square in front is empty append it to move list
-                moves.append(Move((row, column), (row - 1, column), self.board))
-                if row == 6 and self.board[row - 2][column] == "--":  # two square pawn advance
-                    moves.append(Move((row, column), (row - 2, column), self.board))
-            if column - 1 >= 0:  # Note, we don't want to check negative columns and this check is independent since
-                # it is diagonal move (left capture)
-                if self.board[row - 1][column - 1][0] == 'b':  # There is piece of opposite color to capture
-                    moves.append(Move((row, column), (row - 1, column - 1), self.board))
-                elif (row - 1, column - 1) == self.enpassant_possible:  # en passant move
-                    moves.append(Move((row, column), (row - 1, column - 1), self.board, enpassant_possible=True))
-            if column + 1 <= 7:  # right capture
-                if self.board[row - 1][column + 1][0] == 'b':
-                    moves.append(Move((row, column), (row - 1, column + 1), self.board))
-                elif (row - 1, column + 1) == self.enpassant_possible:  # en passant move
-                    moves.append(Move((row, column), (row - 1, column + 1), self.board, enpassant_possible=True))
+            move_amount = -1
+            start_row = 6
+            enemy_color = "b"
         else:
-            if self.board[row + 1][column] == "--":  # first square move
-                moves.append(Move((row, column), (row + 1, column), self.board))
-                if row == 1 and self.board[row + 2][column] == "--":  # two square move
-                    moves.append(Move((row, column), (row + 2, column), self.board))
-            if column - 1 >= 0:  # Left capture, see analogous explanation above
-                if self.board[row + 1][column - 1][0] == 'w':
-                    moves.append(Move((row, column), (row + 1, column - 1), self.board))
-                elif (row + 1, column - 1) == self.enpassant_possible:  # en passant move
-                    moves.append(Move((row, column), (row + 1, column - 1), self.board, enpassant_possible=True))
-            if column + 1 <= 7:  # right capture
-                if self.board[row + 1][column + 1][0] == 'w':
-                    moves.append(Move((row, column), (row + 1, column + 1), self.board))
-                elif (row + 1, column + 1) == self.enpassant_possible:  # en passant move
-                    moves.append(Move((row, column), (row + 1, column + 1), self.board, enpassant_possible=True))
-            # TODO: Pawn promotion!
+            move_amount = 1
+            start_row = 1
+            enemy_color = "w"
+
+        if self.board[row + move_amount][column] == "--":  # if one square in front is empty append it to move list
+            if pin_direction is None or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0):
+                self.add_pawn_moves((row, column), (row + move_amount, column), moves)
+                if row == start_row and self.board[row + 2 * move_amount][column] == "--":  # two square pawn advance
+                    moves.append(Move((row, column), (row + 2 * move_amount, column), self.board))
+        for column_amount in (-1, 1):  # left and right capture
+            end_column = column + column_amount
+            # Note, we don't want to check columns off board and this check is independent since it is diagonal move
+            if 0 <= end_column <= 7:
+                if pin_direction is not None and pin_direction != (move_amount, column_amount) and \
+                        pin_direction != (-move_amount, -column_amount):
+                    continue  # pinned pawn can only capture along the pin
+                if self.board[row + move_amount][end_column][0] == enemy_color:  # piece of opposite color to capture
+                    self.add_pawn_moves((row, column), (row + move_amount, end_column), moves)
+                elif (row + move_amount, end_column) == self.enpassant_possible and \
+                        self.enpassant_is_safe(row, column, row + move_amount, end_column):  # en passant move
+                    moves.append(Move((row, column), (row + move_amount, end_column), self.board,
+                                      enpassant_possible=True))
+
+    """
+    Adds the pawn move, or all four promotions if the pawn reaches the last rank
+    """
+
+    def add_pawn_moves(self, start_position, end_position, moves):
+        if end_position[0] == 0 or end_position[0] == 7:
+            for promotion_piece in Move.promotion_pieces:
+                moves.append(Move(start_position, end_position, self.board, promotion_piece=promotion_piece))
+        else:
+            moves.append(Move(start_position, end_position, self.board))
 
     """
     Get all the rook moves for the rook at location (row, column), add these moves to the list
     """
 
     def get_rook_moves(self, row, column, moves):
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
+        directions = ROOK_DIRECTIONS
         enemy_color = "b" if self.white_to_move else "w"
+        pin_direction = self.pins.get((row, column))
         for direction in directions:
+            if pin_direction is not None and direction != pin_direction and \
+                    direction != (-pin_direction[0], -pin_direction[1]):
+                continue  # pinned piece can only move along the pin
             for square_number in range(1, 8):
                 end_row = row + direction[0] * square_number
                 end_column = column + direction[1] * square_number
@@ -394,9 +1234,10 @@ class Game_state:
     """
 
     def get_knight_moves(self, row, column, moves):
-        knight_moves = ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1))
+        if (row, column) in self.pins:
+            return  # pinned knight can never move
         enemy_color = "b" if self.white_to_move else "w"
-        for move in knight_moves:
+        for move in KNIGHT_MOVES:
             end_row = row + move[0]
             end_column = column + move[1]
             if 0 <= end_row < 8 and 0 <= end_column < 8:
@@ -410,9 +1251,13 @@ class Game_state:
     """
 
     def get_bishop_moves(self, row, column, moves):
-        directions = ((-1, -1), (-1, 1), (1, -1), (1, 1))  # top-left, top-right, bottom-left, bottom-right
+        directions = BISHOP_DIRECTIONS
         enemy_color = "b" if self.white_to_move else "w"
+        pin_direction = self.pins.get((row, column))
         for direction in directions:
+            if pin_direction is not None and direction != pin_direction and \
+                    direction != (-pin_direction[0], -pin_direction[1]):
+                continue  # pinned piece can only move along the pin
             for square_number in range(1, 8):
                 end_row = row + direction[0] * square_number
                 end_column = column + direction[1] * square_number
@@ -443,25 +1288,23 @@ class Game_state:
 
     def get_king_moves(self, row, column, moves):
         # king can move any square arond him (but only one square)
-        king_moves = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
         enemy_color = "b" if self.white_to_move else "w"
         for move in range(8):
-            end_row = row + king_moves[move][0]
-            end_column = column + king_moves[move][1]
+            end_row = row + KING_MOVES[move][0]
+            end_column = column + KING_MOVES[move][1]
             if 0 <= end_row < 8 and 0 <= end_column < 8:
                 end_piece = self.board[end_row][end_column]
-                # King can capture enemy piece or move to the empty square
-                if end_piece[0] == enemy_color or end_piece == "--":
+                # King can capture enemy piece or move to the empty square, but only if that square is not attacked
+                if (end_piece[0] == enemy_color or end_piece == "--") and self.king_square_is_safe(end_row, end_column):
                     moves.append(Move((row, column), (end_row, end_column), self.board))
 
 
     """
-    Generate all valid castle moves for the king at (row, column) and add them to the list of moves
+    Generate all valid castle moves for the king at (row, column) and add them to the list of moves.
+    Only called when the king is not in check, castling through attacked squares is not allowed
     """
 
     def get_castle_moves(self, row, column, moves):
-        if self.square_under_attack(row, column):
-            return  # we cant castle when in check
         if (self.white_to_move and self.current_castling_rights.white_king_side) or \
                 (not self.white_to_move and self.current_castling_rights.black_king_side):
             self.get_king_side_castle_moves(row, column, moves)
@@ -471,10 +1314,10 @@ class Game_state:
 
     def get_king_side_castle_moves(self, row, column, moves):
         if self.board[row][column + 1] == "--" and self.board[row][column + 2] == "--":
-            if not self.square_under_attack(row, column + 1) and not self.square_under_attack(row, column + 2):
+            if self.king_square_is_safe(row, column + 1) and self.king_square_is_safe(row, column + 2):
                 moves.append(Move((row, column), (row, column + 2), self.board, is_castle_move=True))
 
     def get_queen_side_castle_moves(self, row, column, moves):
         if self.board[row][column - 1] == "--" and self.board[row][column - 2] == "--" and self.board[row][column - 3] == "--":
-            if not self.square_under_attack(row, column - 1) and not self.square_under_attack(row, column - 2):
+            if self.king_square_is_safe(row, column - 1) and self.king_square_is_safe(row, column - 2):
                 moves.append(Move((row, column), (row, column - 2), self.board, is_castle_move=True))
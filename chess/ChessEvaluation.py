@@ -0,0 +1,187 @@
+"""
+Batch evaluation with NumPy, for scoring large position sets (dataset building).
+Positions are packed into a (N, 12, 8, 8) array of piece planes (plane order PLANE_PIECES, row 0 is the 8th rank
+like Game_state.board), material and piece square tables are a dot product with weight planes and mobility is
+computed on 64 bit bitboards for all positions at once.
+The score is the one ChessAIEngine.evaluate() gives, both use the tables in ChessAIEngine, and evaluate() below
+can be passed to ChessAIEngine.Searcher as its evaluator.
+Needs NumPy (the rest of the package doesn't).
+"""
+
+import numpy as np
+
+from chess import ChessAIEngine, ChessEngine
+
+PLANE_PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PLANE_INDEX = {piece: index for index, piece in enumerate(PLANE_PIECES)}
+_SQUARE_CODES = dict(PLANE_INDEX, **{"--": len(PLANE_PIECES)})  # empty squares get a code without a plane
+_PLANE_CODES = np.arange(len(PLANE_PIECES), dtype=np.int8).reshape(1, -1, 1)
+
+# material value of one piece for every plane, negative for black
+MATERIAL_WEIGHTS = np.array([ChessAIEngine.piece_scores[piece[1]] * (1 if piece[0] == "w" else -1)
+                             for piece in PLANE_PIECES], dtype=np.int64)
+# piece square table values for every plane, black planes use the mirrored table and are negative
+POSITION_WEIGHTS = np.array([ChessAIEngine.piece_position_scores[piece[1]] if piece[0] == "w" else
+                             [[-score for score in row] for row in ChessAIEngine.piece_position_scores[piece[1]][::-1]]
+                             for piece in PLANE_PIECES], dtype=np.int64)
+
+_COLUMN_0 = np.uint64(0x0101010101010101)
+_NOT_COLUMN_0 = ~_COLUMN_0
+_NOT_COLUMN_7 = ~(_COLUMN_0 << np.uint64(7))
+_NOT_COLUMNS_01 = _NOT_COLUMN_0 & ~(_COLUMN_0 << np.uint64(1))
+_NOT_COLUMNS_67 = _NOT_COLUMN_7 & ~(_COLUMN_0 << np.uint64(6))
+_ALL = ~np.uint64(0)
+_COLUMN_MASKS = {2: _NOT_COLUMNS_01, 1: _NOT_COLUMN_0, 0: _ALL, -1: _NOT_COLUMN_7, -2: _NOT_COLUMNS_67}
+
+# (row, column) step -> (bit shift, mask clearing squares that wrapped around to the other side of the board)
+KNIGHT_SHIFTS = [(move[0] * 8 + move[1], _COLUMN_MASKS[move[1]]) for move in ChessEngine.KNIGHT_MOVES]
+ROOK_SHIFTS = [(direction[0] * 8 + direction[1], _COLUMN_MASKS[direction[1]])
+               for direction in ChessEngine.ROOK_DIRECTIONS]
+BISHOP_SHIFTS = [(direction[0] * 8 + direction[1], _COLUMN_MASKS[direction[1]])
+                 for direction in ChessEngine.BISHOP_DIRECTIONS]
+
+
+"""
+Piece planes for 8x8 boards of Game_state (lists of "wp", "--", ...), shape (N, 12, 8, 8), dtype uint8
+"""
+
+
+def pack_boards(boards):
+    codes = np.fromiter((_SQUARE_CODES[piece] for board in boards for board_row in board for piece in board_row),
+                        dtype=np.int8, count=64 * len(boards)).reshape(-1, 1, 64)
+    return (codes == _PLANE_CODES).view(np.uint8).reshape(-1, 12, 8, 8)
+
+
+"""
+Piece planes for FEN strings, only the piece placement field is used
+"""
+
+
+def pack_fens(fens):
+    return pack_boards([[ChessEngine.parse_fen_rank(rank) for rank in fen.split(" ", 1)[0].split("/")]
+                        for fen in fens])
+
+
+def pack_game_states(game_states):
+    return pack_boards([game_state.board for game_state in game_states])
+
+
+"""
+Piece planes for a mix of FEN strings and Game_state objects
+"""
+
+
+def pack_positions(positions):
+    return pack_boards([ChessEngine.Game_state.from_fen(position).board if isinstance(position, str)
+                        else position.board for position in positions])
+
+
+"""
+One bitboard per plane, shape (N, 12), square (row, column) is bit row * 8 + column
+"""
+
+
+def to_bitboards(planes):
+    packed = np.packbits(planes.reshape(len(planes), 12, 64), axis=2, bitorder="little")
+    return packed.view("<u8").reshape(len(planes), 12).astype(np.uint64)
+
+
+def popcount(bitboards):
+    if hasattr(np, "bitwise_count"):  # NumPy 2.0 and newer
+        return np.bitwise_count(bitboards).astype(np.int64)
+    bitboards = bitboards - ((bitboards >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    bitboards = (bitboards & np.uint64(0x3333333333333333)) + \
+                ((bitboards >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    bitboards = (bitboards + (bitboards >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return ((bitboards * np.uint64(0x0101010101010101)) >> np.uint64(56)).astype(np.int64)
+
+
+def _shift(bitboards, shift, mask):
+    if shift > 0:
+        return (bitboards << np.uint64(shift)) & mask
+    return (bitboards >> np.uint64(-shift)) & mask
+
+
+"""
+Squares reached from pieces going in one direction, up to and including the first occupied square.
+Rays of different pieces in one direction never overlap (the piece behind is blocked by the one in front),
+so the popcount of the result is the sum over the pieces.
+"""
+
+
+def _slide(pieces, empty, shift, mask):
+    attacks = np.zeros_like(pieces)
+    ray = pieces
+    for _ in range(7):
+        ray = _shift(ray, shift, mask)
+        attacks |= ray
+        ray &= empty
+    return attacks
+
+
+"""
+Number of squares the knights, bishops, rooks and queens of one color attack that aren't taken by that color,
+for every position. bitboards is the result of to_bitboards() and offset 0 is white, 6 is black.
+"""
+
+
+def mobility(bitboards, offset):
+    own = np.bitwise_or.reduce(bitboards[:, offset:offset + 6], axis=1)
+    occupied = np.bitwise_or.reduce(bitboards, axis=1)
+    empty = ~occupied
+    knights = bitboards[:, offset + 1]
+    bishops = bitboards[:, offset + 2] | bitboards[:, offset + 4]
+    rooks = bitboards[:, offset + 3] | bitboards[:, offset + 4]
+    count = np.zeros(len(bitboards), dtype=np.int64)
+    for shift, mask in KNIGHT_SHIFTS:  # each shift moves every knight to a different square, no overlaps
+        count += popcount(_shift(knights, shift, mask) & ~own)
+    for shift, mask in BISHOP_SHIFTS:
+        count += popcount(_slide(bishops, empty, shift, mask) & ~own)
+    for shift, mask in ROOK_SHIFTS:
+        count += popcount(_slide(rooks, empty, shift, mask) & ~own)
+    return count
+
+
+"""
+Evaluation terms for every position, all from white perspective: material, position (piece square tables)
+and mobility (white minus black squares, not yet multiplied by mobility_score)
+"""
+
+
+def features(planes):
+    counts = planes.sum(axis=(2, 3), dtype=np.int64)
+    bitboards = to_bitboards(planes)
+    return {
+        "material": counts @ MATERIAL_WEIGHTS,
+        "position": planes.reshape(len(planes), -1).astype(np.int64) @ POSITION_WEIGHTS.reshape(-1),
+        "mobility": mobility(bitboards, 0) - mobility(bitboards, 6),
+    }
+
+
+"""
+Scores (white perspective) for packed positions, equal to ChessAIEngine.evaluate() for each of them
+"""
+
+
+def evaluate_planes(planes):
+    terms = features(planes)
+    return terms["material"] + terms["position"] + ChessAIEngine.mobility_score * terms["mobility"]
+
+
+"""
+Scores (white perspective) for a list of FEN strings and/or Game_state objects
+"""
+
+
+def evaluate_batch(positions):
+    return evaluate_planes(pack_positions(positions))
+
+
+"""
+Single position, for use as the evaluator of ChessAIEngine.Searcher
+(slower than ChessAIEngine.evaluate for one position, the point is that it goes through the same code as batches)
+"""
+
+
+def evaluate(game_state):
+    return int(evaluate_planes(pack_boards([game_state.board]))[0])
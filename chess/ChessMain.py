@@ -3,39 +3,33 @@ This is main driver. Contains current game state in GameState object.
 It is responsible for handling user input current state.
 """
 
+import functools
+import time
+from multiprocessing import Process, Queue, Event
 import pygame as game
-from chess import ChessEngine, ChessAIEngine
+from chess import ChessEngine, ChessAIEngine, ChessPgn, ChessSprites
 
 # Globals
-WIDTH = HEIGHT = 400
+WIDTH = HEIGHT = 400  # initial window size, the window can be resized
 DIMENSION = 8
-SQUARE_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 15
-IMAGES = {}
-
-"""
-This method initializes images dictionary.
-Since this is expensive operation it should be only called once during game startup.
-"""
-
-
-def load_images():
-    pieces = ["wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK"]
-
-    for piece in pieces:
-        IMAGES[piece] = game.transform.scale(game.image.load("images/{}.png".format(piece)), (SQUARE_SIZE, SQUARE_SIZE))
+AI_TIME_LIMIT = 1.0  # seconds the AI may think, search runs in a worker process so the window stays responsive
+PGN_FILE = "games.pgn"  # games saved with 's' are appended here
+BOOK_FILE = "book.bin"  # Polyglot opening book used by the AI if the file exists (python main.py book build ...)
+TABLEBASE_DIRECTORY = "tablebases"  # endgame tables used by the AI if they exist (python main.py tablebase)
+PROFILE_FILE = "profile.json"  # counters and timers written here when profiling ('p') is turned off or on quit
+PROFILE_LOG_INTERVAL = 5.0  # seconds between profile log lines while profiling
 
 
 def main():
     game.init()
-    screen = game.display.set_mode((WIDTH, HEIGHT))
+    screen = game.display.set_mode((WIDTH, HEIGHT), game.RESIZABLE)
     clock = game.time.Clock()
-    screen.fill(game.Color("white"))
+    renderer = Renderer(screen, ChessSprites.SpriteCache())
     game_state = ChessEngine.Game_state()
     valid_moves = game_state.get_valid_moves()
     move_made = False  # flag variable for when a move is made
     animate = False  # flag variable for when we should animate a move
-    load_images()
     running = True
 
     square_selected = ()  # initailly no square is selected, keeps track of the last click of the user (row,column)
@@ -44,17 +38,32 @@ def main():
     game_over = False
     player_one = False  # If a human is playing white, this will be true. If AI is playing then it will be false
     player_two = False  # same as above! TODO: change to int to express difficulty
+    ai_thinking = False  # True while the worker process searches for the AI move
+    move_finder_process = None
+    move_finder_stop = None  # event that tells the worker to stop searching (undo, reset, quit)
+    return_queue = None
+    ai_start = 0.0  # when the AI was asked for a move
+    profiler = None  # ChessProfiler.Profiler while profiling is on, 'p' turns it on and off
+    profile_logged = 0.0
     while running:
+        frame_start = time.perf_counter()
         human_turn = (game_state.white_to_move and player_one) or (not game_state.white_to_move and player_two)
         for event in game.event.get():
             if event.type == game.QUIT:
                 running = False
+                if ai_thinking:
+                    move_finder_stop.set()
+                    move_finder_process.terminate()
+                if profiler is not None:
+                    profiler.write_json(PROFILE_FILE)
+            elif event.type == game.VIDEORESIZE:
+                renderer.resize(game.display.get_surface())
                 # mouse handler
             elif event.type == game.MOUSEBUTTONDOWN:  # adding event handles for mouse clicks
-                if not game_over and human_turn:
-                    location = game.mouse.get_pos()  # (x,y) location of pointer
-                    column = location[0] // SQUARE_SIZE
-                    row = location[1] // SQUARE_SIZE
+                location = game.mouse.get_pos()  # (x,y) location of pointer
+                column = location[0] // renderer.square_size
+                row = location[1] // renderer.square_size
+                if not game_over and human_turn and row < DIMENSION and column < DIMENSION:  # not next to the board
                     if square_selected == (row, column):  # user clicked same square twice, unselect
                         square_selected = ()  # deselect
                         player_clicks = []  # clear player clicks
@@ -80,136 +89,260 @@ def main():
                     game_state.undo_move()
                     move_made = True
                     animate = False
+                    if ai_thinking:  # position changed, the move the AI is looking for is no longer wanted
+                        move_finder_stop.set()
+                        ai_thinking = False
+                if event.key == game.K_s:  # save the game as PGN when 's' is pressed
+                    with open(PGN_FILE, "a") as file:
+                        ChessPgn.write_game(file, game_state, {"Event": "Casual game",
+                                                               "Date": time.strftime("%Y.%m.%d"),
+                                                               "White": "Human" if player_one else "AI",
+                                                               "Black": "Human" if player_two else "AI"})
+                if event.key == game.K_p:  # profiling on and off when 'p' is pressed
+                    if profiler is None:
+                        profiler = game_state.enable_profiler()
+                    else:
+                        profiler.write_json(PROFILE_FILE)
+                        print("Profile written to {}".format(PROFILE_FILE))
+                        game_state.disable_profiler()
+                        profiler = None
                 if event.key == game.K_r:  # reset when 'r' is pressed
                     game_state = ChessEngine.Game_state()
+                    if profiler is not None:
+                        game_state.enable_profiler(profiler)
                     valid_moves = game_state.get_valid_moves()
                     square_selected = ()
                     player_clicks = []
                     move_made = False
                     animate = False
                     game_over = False
-
-        # AI move finder logic
-        if not game_over and not human_turn:
-            AI_move = ChessAIEngine.find_random_move(valid_moves)
-            game_state.make_move(AI_move)
-            move_made = True
-            animate = True
+                    if ai_thinking:
+                        move_finder_stop.set()
+                        ai_thinking = False
+
+        # AI move finder logic, search runs in a separate process (threads would block on the GIL)
+        # and the loop keeps polling for its result while it handles events and draws
+        if not game_over and not human_turn and not move_made:
+            if not ai_thinking:
+                ai_thinking = True
+                return_queue = Queue()
+                move_finder_stop = Event()
+                move_finder_process = Process(target=ChessAIEngine.find_move_process,
+                                              args=(game_state, valid_moves, AI_TIME_LIMIT, return_queue,
+                                                    move_finder_stop, BOOK_FILE, TABLEBASE_DIRECTORY))
+                move_finder_process.start()
+                ai_start = time.perf_counter()
+            elif not return_queue.empty():
+                AI_move, profile = return_queue.get()
+                ai_thinking = False
+                if profiler is not None:
+                    profiler.add_time("ai_move", time.perf_counter() - ai_start)
+                    if profile is not None:
+                        profiler.merge(profile)  # counters of the worker process
+                for move in valid_moves:  # move came back pickled, use the matching valid move
+                    if move == AI_move and move.is_castle_move == AI_move.is_castle_move:
+                        game_state.make_move(move)
+                        move_made = True
+                        animate = True
+                        break
 
         # Since generating valid moves is expensive, generating is only done after a valid move!
         if move_made:
             if animate:
-                animate_move(game_state.game_log[-1], screen, game_state.board, clock)
+                animation_start = time.perf_counter()
+                renderer.animate_move(game_state.game_log[-1], game_state, clock)
+                frame_start += time.perf_counter() - animation_start  # animation waits for its own frames
             valid_moves = game_state.get_valid_moves()
             move_made = False
             animate = False
-        draw_game_state(screen, game_state, valid_moves, square_selected)
-
-        if game_state.check_mate:
-            game_over = True
-            if game_state.white_to_move:
-                draw_text(screen, "Black wins by checkmate")
-            else:
-                draw_text(screen, "White wins by checkmate")
-        elif game_state.stale_mate:
-            game_over = True
-            draw_text(screen, "Stalemate")
+        text = game_over_text(game_state)
+        game_over = text is not None
+        overlay = None
+        if profiler is not None:
+            profiler.add_time("frame", time.perf_counter() - frame_start)  # work of the frame, without waiting
+            overlay = "{:.2f} ms/frame  {:.0f} nodes/s".format(profiler.mean_ms("frame"), profiler.nodes_per_second())
+            if frame_start - profile_logged >= PROFILE_LOG_INTERVAL:
+                print(profiler.log_line())
+                profile_logged = frame_start
+        dirty = renderer.draw(game_state, valid_moves, square_selected, text, overlay)
         clock.tick(MAX_FPS)
-        game.display.flip()
+        game.display.update(dirty)
 
 
 """
-Highlight square selected and moves for piece selected
+Board squares without pieces, rendered once. Top-left square is light (no matter of perspective!)
 """
 
 
-def highlight_squares(screen, game_state, valid_moves, square_selected):
-    if square_selected != ():
-        row, column = square_selected
-        if game_state.board[row][column][0] == (
-        "w" if game_state.white_to_move else "b"):  # sq selected is a piece that can be moved
-            # highlight selected square
-            surface = game.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            surface.set_alpha(100)  # 0 - transparent, 255 - opaque
-            surface.fill("blue")
-            screen.blit(surface, (column * SQUARE_SIZE, row * SQUARE_SIZE))
-            # highlight moves from that square
-            surface.fill(game.Color("yellow"))
-            for move in valid_moves:
-                if move.start_row == row and move.start_column == column:
-                    screen.blit(surface, (SQUARE_SIZE * move.end_column, SQUARE_SIZE * move.end_row))
+def render_board(square_size):
+    surface = game.Surface((DIMENSION * square_size, DIMENSION * square_size))
+    board_colors = [game.Color("white"), game.Color("light blue")]
+    for row in range(DIMENSION):
+        for column in range(DIMENSION):
+            color = board_colors[(row + column) % 2]
+            surface.fill(color, square_rect(row, column, square_size))
+    return surface
 
 
-"""
-Responsible for all graphic in game.
-Note that order of calling is important! Board must be drawn before pieces!
-"""
+def square_rect(row, column, square_size):
+    return game.Rect(column * square_size, row * square_size, square_size, square_size)
+
 
+def highlight_surface(color, square_size):
+    surface = game.Surface((square_size, square_size))
+    surface.set_alpha(100)  # 0 - transparent, 255 - opaque
+    surface.fill(game.Color(color))
+    return surface
 
-def draw_game_state(screen, game_state, valid_moves, square_selected):
-    draw_board(screen)
-    highlight_squares(screen, game_state, valid_moves, square_selected)
-    draw_pieces(screen, game_state.board)
+
+@functools.lru_cache(maxsize=None)
+def get_font(name, size, bold=False, italic=False):
+    return game.font.SysFont(name, size, bold, italic)
 
 
 """
-Draws squares on the board. Top-left square is light (no matter of perspective!)
+Highlighted squares: square selected (if it is a piece that can be moved) and moves for piece selected,
+as {square: "selected" or "move"}
 """
 
 
-def draw_board(screen):
-    global board_colors
-    board_colors = [game.Color("white"), game.Color("light blue")]
-
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            color = board_colors[(row + column) % 2]
-            game.draw.rect(screen, color, game.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+def highlighted_squares(game_state, valid_moves, square_selected):
+    highlights = {}
+    if square_selected != ():
+        row, column = square_selected
+        if game_state.board[row][column][0] == ("w" if game_state.white_to_move else "b"):
+            highlights[row * 8 + column] = "selected"
+            for move in valid_moves:
+                if move.start_row == row and move.start_column == column:
+                    highlights[move.end_row * 8 + move.end_column] = "move"
+    return highlights
 
 
 """
-Draws pieces on top of the squares
+Draws the game and remembers what is on the screen, so that only squares that changed since the last frame are
+drawn again. Methods return the rects drawn, for game.display.update(rects).
+The board fills the smaller side of the screen, pieces come from sprites (ChessSprites.SpriteCache).
 """
 
 
-def draw_pieces(screen, board):
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-
-            if piece != "--":
-                screen.blit(IMAGES[piece], game.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-
-def animate_move(move, screen, board, clock):
-    global board_colors
-    delta_row = move.end_row - move.start_row
-    delta_column = move.end_column - move.start_column
-    frames_per_square = 10
-    frame_count = (abs(delta_row) + abs(delta_column)) * frames_per_square
-    for frame in range(frame_count + 1):
-        row, column = (
-        move.start_row + delta_row * frame / frame_count, move.start_column + delta_column * frame / frame_count)
-        draw_board(screen)
-        draw_pieces(screen, board)
-
-        # erase the piece moved from its ending square
-        color = board_colors[(move.end_row + move.end_column) % 2]
-        end_square = game.Rect(move.end_column * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        game.draw.rect(screen, color, end_square)
-
-        if move.piece_captured != "--":
-            screen.blit(IMAGES[move.piece_captured], end_square)
-
-        screen.blit(IMAGES[move.piece_moved],
-                    game.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        game.display.flip()
-        clock.tick(60)
-
-def draw_text(screen, text):
-    font = game.font.SysFont("Helvetica", 32, True, False)
-    text_object = font.render(text, 0, game.Color("Black"))
-    text_loc = game.Rect(0,0, WIDTH, HEIGHT).move(WIDTH/2 - text_object.get_width()/2, HEIGHT/2 - text_object.get_height()/2)
-    screen.blit(text_object, text_loc)
+class Renderer:
+    def __init__(self, screen, sprites):
+        self.sprites = sprites
+        self.resize(screen)
+
+    """
+    Starts over on a new or resized screen, the next draw() draws everything
+    """
+
+    def resize(self, screen):
+        self.screen = screen
+        self.square_size = max(min(screen.get_size()) // DIMENSION, 1)
+        self.background = render_board(self.square_size)
+        self.highlights = {"selected": highlight_surface("blue", self.square_size),
+                           "move": highlight_surface("yellow", self.square_size)}
+        self.shown = [None] * 64  # (piece, highlight) of every square as it is on the screen, None - unknown
+        self.text = None
+        self.text_surface = None
+        self.text_rect = None
+        self.screen.fill(game.Color("white"))
+        self.whole_screen = True  # next draw() updates all of it, not only the board
+
+    """
+    Draws the squares whose piece or highlight changed, the text (end of game message, None for no text)
+    and the overlay (profiling line in the top left corner, drawn every frame)
+    """
+
+    def draw(self, game_state, valid_moves, square_selected, text=None, overlay=None):
+        if text != self.text and self.text is not None:
+            self.shown = [None] * 64  # squares under the old text
+        highlights = highlighted_squares(game_state, valid_moves, square_selected)
+        dirty = [self.screen.get_rect()] if self.whole_screen else []
+        self.whole_screen = False
+        for row in range(DIMENSION):
+            board_row = game_state.board[row]
+            for column in range(DIMENSION):
+                square = row * 8 + column
+                content = (board_row[column], highlights.get(square))
+                if self.shown[square] != content:
+                    self.shown[square] = content
+                    dirty.append(self.draw_square(row, column, *content))
+        if text is not None and (text != self.text or self.text_rect.collidelist(dirty) != -1):
+            if text != self.text:
+                self.text_surface = get_font("Helvetica", self.square_size * 32 // 50, True, False).render(text, 0, game.Color("Black"))
+                self.text_rect = self.text_surface.get_rect(center=self.background.get_rect().center)
+            self.screen.blit(self.text_surface, self.text_rect)
+            dirty.append(self.text_rect)
+        self.text = text
+        if overlay is not None:
+            surface = get_font("Courier", max(self.square_size // 4, 8)).render(overlay, 0, game.Color("white"),
+                                                                               game.Color("black"))
+            overlay_rect = self.screen.blit(surface, (0, 0))
+            self.forget(overlay_rect)  # squares under it are drawn again next frame, with a new overlay or without
+            dirty.append(overlay_rect)
+        return dirty
+
+    """
+    Squares under rect are drawn again by the next draw()
+    """
+
+    def forget(self, rect):
+        for row in range(rect.top // self.square_size, min(rect.bottom // self.square_size + 1, DIMENSION)):
+            for column in range(rect.left // self.square_size, min(rect.right // self.square_size + 1, DIMENSION)):
+                self.shown[row * 8 + column] = None
+
+    def draw_square(self, row, column, piece, highlight=None):
+        rect = square_rect(row, column, self.square_size)
+        self.screen.blit(self.background, rect, rect)
+        if highlight is not None:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(self.sprites.get(piece, self.square_size), rect)
+        return rect
+
+    """
+    Slides the piece moved from its start to its end square, game_state has the move made already.
+    Every frame only the rects the piece leaves and enters are updated.
+    """
+
+    def animate_move(self, move, game_state, clock):
+        game.display.update(self.draw(game_state, [], ()))
+        # captured piece stays on the end square until the piece moved arrives
+        self.draw_square(move.end_row, move.end_column, "--" if move.is_enpassant_move else move.piece_captured)
+        self.shown[move.end_row * 8 + move.end_column] = None
+        static = self.screen.copy()
+        delta_row = move.end_row - move.start_row
+        delta_column = move.end_column - move.start_column
+        frames_per_square = 10
+        frame_count = (abs(delta_row) + abs(delta_column)) * frames_per_square
+        square_size = self.square_size
+        sprite = self.sprites.get(move.piece_moved, square_size)
+        previous = None
+        for frame in range(frame_count + 1):
+            row = move.start_row + delta_row * frame / frame_count
+            column = move.start_column + delta_column * frame / frame_count
+            rect = game.Rect(round(column * square_size), round(row * square_size), square_size, square_size)
+            dirty = [rect]
+            if previous is not None:
+                self.screen.blit(static, previous, previous)
+                dirty.append(previous)
+            self.screen.blit(sprite, rect)
+            game.display.update(dirty)
+            previous = rect
+            clock.tick(60)
+        self.screen.blit(static, previous, previous)
+        game.display.update(previous)
+
+
+def game_over_text(game_state):
+    if game_state.check_mate:
+        return "Black wins by checkmate" if game_state.white_to_move else "White wins by checkmate"
+    if game_state.stale_mate:
+        return "Stalemate"
+    draw_reason = game_state.draw_reason()
+    if draw_reason is not None:
+        return "Draw by " + draw_reason
+    return None
+
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,189 @@
+"""
+Perft (performance test): counts all leaf nodes of the legal move tree to a fixed depth.
+Node counts of the standard test positions are known, so any difference means a move generation or
+make/undo bug, and the time it takes measures move generation speed.
+
+Usage:
+    python main.py perft [positions...] [--depth N] [--divide] [--phases] [--backend board|bitboard] [--move-cache]
+                         [--profile] [--json FILE]
+The move cache is off unless --move-cache is given, so that the numbers measure move generation.
+"""
+
+import argparse
+import json
+import platform
+import sys
+import time
+
+from chess import ChessEngine
+
+# name -> (FEN, known node counts for depth 1, 2, ...)
+POSITIONS = {
+    "initial": ("rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+                [20, 400, 8902, 197281, 4865609]),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 [48, 2039, 97862, 4085603]),
+    "enpassant": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  [14, 191, 2812, 43238, 674624]),
+    "promotion": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  [6, 264, 9467, 422333]),
+    "castling": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                 [44, 1486, 62379, 2103487]),
+    "middlegame": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                   [46, 2079, 89890, 3894594]),
+}
+DEFAULT_DEPTH = 3
+
+
+def perft(game_state, depth):
+    moves = game_state.get_valid_moves()
+    if depth == 1:
+        return len(moves)  # bulk counting, leaf moves don't have to be made
+    nodes = 0
+    for move in moves:
+        game_state.make_move(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undo_move()
+    return nodes
+
+
+"""
+Perft split by root move, in long algebraic notation -> node count
+"""
+
+
+def divide(game_state, depth):
+    result = {}
+    for move in game_state.get_valid_moves():
+        game_state.make_move(move)
+        result[move.get_chess_notation()] = perft(game_state, depth - 1) if depth > 1 else 1
+        game_state.undo_move()
+    return result
+
+
+"""
+Same as perft, but measures time spent in move generation and in make/undo separately.
+Timing every call has its own cost, so total time is higher than with plain perft.
+"""
+
+
+def perft_phases(game_state, depth, phases):
+    start = time.perf_counter()
+    moves = game_state.get_valid_moves()
+    phases["generate"] += time.perf_counter() - start
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        start = time.perf_counter()
+        game_state.make_move(move)
+        phases["make_undo"] += time.perf_counter() - start
+        nodes += perft_phases(game_state, depth - 1, phases)
+        start = time.perf_counter()
+        game_state.undo_move()
+        phases["make_undo"] += time.perf_counter() - start
+    return nodes
+
+
+def run_position(name, fen, expected, depth, backend="board", with_divide=False, with_phases=False,
+                 move_cache=False, with_profile=False):
+    start = time.perf_counter()
+    game_state = ChessEngine.Game_state.from_fen(fen)
+    if backend == "bitboard":
+        game_state.enable_bitboards()
+    if not move_cache:
+        game_state.disable_move_cache()
+    setup_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    nodes = perft(game_state, depth)
+    seconds = time.perf_counter() - start
+    result = {
+        "position": name,
+        "fen": fen,
+        "depth": depth,
+        "nodes": nodes,
+        "expected": expected[depth - 1] if depth <= len(expected) else None,
+        "seconds": seconds,
+        "nps": nodes / seconds if seconds > 0 else 0.0,
+        "phases": {"setup": setup_seconds},
+    }
+    result["ok"] = result["expected"] is None or result["expected"] == nodes
+    if move_cache:
+        result["move_cache"] = game_state.move_cache.stats()
+    if with_phases:
+        phases = {"generate": 0.0, "make_undo": 0.0}
+        perft_phases(game_state, depth, phases)
+        result["phases"].update(phases)
+    if with_profile:  # separate run, the untimed one above stays free of instrumentation
+        profiler = game_state.enable_profiler()
+        perft(game_state, depth)
+        game_state.disable_profiler()
+        result["profile"] = profiler.snapshot()
+        result["profile_line"] = profiler.log_line()
+    if with_divide:
+        result["divide"] = divide(game_state, depth)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="perft", description="Move generation correctness and speed test")
+    parser.add_argument("positions", nargs="*", default=list(POSITIONS),
+                        help="positions to run: {} (default: all)".format(", ".join(POSITIONS)))
+    parser.add_argument("--fen", help="run an arbitrary position instead (no known node count)")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="search depth (default: %(default)s)")
+    parser.add_argument("--divide", action="store_true", help="print node count for every root move")
+    parser.add_argument("--phases", action="store_true", help="time move generation and make/undo separately")
+    parser.add_argument("--backend", choices=("board", "bitboard"), default="board")
+    parser.add_argument("--move-cache", action="store_true", help="use the legal move cache of Game_state")
+    parser.add_argument("--profile", action="store_true", help="count hot path calls (see chess/ChessProfiler.py)")
+    parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        jobs = [("fen", args.fen, [])]
+    else:
+        unknown = [name for name in args.positions if name not in POSITIONS]
+        if unknown:
+            parser.error("unknown position(s): {}".format(", ".join(unknown)))
+        jobs = [(name,) + POSITIONS[name] for name in args.positions]
+
+    results = []
+    for name, fen, expected in jobs:
+        result = run_position(name, fen, expected, args.depth, args.backend, args.divide, args.phases,
+                              args.move_cache, args.profile)
+        results.append(result)
+        if args.divide:
+            for notation, nodes in sorted(result["divide"].items()):
+                print("  {}: {}".format(notation, nodes))
+        status = "ok" if result["expected"] is not None and result["ok"] else \
+            ("FAIL (expected {})".format(result["expected"]) if not result["ok"] else "")
+        phases = ""
+        if args.phases:
+            phases = "  generate {:.3f}s  make/undo {:.3f}s".format(result["phases"]["generate"],
+                                                                   result["phases"]["make_undo"])
+        print("{:<12} depth {}  nodes {:>10}  {:8.3f}s  {:>9.0f} nps  {}{}".format(
+            name, args.depth, result["nodes"], result["seconds"], result["nps"], status, phases))
+        if args.profile:
+            print("  " + result.pop("profile_line"))
+
+    if args.json_file:
+        report = {
+            "backend": args.backend,
+            "move_cache": args.move_cache,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_file, "w") as file:
+                json.dump(report, file, indent=2)
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,372 @@
+"""
+Streaming PGN (Portable Game Notation) reader and writer.
+Games are read one at a time from any iterable of lines, usually an open file, so memory use is bounded by the
+largest single game and not by the size of the archive. Moves in SAN (standard algebraic notation, "Nbd7",
+"exd6", "e8=Q+") are resolved against Game_state.get_valid_moves(), and the writer produces SAN the same way.
+
+Usage:
+    python main.py pgn [FILE...] [--games N] [--seed S] [--json FILE]
+Without files, N random games are generated, written and read back, which measures both directions.
+"""
+
+import argparse
+import io
+import json
+import platform
+import random
+import re
+import sys
+import time
+
+from chess import ChessEngine
+
+INITIAL_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+LINE_LENGTH = 79  # export format limit for movetext lines
+
+_TAG = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+_TOKEN = re.compile(r'[{}();]|[^\s{}();]+')
+_MOVE_NUMBER = re.compile(r'^\d+\.*')
+_SAN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$')
+
+
+class PgnGame:
+    def __init__(self, headers=None, moves=None, result="*"):
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []  # SAN strings of the main line
+        self.result = result
+
+    """
+    FEN of the starting position, from the FEN tag if there is one
+    """
+
+    def start_fen(self):
+        return self.headers.get("FEN", INITIAL_FEN)
+
+    """
+    Replays the main line and yields (game_state, move) after every move. The same Game_state is updated
+    in place, so nothing is kept per ply. Raises ValueError if a move is illegal or ambiguous.
+    A new game state uses the board backend, pass a game_state with enable_bitboards() to use the bitboards.
+    """
+
+    def replay(self, game_state=None):
+        if game_state is None:
+            game_state = ChessEngine.Game_state.from_fen(self.start_fen())
+        valid_moves = game_state.get_valid_moves()
+        for ply, san in enumerate(self.moves):
+            try:
+                move = parse_san(game_state, san, valid_moves)
+            except ValueError as error:
+                raise ValueError("{} (ply {} of game {!r})".format(error, ply + 1, self.headers.get("Event", "?")))
+            game_state.make_move(move)
+            valid_moves = game_state.get_valid_moves()
+            yield game_state, move
+
+    """
+    Game_state after the last move of the main line
+    """
+
+    def game_state(self):
+        game_state = None
+        for game_state, _ in self.replay():
+            pass
+        return game_state if game_state is not None else ChessEngine.Game_state.from_fen(self.start_fen())
+
+
+"""
+Reads games one by one from an iterable of lines (an open text file). Comments, variations, NAGs and move
+numbers are skipped, only the main line is kept. A game ends with its result token, or when the tags of the
+next game start.
+"""
+
+
+def read_games(lines):
+    headers = {}
+    moves = []
+    comment = False  # inside a {...} comment, these can span lines
+    variation_depth = 0
+    for line in lines:
+        if not comment and variation_depth == 0 and line.startswith("["):
+            tag = _TAG.match(line)
+            if tag:
+                if moves:  # previous game had no result token
+                    yield PgnGame(headers, moves, "*")
+                    headers, moves = {}, []
+                headers[tag.group(1)] = tag.group(2).replace('\\"', '"').replace("\\\\", "\\")
+                continue
+        if line.startswith("%"):  # escape mechanism, the line is ignored
+            continue
+        for token in _TOKEN.findall(line):
+            if comment:
+                if token == "}":
+                    comment = False
+            elif token == "{":
+                comment = True
+            elif token == ";":  # comment till the end of the line
+                break
+            elif token == "(":
+                variation_depth += 1
+            elif token == ")":
+                variation_depth = max(0, variation_depth - 1)
+            elif variation_depth:
+                continue
+            elif token in RESULTS:
+                yield PgnGame(headers, moves, token)
+                headers, moves = {}, []
+            elif token[0] != "$":  # NAGs ($1, $14, ...) are annotations, not moves
+                token = _MOVE_NUMBER.sub("", token)  # "12." "12..." and also "12.e4" written without a space
+                if token:
+                    moves.append(token)
+    if moves or headers:
+        yield PgnGame(headers, moves, headers.get("Result", "*"))
+
+
+"""
+The valid move written as san, for the position in game_state (valid_moves must be its valid moves).
+Check and checkmate suffixes need the position after the move, see san_moves().
+"""
+
+
+def move_to_san(game_state, move, valid_moves):
+    if move.is_castle_move:
+        return "O-O" if move.end_column == 6 else "O-O-O"
+    target = move.get_rank_file(move.end_row, move.end_column)
+    capture = move.piece_captured != "--"
+    piece = move.piece_moved[1]
+    if piece == "p":
+        san = (move.columns_to_files[move.start_column] + "x" + target) if capture else target
+        if move.is_pawn_promotion:
+            san += "=" + move.promotion_piece
+        return san
+    # another piece of the same kind that can go to the same square makes the move ambiguous
+    others = [other for other in valid_moves if other.piece_moved == move.piece_moved and
+              other.end_row == move.end_row and other.end_column == move.end_column and
+              (other.start_row != move.start_row or other.start_column != move.start_column)]
+    disambiguation = ""
+    if others:
+        if all(other.start_column != move.start_column for other in others):
+            disambiguation = move.columns_to_files[move.start_column]
+        elif all(other.start_row != move.start_row for other in others):
+            disambiguation = move.rows_to_ranks[move.start_row]
+        else:
+            disambiguation = move.get_rank_file(move.start_row, move.start_column)
+    return piece + disambiguation + ("x" if capture else "") + target
+
+
+"""
+The valid move for san in the position in game_state. Annotations (+, #, !, ?) are ignored and castling may be
+written with zeros. Raises ValueError if no valid move, or more than one, matches.
+"""
+
+
+def parse_san(game_state, san, valid_moves):
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        end_column = 6 if len(text) == 3 else 2
+        for move in valid_moves:
+            if move.is_castle_move and move.end_column == end_column:
+                return move
+        raise ValueError("Illegal move {!r}".format(san))
+    match = _SAN.match(text)
+    if match is None:
+        raise ValueError("Invalid SAN {!r}".format(san))
+    piece, file, rank, target, promotion = match.groups()
+    piece = piece or "p"
+    end_row = ChessEngine.Move.ranks_to_rows[target[1]]
+    end_column = ChessEngine.Move.files_to_columns[target[0]]
+    start_column = ChessEngine.Move.files_to_columns[file] if file else None
+    start_row = ChessEngine.Move.ranks_to_rows[rank] if rank else None
+    if piece == "p" and promotion is None and (end_row == 0 or end_row == 7):
+        promotion = "Q"  # some writers leave out the piece for queen promotions
+    found = None
+    for move in valid_moves:
+        if move.end_row != end_row or move.end_column != end_column or move.piece_moved[1] != piece or \
+                move.is_castle_move or move.promotion_piece != promotion:
+            continue
+        if (start_column is not None and move.start_column != start_column) or \
+                (start_row is not None and move.start_row != start_row):
+            continue
+        if found is not None:
+            raise ValueError("Ambiguous move {!r}".format(san))
+        found = move
+    if found is None:
+        raise ValueError("Illegal move {!r}".format(san))
+    return found
+
+
+"""
+Makes moves on game_state one after the other and yields each one in SAN, including check (+)
+and checkmate (#) suffixes
+"""
+
+
+def san_moves(game_state, moves):
+    valid_moves = game_state.get_valid_moves()
+    for move in moves:
+        san = move_to_san(game_state, move, valid_moves)
+        game_state.make_move(move)
+        valid_moves = game_state.get_valid_moves()
+        if game_state.check_mate:
+            san += "#"
+        elif game_state.in_check():
+            san += "+"
+        yield san
+
+
+"""
+Result token for the current position of game_state, "*" while the game is not over
+"""
+
+
+def game_result(game_state):
+    if game_state.check_mate:
+        return "0-1" if game_state.white_to_move else "1-0"
+    if game_state.stale_mate or game_state.draw_reason() is not None:
+        return "1/2-1/2"
+    return "*"
+
+
+"""
+Writes the game played on game_state (game_state.game_log) as PGN to file. The moves are taken back and
+made again to get their SAN, afterwards game_state is in the same position as before.
+Missing tags of the seven tag roster are filled in with "?". The result comes from the final position, a Result
+header is used only when the position doesn't decide the game.
+"""
+
+
+def write_game(file, game_state, headers=None):
+    moves = list(game_state.game_log)
+    for _ in moves:
+        game_state.undo_move()
+    start_fen = game_state.to_fen()
+    fullmove_number = game_state.fullmove_number
+    white_to_move = game_state.white_to_move
+    sans = list(san_moves(game_state, moves))
+
+    tags = {"Event": "?", "Site": "?", "Date": "????.??.??", "Round": "?", "White": "?", "Black": "?"}
+    tags.update(headers or {})
+    result = game_result(game_state)
+    if result == "*" and tags.get("Result") in RESULTS:  # decided by something else than the position (time, adjudication)
+        result = tags["Result"]
+    tags["Result"] = result
+    if start_fen != INITIAL_FEN:
+        tags["SetUp"] = "1"
+        tags["FEN"] = start_fen
+    lines = ['[{} "{}"]'.format(name, tags[name].replace("\\", "\\\\").replace('"', '\\"'))
+             for name in SEVEN_TAG_ROSTER + tuple(name for name in tags if name not in SEVEN_TAG_ROSTER)]
+    lines.append("")
+
+    tokens = []
+    for san in sans:
+        if white_to_move:
+            tokens.append("{}. {}".format(fullmove_number, san))
+        elif not tokens:  # game starts with a black move
+            tokens.append("{}... {}".format(fullmove_number, san))
+        else:
+            tokens.append(san)
+            fullmove_number += 1
+        white_to_move = not white_to_move
+    tokens.append(result)
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    file.write("\n".join(lines) + "\n\n")
+
+
+"""
+Plays a game of random moves, used to generate benchmark input
+"""
+
+
+def random_game(rng, max_plies=200):
+    game_state = ChessEngine.Game_state()
+    for _ in range(max_plies):
+        valid_moves = game_state.get_valid_moves()
+        if not valid_moves:
+            break
+        game_state.make_move(rng.choice(valid_moves))
+    return game_state
+
+
+"""
+Reads all games from lines and replays them, returns (games, plies, errors)
+"""
+
+
+def replay_games(lines):
+    games = plies = errors = 0
+    for game in read_games(lines):
+        games += 1
+        try:
+            for _ in game.replay():
+                plies += 1
+        except ValueError:
+            errors += 1
+    return games, plies, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="pgn", description="PGN reading and writing throughput")
+    parser.add_argument("files", nargs="*", help="PGN files to read and replay (default: generated games)")
+    parser.add_argument("--games", type=int, default=100, help="random games to generate (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for generated games")
+    parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    results = []
+    if args.files:
+        for path in args.files:
+            start = time.perf_counter()
+            with open(path, encoding="utf-8", errors="replace") as file:
+                games, plies, errors = replay_games(file)
+            results.append({"name": path, "operation": "read", "games": games, "plies": plies, "errors": errors,
+                            "seconds": time.perf_counter() - start})
+    else:
+        rng = random.Random(args.seed)
+        game_states = [random_game(rng) for _ in range(args.games)]
+        output = io.StringIO()
+        start = time.perf_counter()
+        for number, game_state in enumerate(game_states):
+            write_game(output, game_state, {"Event": "Random game", "Round": str(number + 1)})
+        results.append({"name": "generated", "operation": "write", "games": len(game_states),
+                        "plies": sum(len(game_state.game_log) for game_state in game_states), "errors": 0,
+                        "seconds": time.perf_counter() - start})
+        output.seek(0)
+        start = time.perf_counter()
+        games, plies, errors = replay_games(output)
+        results.append({"name": "generated", "operation": "read", "games": games, "plies": plies, "errors": errors,
+                        "seconds": time.perf_counter() - start})
+
+    for result in results:
+        seconds = result["seconds"]
+        result["games_per_second"] = result["games"] / seconds if seconds > 0 else 0.0
+        result["plies_per_second"] = result["plies"] / seconds if seconds > 0 else 0.0
+        print("{:<12} {:<5}  games {:>8}  plies {:>10}  {:8.3f}s  {:>8.1f} games/s  {:>9.0f} plies/s{}".format(
+            result["name"], result["operation"], result["games"], result["plies"], seconds,
+            result["games_per_second"], result["plies_per_second"],
+            "  {} errors".format(result["errors"]) if result["errors"] else ""))
+
+    if args.json_file:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": results,
+        }
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_file, "w") as file:
+                json.dump(report, file, indent=2)
+    return 0 if all(result["errors"] == 0 for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,462 @@
+"""
+Position search index over a game archive (see ChessArchive.py): which games reached a position, a pawn structure or
+a material signature, answered by binary search instead of replaying every game.
+
+For every ply of every game (the start position included) three 64 bit keys are recorded:
+    position    Game_state.position_key(): Zobrist key with side to move and castling, and the en passant square
+                only when an en passant capture is legal
+    pawns       Zobrist key of the pawns only
+    material    piece counts, 4 bits for each of QRBNP of both sides
+Each kind is stored as (key, game) pairs sorted by key, one pair per game and key. An index is a directory of
+segment files, each covering a range of games; indexing new games of the archive writes a new segment next to the
+existing ones (nothing is rebuilt), compact() merges the segments into one. Segments are memory mapped, a query is
+a binary search in every segment. Game ids are the game numbers of the archive.
+
+Segment layout (little-endian):
+    header   magic "PCPI", version (H), kinds (H), first game (I), end game (I),
+             then for each kind: entries (Q), keys offset (Q), games offset (Q)
+    data     keys (Q each) and games (I each) of every kind, 8 byte aligned
+
+Usage:
+    python main.py index build ARCHIVE INDEX_DIR [--workers N] [--chunk GAMES]     index games not indexed yet
+    python main.py index query INDEX_DIR [--fen FEN] [--pawns FEN] [--material KRPvKR] [--archive ARCHIVE]
+    python main.py index compact INDEX_DIR
+    python main.py index bench ARCHIVE INDEX_DIR [--queries N] [--json FILE]    query time against replaying the archive
+"""
+
+import argparse
+import heapq
+import json
+import mmap
+import os
+import platform
+import random
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+
+from chess import ChessArchive, ChessEngine
+
+MAGIC = b"PCPI"
+VERSION = 2  # 2: en passant only in position keys where the capture is legal
+KINDS = ("position", "pawns", "material")
+HEADER = struct.Struct("<4sHHII")
+KIND = struct.Struct("<QQQ")
+SEGMENT_SUFFIX = ".pidx"
+DEFAULT_CHUNK = 200  # games per worker task
+MATERIAL_PIECES = ("wQ", "wR", "wB", "wN", "wp", "bQ", "bR", "bB", "bN", "bp")
+MATERIAL_SHIFTS = {piece: 4 * index for index, piece in enumerate(MATERIAL_PIECES)}
+PAWN_KEYS = {"wp": ChessEngine.ZOBRIST_PIECES["wp"], "bp": ChessEngine.ZOBRIST_PIECES["bp"]}
+
+
+def pawn_key(board):
+    key = 0
+    for row in range(8):
+        for column, piece in enumerate(board[row]):
+            if piece[1] == "p":
+                key ^= PAWN_KEYS[piece][row * 8 + column]
+    return key
+
+
+def material_key(board):
+    key = 0
+    for rank in board:
+        for piece in rank:
+            shift = MATERIAL_SHIFTS.get(piece)
+            if shift is not None:
+                key += 1 << shift
+    return key
+
+
+"""
+Material key of a signature like "KRPvKR" (white pieces, "v", black pieces, kings optional)
+"""
+
+
+def material_key_from_text(text):
+    sides = text.upper().split("V")
+    if len(sides) != 2:
+        raise ValueError("Material signature {!r} is not like KRPvKR".format(text))
+    key = 0
+    for color, pieces in zip("wb", sides):
+        for letter in pieces:
+            if letter == "K":
+                continue
+            shift = MATERIAL_SHIFTS.get(color + (letter.lower() if letter == "P" else letter))
+            if shift is None:
+                raise ValueError("Unknown piece {!r} in material signature {!r}".format(letter, text))
+            key += 1 << shift
+    return key
+
+
+"""
+Keys of every ply of the games first to end - 1 of the archive, for each kind the (key, game) pairs
+sorted, as (keys, games) bytes. Runs in the worker processes.
+"""
+
+
+def index_games(archive_path, first, end):
+    entries = [set() for _ in KINDS]
+    position_entries, pawn_entries, material_entries = entries
+    with ChessArchive.GameArchive(archive_path) as archive:
+        for game in range(first, end):
+            game_state = ChessEngine.Game_state.from_fen(archive.start_fen(game))
+            game_state.disable_move_cache()
+            board = game_state.board
+            pawns = pawn_key(board)
+            material = material_key(board)
+            position_entries.add((game_state.position_key(), game))
+            pawn_entries.add((pawns, game))
+            material_entries.add((material, game))
+            for _, move in archive.replay(game, game_state):
+                position_entries.add((game_state.position_key(), game))
+                # only pawn moves and captures change the pawns or the material
+                if move.piece_moved[1] == "p" or move.piece_captured != "--":
+                    pawns = pawn_key(board)
+                    material = material_key(board)
+                    pawn_entries.add((pawns, game))
+                    material_entries.add((material, game))
+    results = []
+    for kind_entries in entries:
+        ordered = sorted(kind_entries)
+        keys = array("Q", [key for key, _ in ordered])
+        games = array("I", [game for _, game in ordered])
+        if sys.byteorder == "big":
+            keys.byteswap()
+            games.byteswap()
+        results.append((keys.tobytes(), games.tobytes()))
+    return results
+
+
+def _array(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _pad(file):
+    file.write(bytes(-file.tell() % 8))
+
+
+"""
+Writes a segment for games first to end - 1 from runs, for each kind a list of sorted (key, game) iterables.
+The file is written under a temporary name and renamed, readers never see half a segment.
+"""
+
+
+def write_segment(directory, first, end, runs):
+    path = os.path.join(directory, "segment-{:010d}-{:010d}{}".format(first, end, SEGMENT_SUFFIX))
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as file:
+        file.write(bytes(HEADER.size + KIND.size * len(KINDS)))
+        kinds = []
+        for kind_runs in runs:
+            keys = array("Q")
+            games = array("I")
+            for key, game in heapq.merge(*kind_runs):
+                keys.append(key)
+                games.append(game)
+            if sys.byteorder == "big":
+                keys.byteswap()
+                games.byteswap()
+            _pad(file)
+            keys_offset = file.tell()
+            file.write(keys.tobytes())
+            _pad(file)
+            games_offset = file.tell()
+            file.write(games.tobytes())
+            kinds.append((len(keys), keys_offset, games_offset))
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, len(KINDS), first, end))
+        for kind in kinds:
+            file.write(KIND.pack(*kind))
+    os.replace(temporary, path)
+    return path
+
+
+"""
+One memory mapped segment file
+"""
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, kinds, self.first_game, self.end_game = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or kinds != len(KINDS):
+            self.data.close()
+            raise ValueError("{} is not a position index segment".format(path))
+        if version != VERSION:
+            self.data.close()
+            raise ValueError("{} is from index version {}, build the index again".format(path, version))
+        view = self.view = memoryview(self.data)
+        self.keys = {}
+        self.games = {}
+        for index, kind in enumerate(KINDS):
+            entries, keys_offset, games_offset = KIND.unpack_from(self.data, HEADER.size + KIND.size * index)
+            if sys.byteorder == "big":  # the mapped arrays are little-endian, copy them in native order
+                self.keys[kind] = _array("Q", view[keys_offset:keys_offset + 8 * entries])
+                self.games[kind] = _array("I", view[games_offset:games_offset + 4 * entries])
+            else:
+                self.keys[kind] = view[keys_offset:keys_offset + 8 * entries].cast("Q")
+                self.games[kind] = view[games_offset:games_offset + 4 * entries].cast("I")
+
+    def find(self, kind, key):
+        keys = self.keys[kind]
+        return self.games[kind][bisect_left(keys, key):bisect_right(keys, key)].tolist()
+
+    """
+    Sorted (key, game) pairs of kind, for merging
+    """
+
+    def entries(self, kind):
+        return zip(self.keys[kind], self.games[kind])
+
+    def close(self):
+        for values in list(self.keys.values()) + list(self.games.values()):
+            if isinstance(values, memoryview):
+                values.release()  # the map can't be closed while views of it exist
+        self.keys.clear()
+        self.games.clear()
+        self.view.release()
+        self.data.close()
+
+
+class PositionIndex:
+    def __init__(self, directory):
+        self.directory = directory
+        self.segments = []
+        self.refresh()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    """
+    Opens segments written since the index was opened
+    """
+
+    def refresh(self):
+        known = {segment.path for segment in self.segments}
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if name.endswith(SEGMENT_SUFFIX) and path not in known:
+                    self.segments.append(Segment(path))
+        self.segments.sort(key=lambda segment: segment.first_game)
+
+    """
+    Games indexed: 0 to end_game() - 1
+    """
+
+    def end_game(self):
+        return max((segment.end_game for segment in self.segments), default=0)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+
+    """
+    Sorted ids of the games having key of kind ("position", "pawns" or "material") at some ply
+    """
+
+    def find(self, kind, key):
+        games = []
+        for segment in self.segments:  # game ranges don't overlap, the results stay sorted
+            games.extend(segment.find(kind, key))
+        return games
+
+    def find_position(self, fen):
+        return self.find("position", ChessEngine.Game_state.from_fen(fen).position_key())
+
+    def find_pawns(self, fen):
+        return self.find("pawns", pawn_key(ChessEngine.Game_state.from_fen(fen).board))
+
+    def find_material(self, signature):
+        return self.find("material", material_key_from_text(signature))
+
+    """
+    Games matching all the given conditions (a FEN for position and pawns, a signature like KRPvKR for material)
+    """
+
+    def query(self, position=None, pawns=None, material=None):
+        results = []
+        if position is not None:
+            results.append(self.find_position(position))
+        if pawns is not None:
+            results.append(self.find_pawns(pawns))
+        if material is not None:
+            results.append(self.find_material(material))
+        if not results:
+            raise ValueError("No condition given")
+        games = set(results[0]).intersection(*results[1:])
+        return sorted(games)
+
+
+"""
+Indexes the games of the archive that the index doesn't have yet (all of them for a new index) into a new segment,
+chunk games per task on workers processes. Returns (first game, end game), equal when there was nothing to do.
+"""
+
+
+def build(archive_path, directory, workers=None, chunk=DEFAULT_CHUNK):
+    os.makedirs(directory, exist_ok=True)
+    with PositionIndex(directory) as index:
+        first = index.end_game()
+    with ChessArchive.GameArchive(archive_path) as archive:
+        end = len(archive)
+    if first >= end:
+        return first, first
+    chunks = [(start, min(start + chunk, end)) for start in range(first, end, chunk)]
+    runs = [[] for _ in KINDS]
+    with ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(index_games, archive_path, start, stop) for start, stop in chunks]
+        for future in futures:
+            for kind_runs, (keys, games) in zip(runs, future.result()):
+                kind_runs.append(zip(_array("Q", keys), _array("I", games)))
+    write_segment(directory, first, end, runs)
+    return first, end
+
+
+"""
+Merges all segments of the index into one, returns the number of segments merged
+"""
+
+
+def compact(directory):
+    with PositionIndex(directory) as index:
+        segments = index.segments
+        if len(segments) < 2:
+            return len(segments)
+        runs = [[segment.entries(kind) for segment in segments] for kind in KINDS]
+        paths = [segment.path for segment in segments]
+        path = write_segment(directory, segments[0].first_game, index.end_game(), runs)
+    for old_path in paths:
+        if old_path != path:
+            os.remove(old_path)
+    return len(paths)
+
+
+"""
+Games of the archive that reached the position with key, found by replaying all of them
+"""
+
+
+def scan_position(archive, key):
+    games = []
+    for game in range(len(archive)):
+        game_state = ChessEngine.Game_state.from_fen(archive.start_fen(game))
+        game_state.disable_move_cache()
+        found = game_state.position_key() == key
+        for state, _ in archive.replay(game, game_state):
+            found = found or state.position_key() == key
+        if found:
+            games.append(game)
+    return games
+
+
+def benchmark(archive_path, directory, queries, seed=1):
+    rng = random.Random(seed)
+    with ChessArchive.GameArchive(archive_path) as archive, PositionIndex(directory) as index:
+        keys = []
+        for _ in range(queries):
+            game = rng.randrange(len(archive))
+            keys.append(archive.game_state(game, rng.randint(0, archive.plies(game))).position_key())
+        start = time.perf_counter()
+        found = [index.find("position", key) for key in keys]
+        query_seconds = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        scanned = scan_position(archive, keys[0])
+        scan_seconds = time.perf_counter() - start
+        if scanned != found[0]:
+            raise AssertionError("Index and replay disagree: {} != {}".format(found[0], scanned))
+        return {
+            "games": len(archive),
+            "segments": len(index.segments),
+            "queries": queries,
+            "query_ms": query_seconds * 1000,
+            "mean_matches": sum(map(len, found)) / queries,
+            "scan_ms": scan_seconds * 1000,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="index", description="position search index over a game archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="index the archive games not indexed yet")
+    build_parser.add_argument("archive_file")
+    build_parser.add_argument("index_directory")
+    build_parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    build_parser.add_argument("--chunk", type=int, default=DEFAULT_CHUNK, help="games per task (default: %(default)s)")
+    query_parser = commands.add_parser("query", help="games that reached a position, pawn structure or material")
+    query_parser.add_argument("index_directory")
+    query_parser.add_argument("--fen", help="position")
+    query_parser.add_argument("--pawns", help="FEN whose pawn structure is searched")
+    query_parser.add_argument("--material", help="material signature, e.g. KRPvKR")
+    query_parser.add_argument("--archive", dest="archive_file", help="print the tags of the games found")
+    compact_parser = commands.add_parser("compact", help="merge the index segments into one")
+    compact_parser.add_argument("index_directory")
+    bench_parser = commands.add_parser("bench", help="query time against replaying the archive")
+    bench_parser.add_argument("archive_file")
+    bench_parser.add_argument("index_directory")
+    bench_parser.add_argument("--queries", type=int, default=1000,
+                              help="random positions looked up (default: %(default)s)")
+    bench_parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        start = time.perf_counter()
+        first, end = build(args.archive_file, args.index_directory, args.workers, args.chunk)
+        if first == end:
+            print("{} games already indexed".format(end))
+        else:
+            print("indexed games {} to {} in {:.2f}s".format(first, end - 1, time.perf_counter() - start))
+    elif args.command == "query":
+        with PositionIndex(args.index_directory) as index:
+            start = time.perf_counter()
+            try:
+                games = index.query(args.fen, args.pawns, args.material)
+            except ValueError as error:
+                parser.error(str(error))
+            seconds = time.perf_counter() - start
+        print("{} games in {:.3f} ms".format(len(games), seconds * 1000))
+        if args.archive_file:
+            with ChessArchive.GameArchive(args.archive_file) as archive:
+                for game in games:
+                    headers = archive.headers(game)
+                    print("{:>8}  {} - {}  {}  {}".format(game, headers.get("White", "?"), headers.get("Black", "?"),
+                                                         headers.get("Event", "?"), headers["Result"]))
+        else:
+            print(" ".join(map(str, games)))
+    elif args.command == "compact":
+        print("{} segments merged".format(compact(args.index_directory)))
+    else:
+        results = benchmark(args.archive_file, args.index_directory, args.queries)
+        print("{} games in {} segments".format(results["games"], results["segments"]))
+        print("index query     {:10.3f} ms  ({:.1f} games found on average)".format(results["query_ms"],
+                                                                                   results["mean_matches"]))
+        print("replay all      {:10.3f} ms".format(results["scan_ms"]))
+        if args.json_file:
+            report = {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results,
+            }
+            if args.json_file == "-":
+                json.dump(report, sys.stdout, indent=2)
+                print()
+            else:
+                with open(args.json_file, "w") as file:
+                    json.dump(report, file, indent=2)
+    return 0
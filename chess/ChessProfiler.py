@@ -0,0 +1,73 @@
+"""
+Opt-in instrumentation of the hot paths. A Profiler is attached with Game_state.enable_profiler(), without one the
+hooks cost a single "is not None" test. Counters:
+    moves_generated     legal moves produced by generation (moves taken from the move cache not included)
+    legality_checks     square_under_attack() calls: king safety, en passant and check tests
+    make_move, undo_move
+    cache_hits, cache_misses   move cache lookups of get_valid_moves()
+    search_nodes        nodes searched by the AI
+Timers (calls, total seconds): get_valid_moves, ai_move (from asking the AI until its move arrives), frame.
+Results are exported with snapshot() (JSON ready), write_json() or log_line().
+"""
+
+import json
+import time
+
+COUNTERS = ("moves_generated", "legality_checks", "make_move", "undo_move", "cache_hits", "cache_misses",
+            "search_nodes")
+
+
+class Profiler:
+    def __init__(self):
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.timers = {}  # name -> [calls, seconds]
+        self.started = time.perf_counter()
+
+    def reset(self):
+        self.__init__()
+
+    def add_time(self, name, seconds):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = [0, 0.0]
+        timer[0] += 1
+        timer[1] += seconds
+
+    """
+    Adds the counters and timers of another profiler's snapshot(), e.g. from the AI worker process
+    """
+
+    def merge(self, snapshot):
+        for name, value in snapshot["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, timer in snapshot["timers"].items():
+            total = self.timers.setdefault(name, [0, 0.0])
+            total[0] += timer["calls"]
+            total[1] += timer["seconds"]
+
+    def mean_ms(self, name):
+        calls, seconds = self.timers.get(name, (0, 0.0))
+        return seconds / calls * 1000 if calls else 0.0
+
+    """
+    Search nodes per second of AI thinking time
+    """
+
+    def nodes_per_second(self):
+        seconds = self.timers.get("ai_move", (0, 0.0))[1]
+        return self.counters["search_nodes"] / seconds if seconds else 0.0
+
+    def snapshot(self):
+        timers = {name: {"calls": calls, "seconds": seconds, "mean_ms": self.mean_ms(name)}
+                  for name, (calls, seconds) in self.timers.items()}
+        return {"seconds": time.perf_counter() - self.started, "counters": dict(self.counters), "timers": timers}
+
+    def write_json(self, path):
+        with open(path, "w") as file:
+            json.dump(self.snapshot(), file, indent=2)
+
+    def log_line(self):
+        counters = " ".join("{}={}".format(name, value) for name, value in self.counters.items())
+        timers = " ".join("{}={:.3f}ms/{}".format(name, self.mean_ms(name), calls)
+                          for name, (calls, _) in self.timers.items())
+        return "{} {} nps={:.0f}".format(counters, timers, self.nodes_per_second())
@@ -0,0 +1,461 @@
+"""
+Session server hosting many games at once: asyncio, line delimited JSON over TCP or a Unix socket.
+Every request is one JSON object on a line, every response echoes its "id":
+    {"id": 1, "op": "new", "fen": FEN (optional), "legal": true (optional)}  -> {"id": 1, "ok": true, "game": "7", ...}
+    {"id": 2, "op": "move", "game": "7", "move": "e2e4"}
+    {"id": 3, "op": "undo", "game": "7"}
+    {"id": 4, "op": "ai", "game": "7", "movetime": 0.1}                  the AI moves, "move" in the response
+    {"id": 5, "op": "state", "game": "7"}
+    {"id": 6, "op": "close", "game": "7"}
+    {"id": 7, "op": "stats"}
+Game responses have fen, status (ongoing, checkmate, stalemate or the draw reason: threefold repetition,
+fifty move rule, insufficient material), plies and, with "legal": true, the legal moves.
+Errors are {"id": ..., "ok": false, "error": "..."}. Requests on one connection are handled concurrently,
+requests for the same game one after another.
+
+Move validation and search are CPU work and run in a process pool, the event loop only keeps sessions. A session
+holds the starting FEN, the current FEN and the moves as 16 bit codes (Move.encode), so a game costs a few hundred
+bytes plus two bytes per ply, games are limited to MAX_PLIES plies, and the least recently used games are closed
+when there are more than --max-games.
+
+Usage:
+    python main.py server serve [--host 127.0.0.1] [--port 8765] [--unix PATH] [--workers N] [--max-games N]
+    python main.py server loadtest [--host ...] [--port ...] [--unix PATH] [--sessions 1000] [--plies 20]
+                                   [--connections 8] [--ai-every N] [--json FILE]
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import sys
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from chess import ChessAIEngine, ChessEngine
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_GAMES = 100000
+MAX_PLIES = 1024
+MAX_MOVETIME = 10.0  # seconds, longer AI requests are cut to this
+MAX_IN_FLIGHT = 64  # requests of one connection handled at the same time, reading waits when there are more
+LINE_LIMIT = 64 * 1024
+INITIAL_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+AI_TABLE_SIZE_MB = 8  # transposition table of every worker process
+REPETITION_PLIES = 8  # reversible plies before a position can occur a third time
+
+
+class RequestError(Exception):
+    pass
+
+
+# Worker processes
+
+searcher = None  # Searcher of this worker process, shared by all games it searches
+
+
+def game_status(game_state, valid_moves):
+    if valid_moves:
+        return game_state.draw_reason() or "ongoing"
+    return "checkmate" if game_state.check_mate else "stalemate"
+
+
+def position_result(game_state, with_legal, move=None):
+    valid_moves = game_state.get_valid_moves()
+    result = {"fen": game_state.to_fen(), "status": game_status(game_state, valid_moves)}
+    if with_legal:
+        result["legal"] = [valid_move.get_chess_notation() for valid_move in valid_moves]
+    if move is not None:
+        result["move"] = move.get_chess_notation()
+        result["code"] = move.encode()
+    return result
+
+
+"""
+Position after the moves (Move.encode codes) from start_fen. The moves were checked when they were made,
+so they are decoded and made without generating moves.
+"""
+
+
+def replay(start_fen, codes):
+    game_state = ChessEngine.Game_state.from_fen(start_fen)
+    for code in codes:
+        game_state.make_move(ChessEngine.Move.decode(code, game_state.board))
+    return game_state
+
+
+"""
+Runs in the pool: operation on the position fen (or start_fen and codes replayed, for undo and when a repetition
+is possible). Moves are refused once the game is drawn. Returns the new position (see position_result), with "code"
+of the move made for move and ai, or {"error": ...}.
+"""
+
+
+def run_job(operation, fen, argument=None, with_legal=False, start_fen=None, codes=b""):
+    global searcher
+    try:
+        moves = array("H")
+        moves.frombytes(codes)
+        if operation == "undo":
+            return position_result(replay(start_fen, moves), with_legal)
+        game_state = ChessEngine.Game_state.from_fen(fen)
+        # repetitions need the earlier positions, the FEN is enough until REPETITION_PLIES reversible plies
+        # (counting the move of this job) have been played
+        if moves and game_state.halfmove_clock + 1 >= REPETITION_PLIES:
+            game_state = replay(start_fen, moves)
+    except ValueError as error:
+        return {"error": str(error)}
+    game_state.disable_move_cache()  # one position per job, nothing to reuse
+    if operation == "position":
+        return position_result(game_state, with_legal)
+    valid_moves = game_state.get_valid_moves()
+    if game_state.draw_reason() is not None:
+        return {"error": "game is over"}
+    if operation == "move":
+        move = next((move for move in valid_moves if move.get_chess_notation() == argument), None)
+        if move is None:
+            return {"error": "illegal move {}".format(argument)}
+    elif operation == "ai":
+        if not valid_moves:
+            return {"error": "game is over"}
+        if searcher is None:
+            searcher = ChessAIEngine.Searcher(AI_TABLE_SIZE_MB)
+        move = searcher.search(game_state, valid_moves, argument)
+    else:
+        return {"error": "unknown operation {}".format(operation)}
+    game_state.make_move(move)
+    return position_result(game_state, with_legal, move)
+
+
+# Server
+
+
+class Session:
+    __slots__ = ("start_fen", "fen", "codes", "status", "lock")
+
+    def __init__(self, start_fen, fen, status):
+        self.start_fen = start_fen
+        self.fen = fen
+        self.codes = array("H")  # moves made, Move.encode()
+        self.status = status
+        self.lock = asyncio.Lock()
+
+    def state(self):
+        return {"fen": self.fen, "status": self.status, "plies": len(self.codes)}
+
+
+class SessionServer:
+    def __init__(self, workers=None, max_games=DEFAULT_MAX_GAMES):
+        self.workers = workers
+        self.pool = ProcessPoolExecutor(workers)
+        self.max_games = max_games
+        self.sessions = OrderedDict()  # game id -> Session, least recently used first
+        self.game_ids = itertools.count(1)
+        self.requests = 0
+        self.errors = 0
+        self.evicted = 0
+        self.connections = 0
+        self.started = time.perf_counter()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    """
+    Runs run_job(*job) in the pool. A worker that died breaks the whole pool, it is replaced by a new one (once,
+    by the first request that fails with it) and the error goes on to the client.
+    """
+
+    async def run_in_pool(self, *job):
+        pool = self.pool
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(pool, run_job, *job)
+        except BrokenProcessPool:
+            if self.pool is pool:
+                self.pool = ProcessPoolExecutor(self.workers)
+                pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        if "error" in result:
+            raise RequestError(result["error"])
+        return result
+
+    def session(self, request):
+        session = self.sessions.get(str(request.get("game")))
+        if session is None:
+            raise RequestError("no game {}".format(request.get("game")))
+        self.sessions.move_to_end(str(request["game"]))
+        return session
+
+    def add_session(self, session):
+        game_id = str(next(self.game_ids))
+        self.sessions[game_id] = session
+        while len(self.sessions) > self.max_games:
+            self.sessions.popitem(last=False)
+            self.evicted += 1
+        return game_id
+
+    async def handle(self, request):
+        operation = request.get("op")
+        with_legal = bool(request.get("legal"))
+        if operation == "new":
+            fen = request.get("fen") or INITIAL_FEN
+            result = await self.run_in_pool("position", fen, None, with_legal)
+            session = Session(fen, result["fen"], result["status"])
+            result.update(game=self.add_session(session), plies=0)
+            return result
+        if operation == "stats":
+            return self.stats()
+        session = self.session(request)
+        if operation == "state":
+            if not with_legal:
+                return session.state()
+            async with session.lock:
+                return dict(session.state(), **await self.run_in_pool("position", session.fen, None, True,
+                                                                      session.start_fen, session.codes.tobytes()))
+        if operation == "close":
+            del self.sessions[str(request["game"])]
+            return {}
+        async with session.lock:  # moves of one game one after another
+            if operation in ("move", "ai"):
+                if len(session.codes) >= MAX_PLIES:
+                    raise RequestError("game is limited to {} plies".format(MAX_PLIES))
+                argument = str(request.get("move")) if operation == "move" else \
+                    min(float(request.get("movetime", 0.1)), MAX_MOVETIME)
+                result = await self.run_in_pool(operation, session.fen, argument, with_legal, session.start_fen,
+                                                session.codes.tobytes())
+                session.codes.append(result.pop("code"))
+            elif operation == "undo":
+                if not session.codes:
+                    raise RequestError("no move to undo")
+                codes = session.codes[:-1]
+                result = await self.run_in_pool("undo", None, None, with_legal, session.start_fen, codes.tobytes())
+                session.codes = codes
+            else:
+                raise RequestError("unknown op {!r}".format(operation))
+            session.fen = result["fen"]
+            session.status = result["status"]
+            result["plies"] = len(session.codes)
+            return result
+
+    async def respond(self, line, writer, in_flight):
+        try:
+            request = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise RequestError("request must be a JSON object")
+                response = dict(await self.handle(request), ok=True)
+            except Exception as error:  # anything else (a crashed worker) must still answer the request id
+                self.errors += 1
+                response = {"ok": False, "error": str(error) or type(error).__name__}
+            if isinstance(request, dict) and "id" in request:
+                response["id"] = request["id"]
+            writer.write(json.dumps(response).encode() + b"\n")
+        finally:
+            in_flight.release()
+
+    async def serve_connection(self, reader, writer):
+        self.connections += 1
+        in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                self.requests += 1
+                await in_flight.acquire()
+                task = asyncio.ensure_future(self.respond(line, writer, in_flight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                await writer.drain()
+            if tasks:
+                await asyncio.wait(tasks)
+            await writer.drain()
+        except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+            pass  # client went away or sent a line over LINE_LIMIT
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    def stats(self):
+        return {"games": len(self.sessions), "max_games": self.max_games, "evicted": self.evicted,
+                "requests": self.requests, "errors": self.errors, "connections": self.connections,
+                "seconds": time.perf_counter() - self.started}
+
+
+async def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None, workers=None, max_games=DEFAULT_MAX_GAMES):
+    server = SessionServer(workers, max_games)
+    try:
+        if unix_path is not None:
+            listener = await asyncio.start_unix_server(server.serve_connection, unix_path, limit=LINE_LIMIT)
+            print("Listening on {}".format(unix_path), flush=True)
+        else:
+            listener = await asyncio.start_server(server.serve_connection, host, port, limit=LINE_LIMIT)
+            print("Listening on {}:{}".format(host, port), flush=True)
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        server.close()
+
+
+# Load test client
+
+
+class Client:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}  # request id -> future of the response
+        self.request_ids = itertools.count(1)
+        self.receiver = asyncio.ensure_future(self.receive())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, unix_path=None):
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_path, limit=LINE_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+        return cls(reader, writer)
+
+    async def receive(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            response = json.loads(line)
+            future = self.pending.pop(response.get("id"), None)
+            if future is not None:
+                future.set_result(response)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, operation, **arguments):
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(json.dumps(dict(arguments, id=request_id, op=operation)).encode() + b"\n")
+        await self.writer.drain()
+        return await future
+
+    async def close(self):
+        self.writer.close()
+        await self.receiver
+
+
+async def play_session(client, rng, plies, ai_every, latencies, failures):
+    async def timed(operation, **arguments):
+        start = time.perf_counter()
+        response = await client.request(operation, **arguments)
+        latencies.append(time.perf_counter() - start)
+        if not response["ok"]:
+            failures.append(response["error"])
+        return response
+
+    response = await timed("new", legal=True)
+    if not response["ok"]:
+        return
+    game = response["game"]
+    for ply in range(plies):
+        if response["status"] != "ongoing":
+            break
+        if ai_every and ply % ai_every == ai_every - 1:
+            response = await timed("ai", game=game, movetime=0.01, legal=True)
+        else:
+            response = await timed("move", game=game, move=rng.choice(response["legal"]), legal=True)
+        if not response["ok"]:
+            return
+    await timed("undo", game=game)
+    await timed("state", game=game)
+    await timed("close", game=game)
+
+
+"""
+Plays sessions games of random moves (and an AI move every ai_every plies) at the same time,
+spread over connections connections. Returns request count, throughput and latency percentiles.
+"""
+
+
+async def load_test(sessions=1000, plies=20, connections=8, ai_every=0, host=DEFAULT_HOST, port=DEFAULT_PORT,
+                    unix_path=None, seed=0):
+    rng = random.Random(seed)
+    clients = [await Client.connect(host, port, unix_path) for _ in range(connections)]
+    latencies = []
+    failures = []
+    start = time.perf_counter()
+    await asyncio.gather(*(play_session(clients[index % connections], random.Random(rng.getrandbits(32)), plies,
+                                        ai_every, latencies, failures) for index in range(sessions)))
+    seconds = time.perf_counter() - start
+    stats = (await clients[0].request("stats"))
+    for client in clients:
+        await client.close()
+    latencies.sort()
+
+    def percentile(fraction):
+        return latencies[min(int(fraction * len(latencies)), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {"sessions": sessions, "plies": plies, "connections": connections, "requests": len(latencies),
+            "errors": len(failures), "first_errors": failures[:5], "seconds": seconds,
+            "requests_per_second": len(latencies) / seconds if seconds else 0.0,
+            "latency_ms": {"p50": percentile(0.5), "p90": percentile(0.9), "p99": percentile(0.99),
+                           "max": percentile(1.0)},
+            "server": stats}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="server", description="multi-game session server")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="run the server")
+    load_parser = commands.add_parser("loadtest", help="simulate many sessions against a running server")
+    for command in (serve_parser, load_parser):
+        command.add_argument("--host", default=DEFAULT_HOST)
+        command.add_argument("--port", type=int, default=DEFAULT_PORT)
+        command.add_argument("--unix", dest="unix_path", help="Unix socket path instead of TCP")
+    serve_parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    serve_parser.add_argument("--max-games", type=int, default=DEFAULT_MAX_GAMES,
+                              help="games kept, least recently used are closed (default: %(default)s)")
+    load_parser.add_argument("--sessions", type=int, default=1000, help="games played at once (default: %(default)s)")
+    load_parser.add_argument("--plies", type=int, default=20, help="plies per game (default: %(default)s)")
+    load_parser.add_argument("--connections", type=int, default=8, help="connections used (default: %(default)s)")
+    load_parser.add_argument("--ai-every", type=int, default=0, help="every N-th ply is an AI move (default: none)")
+    load_parser.add_argument("--seed", type=int, default=0)
+    load_parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        try:
+            asyncio.run(serve(args.host, args.port, args.unix_path, args.workers, args.max_games))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if args.unix_path is not None and os.path.exists(args.unix_path):
+                os.remove(args.unix_path)
+        return 0
+
+    result = asyncio.run(load_test(args.sessions, args.plies, args.connections, args.ai_every, args.host, args.port,
+                                   args.unix_path, args.seed))
+    print("{requests} requests in {seconds:.2f}s, {requests_per_second:.0f} requests/s, {errors} errors".format(
+        **result))
+    print("latency ms  p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  max {max:.2f}".format(**result["latency_ms"]))
+    if args.json_file:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "results": result,
+        }
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_file, "w") as file:
+                json.dump(report, file, indent=2)
+    return 0 if result["errors"] == 0 else 1
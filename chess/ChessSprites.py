@@ -0,0 +1,145 @@
+"""
+Piece sprites: images are found relative to this package (not the current directory), loaded from disk the first
+time a piece is drawn and converted to the pixel format of the display (convert_alpha) so that blits don't convert
+on every frame. Scaled sprites are kept for every square size in a bounded LRU cache, resizing the window scales
+the loaded images again instead of reading the files.
+
+Usage:
+    python main.py sprites [--size PIXELS] [--frames N] [--json FILE]    load and blit benchmark
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from collections import OrderedDict
+
+import pygame as game
+
+IMAGES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "images")
+PIECES = ("wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+
+
+class SpriteCache:
+    DEFAULT_CAPACITY = 4 * len(PIECES)  # scaled sprites of four square sizes
+
+    def __init__(self, directory=IMAGES_DIRECTORY, capacity=DEFAULT_CAPACITY):
+        self.directory = directory
+        self.capacity = capacity
+        self.images = {}  # piece -> image as loaded, converted to the display format
+        self.scaled = OrderedDict()  # (piece, size) -> scaled sprite, least recently used first
+        self.loads = 0
+        self.hits = 0
+        self.misses = 0
+
+    """
+    Image of piece at its original size. The display mode has to be set, convert_alpha() needs the pixel format.
+    """
+
+    def image(self, piece):
+        image = self.images.get(piece)
+        if image is None:
+            image = game.image.load(os.path.join(self.directory, piece + ".png"))
+            if game.display.get_surface() is not None:
+                image = image.convert_alpha()
+            self.images[piece] = image
+            self.loads += 1
+        return image
+
+    """
+    Sprite of piece scaled to size x size pixels
+    """
+
+    def get(self, piece, size):
+        key = (piece, size)
+        sprite = self.scaled.get(key)
+        if sprite is not None:
+            self.scaled.move_to_end(key)
+            self.hits += 1
+            return sprite
+        self.misses += 1
+        sprite = game.transform.smoothscale(self.image(piece), (size, size))
+        self.scaled[key] = sprite
+        if len(self.scaled) > self.capacity:
+            self.scaled.popitem(last=False)
+        return sprite
+
+    def clear(self):
+        self.images.clear()
+        self.scaled.clear()
+
+    def stats(self):
+        return {"capacity": self.capacity, "size": len(self.scaled), "loads": self.loads, "hits": self.hits,
+                "misses": self.misses}
+
+
+"""
+Seconds per blit of every piece sprite onto screen, frames times
+"""
+
+
+def time_blits(screen, sprites, frames):
+    start = time.perf_counter()
+    for _ in range(frames):
+        for index, sprite in enumerate(sprites):
+            screen.blit(sprite, (index % 8 * sprite.get_width(), index // 8 * sprite.get_height()))
+    return (time.perf_counter() - start) / (frames * len(sprites))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="sprites", description="piece sprite loading and blitting benchmark")
+    parser.add_argument("--size", type=int, default=50, help="square size in pixels (default: %(default)s)")
+    parser.add_argument("--frames", type=int, default=1000, help="frames of 12 blits timed (default: %(default)s)")
+    parser.add_argument("--json", dest="json_file", help="write results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    game.init()
+    screen = game.display.set_mode((8 * args.size, 8 * args.size))
+    cache = SpriteCache()
+    start = time.perf_counter()
+    for piece in PIECES:
+        cache.get(piece, args.size)
+    first_load = time.perf_counter() - start
+    start = time.perf_counter()
+    for piece in PIECES:
+        cache.get(piece, args.size + 10)
+    rescale = time.perf_counter() - start
+    start = time.perf_counter()
+    for piece in PIECES:
+        cache.get(piece, args.size)
+    cached = time.perf_counter() - start
+    # sprites as ChessMain used to load them: not converted to the display format
+    unconverted = [game.transform.scale(game.image.load(os.path.join(IMAGES_DIRECTORY, piece + ".png")),
+                                        (args.size, args.size)) for piece in PIECES]
+    results = {
+        "load_ms": first_load * 1000,
+        "rescale_ms": rescale * 1000,
+        "cached_ms": cached * 1000,
+        "blit_converted_us": time_blits(screen, [cache.get(piece, args.size) for piece in PIECES], args.frames) * 1e6,
+        "blit_unconverted_us": time_blits(screen, unconverted, args.frames) * 1e6,
+        "cache": cache.stats(),
+    }
+    print("load and scale 12 sprites   {:8.3f} ms".format(results["load_ms"]))
+    print("scale to a new size         {:8.3f} ms".format(results["rescale_ms"]))
+    print("cached lookups              {:8.3f} ms".format(results["cached_ms"]))
+    print("blit, display format        {:8.3f} us".format(results["blit_converted_us"]))
+    print("blit, file format           {:8.3f} us".format(results["blit_unconverted_us"]))
+    game.quit()
+
+    if args.json_file:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "size": args.size,
+            "results": results,
+        }
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_file, "w") as file:
+                json.dump(report, file, indent=2)
+    return 0
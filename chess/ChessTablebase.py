@@ -0,0 +1,195 @@
+"""
+Endgame tablebases for a king and up to two pieces against a lone king (KQK, KRK, KPK, KBNK, ...).
+Every table stores one byte per position with distance to mate (DTM) and win/draw/loss for the side to move.
+Tables are generated by ChessTablebaseGenerator (python main.py tablebase ...) and probed here through mmap,
+only the bytes looked up are read, and processes using the same files share their pages.
+
+Table layout: in the table frame the strong side is white. Position index is
+    side * table_half + ((king slot * 64 + weak king) * 64 + piece 1) * 64 + piece 2 ...
+side 0 is white (strong side) to move, square index is row * 8 + column like everywhere else. Only positions with
+the strong king on king_squares() are stored, the others are mirrored onto them (files only when there are pawns).
+Byte values: 0 draw, 1-127 side to move mates in that many moves, 128-254 side to move is mated in
+(value - 128) moves, 255 position can't happen.
+"""
+
+import mmap
+import os
+
+PIECE_ORDER = "QRBNP"  # order of the strong pieces in table names and indexes
+DRAW = 0
+LOSS = 128
+INVALID = 255
+MAX_PIECES = 4  # kings included
+DEFAULT_TABLES = ("Q", "R", "P", "BN")
+TABLE_SUFFIX = ".tb"
+
+# strong king squares that are stored: a8-d8-d5 triangle for pawnless tables, files a-d with pawns
+TRIANGLE = tuple(row * 8 + column for row in range(4) for column in range(row, 4))
+QUEEN_SIDE = tuple(row * 8 + column for row in range(8) for column in range(4))
+KING_SLOTS = {False: {square: slot for slot, square in enumerate(TRIANGLE)},
+              True: {square: slot for slot, square in enumerate(QUEEN_SIDE)}}
+
+
+def table_name(pieces):
+    return "K" + pieces + "K"
+
+
+"""
+Strong pieces in table order, e.g. "NB" -> "BN"
+"""
+
+
+def normalize(pieces):
+    return "".join(sorted(pieces, key=PIECE_ORDER.index))
+
+
+"""
+A lone king with nothing, one bishop or one knight can't mate, these endings are draws without a table
+"""
+
+
+def insufficient_material(pieces):
+    return pieces in ("", "B", "N")
+
+
+def king_squares(pieces):
+    return QUEEN_SIDE if "P" in pieces else TRIANGLE
+
+
+"""
+Positions for one side to move
+"""
+
+
+def table_half(pieces):
+    return len(king_squares(pieces)) * 64 ** (len(pieces) + 1)
+
+
+"""
+Squares [strong king, weak king, pieces...] moved by symmetry so that the strong king is on a stored square
+"""
+
+
+def canonical_squares(squares, pawns):
+    if squares[0] & 7 > 3:
+        squares = [square ^ 7 for square in squares]  # mirror files
+    if not pawns:
+        if squares[0] >> 3 > 3:
+            squares = [square ^ 56 for square in squares]  # mirror rows
+        if squares[0] >> 3 > squares[0] & 7:
+            squares = [(square & 7) << 3 | square >> 3 for square in squares]  # mirror along the diagonal
+    return squares
+
+
+def table_index(pieces, squares, side):
+    pawns = "P" in pieces
+    squares = canonical_squares(squares, pawns)
+    index = KING_SLOTS[pawns][squares[0]]
+    for square in squares[1:]:
+        index = index * 64 + square
+    return side * table_half(pieces) + index
+
+
+"""
+(wdl, plies) for the side to move: wdl is 1 win, 0 draw, -1 loss, plies is the distance to mate
+"""
+
+
+def decode_value(value):
+    if value == DRAW:
+        return 0, 0
+    if value < LOSS:
+        return 1, 2 * value - 1
+    if value < INVALID:
+        return -1, 2 * (value - LOSS)
+    return None
+
+
+class Tablebase:
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}  # strong pieces -> mmap, None when the table isn't there
+
+    def table(self, pieces):
+        if pieces not in self.tables:
+            path = os.path.join(self.directory, table_name(pieces) + TABLE_SUFFIX)
+            table = None
+            if os.path.exists(path):
+                with open(path, "rb") as file:
+                    if os.fstat(file.fileno()).st_size != 2 * table_half(pieces):
+                        raise ValueError("{} has the wrong size, regenerate it".format(path))
+                    table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)  # stays valid after close
+            self.tables[pieces] = table
+        return self.tables[pieces]
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        self.tables = {}
+
+    """
+    (wdl, plies) for the side to move in game_state, see decode_value(). None if the position isn't covered:
+    too many pieces, pieces on both sides, or the table isn't generated. Castling rights are not taken into account.
+    """
+
+    def probe(self, game_state):
+        board = game_state.board
+        if sum(board_row.count("--") for board_row in board) < 64 - MAX_PIECES:
+            return None  # quick way out for the search, which probes every node
+        pieces = []
+        for row in range(8):
+            board_row = board[row]
+            for column in range(8):
+                if board_row[column] != "--":
+                    pieces.append((board_row[column], row * 8 + column))
+        if len(pieces) > MAX_PIECES:
+            return None
+        strong_color = None
+        for piece, _ in pieces:
+            if piece[1] != "K":
+                if strong_color is not None and piece[0] != strong_color:
+                    return None  # both sides have pieces
+                strong_color = piece[0]
+        if strong_color is None:
+            return 0, 0
+        strong = normalize("".join(piece[1].upper() for piece, _ in pieces if piece[1] != "K"))  # "p" is a pawn
+        if insufficient_material(strong):
+            return 0, 0
+        table = self.table(strong)
+        if table is None:
+            return None
+
+        weak_color = "b" if strong_color == "w" else "w"
+        flip = 56 if strong_color == "b" else 0  # black strong side: mirror rows so that its pawns go up the board
+        squares = [next(square for piece, square in pieces if piece == strong_color + "K") ^ flip,
+                   next(square for piece, square in pieces if piece == weak_color + "K") ^ flip]
+        for piece_type in strong:
+            for piece, square in pieces:
+                if piece[0] == strong_color and piece[1].upper() == piece_type and square ^ flip not in squares[2:]:
+                    squares.append(square ^ flip)
+                    break
+        side = 0 if game_state.white_to_move == (strong_color == "w") else 1
+        return decode_value(table[table_index(strong, squares, side)])
+
+    """
+    Best move by the tables: the fastest win, otherwise a draw, otherwise the longest loss.
+    Returns (move, (wdl, plies)) from the point of view of the side to move, None if the position isn't covered.
+    """
+
+    def best_move(self, game_state, valid_moves):
+        if not valid_moves or self.probe(game_state) is None:
+            return None
+        best = None
+        for move in valid_moves:
+            game_state.make_move(move)
+            result = self.probe(game_state)
+            game_state.undo_move()
+            if result is None:
+                return None
+            wdl, plies = -result[0], result[1] + 1
+            # wins sort first and shortest first, losses last and longest first
+            rank = (wdl, -plies if wdl > 0 else plies if wdl < 0 else 0)
+            if best is None or rank > best[0]:
+                best = (rank, move, (wdl, plies if wdl else 0))
+        return best[1], best[2]
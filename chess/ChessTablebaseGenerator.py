@@ -0,0 +1,442 @@
+"""
+Generates the endgame tables probed by ChessTablebase, by retrograde analysis with NumPy.
+Starting from the checkmates, positions are decided backwards one ply at a time: a white (strong side) position
+is won when some move reaches a lost black position, a black position is lost when every black move reaches a won
+white position (a counter of undecided moves per position). Positions never decided are draws.
+Captures by the lone king and promotions go to smaller tables, which are generated first.
+
+Tables are generated in parallel worker processes, as soon as the tables they depend on are done.
+Every table is written to a temporary file and renamed when it is complete, tables that already exist are
+skipped, so an interrupted run continues where it stopped.
+
+Usage:
+    python main.py tablebase [TABLE...] [--directory DIR] [--workers N]
+TABLE is e.g. KQK or KBNK (default: KQK KRK KPK KBNK and the tables they need).
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from chess import ChessEngine
+from chess import ChessTablebase as Tablebase
+
+DEFAULT_DIRECTORY = "tablebases"
+CHUNK = 1 << 20  # positions handled at once, bounds the memory of temporary arrays
+UNDECIDED = -1
+INVALID = -2
+FINAL_DRAW = -3  # stalemate, decided but never a predecessor of anything
+
+
+def _target_table(offsets):
+    table = np.full((64, len(offsets)), -1, dtype=np.int64)
+    for square in range(64):
+        for index, (row_offset, column_offset) in enumerate(offsets):
+            row, column = (square >> 3) + row_offset, (square & 7) + column_offset
+            if 0 <= row < 8 and 0 <= column < 8:
+                table[square, index] = row * 8 + column
+    return table
+
+
+SLIDER_DIRECTIONS = ChessEngine.ROOK_DIRECTIONS + ChessEngine.BISHOP_DIRECTIONS
+DIRECTION_INDEXES = {"R": range(0, 4), "B": range(4, 8), "Q": range(0, 8)}
+TARGETS = {"K": _target_table(ChessEngine.KING_MOVES), "N": _target_table(ChessEngine.KNIGHT_MOVES)}
+BITS = np.array([1 << square for square in range(64)], dtype=np.uint64)
+RAYS = np.full((64, 8, 7), -1, dtype=np.int64)  # square, direction, step -> square, -1 off the board
+BETWEEN = np.zeros((64, 64), dtype=np.uint64)  # squares strictly between two squares on a line
+ATTACKS = {piece_type: np.zeros((64, 64), dtype=bool) for piece_type in "KNBRQP"}  # on an empty board
+for _square in range(64):
+    for _direction, (_row_step, _column_step) in enumerate(SLIDER_DIRECTIONS):
+        _between = 0
+        for _step in range(7):
+            _row, _column = (_square >> 3) + _row_step * (_step + 1), (_square & 7) + _column_step * (_step + 1)
+            if not (0 <= _row < 8 and 0 <= _column < 8):
+                break
+            _target = _row * 8 + _column
+            RAYS[_square, _direction, _step] = _target
+            BETWEEN[_square, _target] = _between
+            _between |= 1 << _target
+            for _piece_type in "RBQ":
+                if _direction in DIRECTION_INDEXES[_piece_type]:
+                    ATTACKS[_piece_type][_square, _target] = True
+    for _piece_type in "KN":
+        for _target in TARGETS[_piece_type][_square]:
+            if _target >= 0:
+                ATTACKS[_piece_type][_square, _target] = True
+    if _square >= 8:  # white pawns capture up the board (towards row 0)
+        if _square & 7 > 0:
+            ATTACKS["P"][_square, _square - 9] = True
+        if _square & 7 < 7:
+            ATTACKS["P"][_square, _square - 7] = True
+KING_SLOT_ARRAYS = {pawns: np.array([slots.get(square, -1) for square in range(64)], dtype=np.int64)
+                    for pawns, slots in Tablebase.KING_SLOTS.items()}
+
+
+"""
+Tables needed to generate the table: after a capture by the lone king and after a promotion
+"""
+
+
+def dependencies(pieces):
+    needed = set()
+    for index in range(len(pieces)):
+        needed.add(Tablebase.normalize(pieces[:index] + pieces[index + 1:]))
+        if pieces[index] == "P":
+            for promotion in "QRBN":
+                needed.add(Tablebase.normalize(pieces[:index] + promotion + pieces[index + 1:]))
+    return {needed_pieces for needed_pieces in needed if not Tablebase.insufficient_material(needed_pieces)}
+
+
+class TableGenerator:
+    def __init__(self, pieces, directory):
+        self.pieces = pieces
+        self.types = "KK" + pieces  # strong king, weak king, strong pieces
+        self.count = len(self.types)
+        self.size = 64 ** self.count
+        self.shifts = [6 * (self.count - 1 - piece) for piece in range(self.count)]
+        self.directory = directory
+        self.subtables = {}
+
+    def squares(self, indexes):
+        return [(indexes >> shift) & 63 for shift in self.shifts]
+
+    def occupancy(self, squares):
+        occupied = BITS[squares[0]]
+        for square in squares[1:]:
+            occupied = occupied | BITS[square]
+        return occupied
+
+    """
+    Which targets are attacked by the strong side, optionally without the piece with index `captured`
+    """
+
+    def attacked(self, target, squares, occupied, captured=None):
+        result = np.zeros(len(target), dtype=bool)
+        for piece, piece_type in enumerate(self.types):
+            if piece == 1 or piece == captured:
+                continue
+            attack = ATTACKS[piece_type][squares[piece], target]
+            if piece_type in "RBQ":
+                attack &= (BETWEEN[squares[piece], target] & occupied) == 0
+            result |= attack
+        return result
+
+    """
+    Positions that can happen: pieces on different squares, kings apart, pawns not on the first or last row,
+    and with white to move (side 0) the black king not in check
+    """
+
+    def valid(self, squares, side):
+        result = ~ATTACKS["K"][squares[0], squares[1]]
+        for first in range(self.count):
+            for second in range(first + 1, self.count):
+                result &= squares[first] != squares[second]
+            if self.types[first] == "P":
+                result &= (squares[first] >= 8) & (squares[first] < 56)
+        if side == 0:
+            result &= ~self.attacked(squares[1], squares, self.occupancy(squares))
+        return result
+
+    """
+    Bytes of an already generated smaller table at the positions given by piece types and squares
+    """
+
+    def lookup(self, types, squares, side):
+        order = sorted(range(2, len(types)), key=lambda piece: Tablebase.PIECE_ORDER.index(types[piece]))
+        pieces = "".join(types[piece] for piece in order)
+        squares = squares[:2] + [squares[piece] for piece in order]
+        if pieces not in self.subtables:
+            path = os.path.join(self.directory, Tablebase.table_name(pieces) + Tablebase.TABLE_SUFFIX)
+            self.subtables[pieces] = np.memmap(path, dtype=np.uint8, mode="r")
+        pawns = "P" in pieces
+        mirror = (squares[0] & 7) > 3
+        squares = [np.where(mirror, square ^ 7, square) for square in squares]
+        if not pawns:
+            mirror = (squares[0] >> 3) > 3
+            squares = [np.where(mirror, square ^ 56, square) for square in squares]
+            mirror = (squares[0] >> 3) > (squares[0] & 7)
+            squares = [np.where(mirror, (square & 7) << 3 | square >> 3, square) for square in squares]
+        index = KING_SLOT_ARRAYS[pawns][squares[0]]
+        for square in squares[1:]:
+            index = index * 64 + square
+        return self.subtables[pieces][side * Tablebase.table_half(pieces) + index]
+
+    """
+    Sets up both sides: invalid positions, legal black moves per position, checkmates and stalemates, and the
+    results that come from smaller tables (captures by the lone king, promotions) as events for later plies
+    """
+
+    def initialize(self):
+        self.white = np.full(self.size, UNDECIDED, dtype=np.int16)  # plies to mate for won positions
+        self.black = np.full(self.size, UNDECIDED, dtype=np.int16)  # plies to mate for lost positions
+        self.moves_left = np.zeros(self.size, dtype=np.int8)  # black moves that don't lead to a known white win
+        self.white_events = {}  # plies -> white positions won in that many plies through a promotion
+        self.black_events = {}  # plies -> black positions with a capture into a white win in that many plies
+        for start in range(0, self.size, CHUNK):
+            indexes = np.arange(start, min(start + CHUNK, self.size), dtype=np.int64)
+            squares = self.squares(indexes)
+            valid = self.valid(squares, 0)
+            self.white[indexes[~valid]] = INVALID
+            self.initialize_promotions(indexes[valid], [square[valid] for square in squares])
+            valid = self.valid(squares, 1)
+            self.black[indexes[~valid]] = INVALID
+            self.initialize_black(indexes[valid], [square[valid] for square in squares])
+
+    def initialize_black(self, indexes, squares):
+        occupied = self.occupancy(squares) & ~BITS[squares[1]]  # the king doesn't block attacks on its new square
+        in_check = self.attacked(squares[1], squares, occupied | BITS[squares[1]])
+        moves = np.zeros(len(indexes), dtype=np.int8)
+        for direction in range(8):
+            target = TARGETS["K"][squares[1], direction]
+            on_board = target >= 0
+            target = np.where(on_board, target, 0)
+            legal = on_board & ~self.attacked(target, squares, occupied)
+            for piece in range(2, self.count):
+                capture = on_board & (target == squares[piece])
+                if not capture.any():
+                    continue
+                safe = ~self.attacked(target[capture], [square[capture] for square in squares], occupied[capture],
+                                      captured=piece)
+                legal[capture] = safe
+                remaining = self.types[:piece] + self.types[piece + 1:]
+                if Tablebase.insufficient_material(remaining[2:]) or not safe.any():
+                    continue
+                after = [square[capture][safe] for square in squares]
+                after[1] = target[capture][safe]
+                del after[piece]
+                values = self.lookup(remaining, after, 0).astype(np.int64)
+                won = (values > 0) & (values < Tablebase.LOSS)
+                for plies in np.unique(2 * values[won] - 1):
+                    self.black_events.setdefault(int(plies), []).append(
+                        indexes[capture][safe][won][2 * values[won] - 1 == plies])
+            moves += legal
+        self.moves_left[indexes] = moves
+        self.black[indexes[(moves == 0) & in_check]] = 0
+        self.black[indexes[(moves == 0) & ~in_check]] = FINAL_DRAW
+
+    def initialize_promotions(self, indexes, squares):
+        occupied = self.occupancy(squares)
+        for piece in range(2, self.count):
+            if self.types[piece] != "P":
+                continue
+            target = squares[piece] - 8
+            promoting = ((squares[piece] >> 3) == 1) & ((occupied & BITS[np.maximum(target, 0)]) == 0)
+            if not promoting.any():
+                continue
+            for promotion in "QRBN":
+                types = self.types[:piece] + promotion + self.types[piece + 1:]
+                if Tablebase.insufficient_material(types[2:]):
+                    continue
+                after = [square[promoting] for square in squares]
+                after[piece] = target[promoting]
+                values = self.lookup(types, after, 1).astype(np.int64)
+                lost = (values >= Tablebase.LOSS) & (values < Tablebase.INVALID)
+                plies = 2 * (values[lost] - Tablebase.LOSS) + 1
+                for ply in np.unique(plies):
+                    self.white_events.setdefault(int(ply), []).append(indexes[promoting][lost][plies == ply])
+
+    """
+    White positions one white move before the (lost) black positions
+    """
+
+    def white_predecessors(self, indexes):
+        squares = self.squares(indexes)
+        occupied = self.occupancy(squares)
+        for piece, piece_type in enumerate(self.types):
+            if piece == 1:
+                continue
+            others = occupied & ~BITS[squares[piece]]
+            origins = []  # (origin squares, mask of the moves that are possible)
+            if piece_type in "KN":
+                for direction in range(TARGETS[piece_type].shape[1]):
+                    origin = TARGETS[piece_type][squares[piece], direction]
+                    origins.append((origin, origin >= 0))
+            elif piece_type in "RBQ":
+                for direction in DIRECTION_INDEXES[piece_type]:
+                    for step in range(7):
+                        origin = RAYS[squares[piece], direction, step]
+                        possible = origin >= 0
+                        origin = np.where(possible, origin, 0)
+                        origins.append((origin, possible & ((BETWEEN[squares[piece], origin] & others) == 0)))
+            else:  # pawns move up the board, so they come from below
+                row = squares[piece] >> 3
+                origin = squares[piece] + 8
+                origins.append((origin, row <= 5))
+                origin = squares[piece] + 16
+                origins.append((origin, (row == 4) & ((others & BITS[squares[piece] + 8]) == 0)))
+            for origin, possible in origins:
+                origin = np.where(possible, origin, 0)
+                possible &= (others & BITS[origin]) == 0
+                if not possible.any():
+                    continue
+                before = [square[possible] for square in squares]
+                before[piece] = origin[possible]
+                legal = ~self.attacked(before[1], before, others[possible] | BITS[before[piece]])
+                yield indexes[possible][legal] + ((before[piece][legal] - squares[piece][possible][legal])
+                                                  << self.shifts[piece])
+
+    """
+    Black positions one black king move before the (won) white positions
+    """
+
+    def black_predecessors(self, indexes):
+        squares = self.squares(indexes)
+        occupied = self.occupancy(squares)
+        for direction in range(8):
+            origin = TARGETS["K"][squares[1], direction]
+            possible = origin >= 0
+            origin = np.where(possible, origin, 0)
+            possible &= ((occupied & BITS[origin]) == 0) & ~ATTACKS["K"][squares[0], origin]
+            yield indexes[possible] + ((origin[possible] - squares[1][possible]) << self.shifts[1])
+
+    def solve(self):
+        lost = np.flatnonzero(self.black == 0)
+        plies = 0
+        while True:
+            won = []
+            candidates = [self.white_events.pop(plies + 1, [])]
+            for start in range(0, len(lost), CHUNK):
+                candidates.append(self.white_predecessors(lost[start:start + CHUNK]))
+            for group in candidates:
+                for positions in group:
+                    positions = np.unique(positions)
+                    positions = positions[self.white[positions] == UNDECIDED]
+                    self.white[positions] = plies + 1
+                    won.append(positions)
+            won = np.concatenate(won) if won else np.zeros(0, dtype=np.int64)
+
+            lost = []
+            candidates = [self.black_events.pop(plies + 1, [])]
+            for start in range(0, len(won), CHUNK):
+                candidates.append(self.black_predecessors(won[start:start + CHUNK]))
+            for group in candidates:
+                for positions in group:
+                    positions, moves = np.unique(positions, return_counts=True)
+                    undecided = self.black[positions] == UNDECIDED
+                    positions, moves = positions[undecided], moves[undecided]
+                    self.moves_left[positions] -= moves.astype(np.int8)
+                    positions = positions[self.moves_left[positions] == 0]
+                    self.black[positions] = plies + 2
+                    lost.append(positions)
+            lost = np.concatenate(lost) if lost else np.zeros(0, dtype=np.int64)
+            plies += 2
+            if len(won) == 0 and len(lost) == 0 and \
+                    not any(ply > plies for ply in list(self.white_events) + list(self.black_events)):
+                break
+
+    """
+    Table bytes as stored (see ChessTablebase): only the stored strong king squares, white to move then black
+    """
+
+    def table_bytes(self):
+        white = np.zeros(self.size, dtype=np.uint8)
+        won = self.white > 0
+        white[won] = (self.white[won] + 1) // 2
+        white[self.white == INVALID] = Tablebase.INVALID
+        black = np.zeros(self.size, dtype=np.uint8)
+        lost = self.black >= 0
+        black[lost] = Tablebase.LOSS + self.black[lost] // 2
+        black[self.black == INVALID] = Tablebase.INVALID
+        king_squares = list(Tablebase.king_squares(self.pieces))
+        return np.concatenate([white.reshape(64, -1)[king_squares].ravel(),
+                               black.reshape(64, -1)[king_squares].ravel()])
+
+    def generate(self):
+        self.initialize()
+        self.solve()
+        path = table_path(self.directory, self.pieces)
+        temporary = path + ".tmp"
+        self.table_bytes().tofile(temporary)
+        os.replace(temporary, path)  # complete tables only, an interrupted run leaves just the .tmp file
+        return path
+
+
+def table_path(directory, pieces):
+    return os.path.join(directory, Tablebase.table_name(pieces) + Tablebase.TABLE_SUFFIX)
+
+
+def is_generated(directory, pieces):
+    path = table_path(directory, pieces)
+    return os.path.exists(path) and os.path.getsize(path) == 2 * Tablebase.table_half(pieces)
+
+
+"""
+Runs in a worker process, returns (pieces, seconds, longest mate in moves)
+"""
+
+
+def generate_table(pieces, directory):
+    start = time.perf_counter()
+    generator = TableGenerator(pieces, directory)
+    generator.generate()
+    return pieces, time.perf_counter() - start, int(max(generator.white.max(), 0) + 1) // 2
+
+
+"""
+Generates the tables for the strong pieces given (e.g. ["Q", "BN"]) and every table they depend on,
+skipping tables that exist already. Calls report(pieces, seconds, longest mate) for every generated table.
+"""
+
+
+def generate(tables, directory=DEFAULT_DIRECTORY, workers=None, report=None):
+    needed = set()
+    pending = [Tablebase.normalize(pieces) for pieces in tables]
+    while pending:
+        pieces = pending.pop()
+        if len(pieces) + 2 > Tablebase.MAX_PIECES:
+            raise ValueError("{} has more than {} pieces".format(Tablebase.table_name(pieces), Tablebase.MAX_PIECES))
+        if pieces not in needed and not Tablebase.insufficient_material(pieces):
+            needed.add(pieces)
+            pending.extend(dependencies(pieces))
+    done = {pieces for pieces in needed if is_generated(directory, pieces)}
+    os.makedirs(directory, exist_ok=True)
+    with ProcessPoolExecutor(workers) as executor:
+        running = {}
+        while len(done) < len(needed):
+            for pieces in needed - done - set(running.values()):
+                if dependencies(pieces) <= done:
+                    running[executor.submit(generate_table, pieces, directory)] = pieces
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                result = future.result()
+                done.add(running.pop(future))
+                if report is not None:
+                    report(*result)
+    return sorted(needed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tablebase", description="Generate endgame tablebases")
+    parser.add_argument("tables", nargs="*", default=[Tablebase.table_name(pieces)
+                                                      for pieces in Tablebase.DEFAULT_TABLES],
+                        help="tables like KQK or KBNK (default: %(default)s)")
+    parser.add_argument("--directory", default=DEFAULT_DIRECTORY, help="where tables are written")
+    parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    args = parser.parse_args(argv)
+
+    tables = []
+    for name in args.tables:
+        name = name.upper()
+        if len(name) < 2 or name[0] != "K" or name[-1] != "K" or any(piece not in Tablebase.PIECE_ORDER
+                                                                     for piece in name[1:-1]):
+            parser.error("{} is not a table with pieces against a lone king (like KQK)".format(name))
+        tables.append(name[1:-1])
+
+    def report(pieces, seconds, longest_mate):
+        print("{:<6} {:8.1f}s  longest mate {} moves".format(Tablebase.table_name(pieces), seconds, longest_mate))
+
+    start = time.perf_counter()
+    try:
+        needed = generate(tables, args.directory, args.workers, report)
+    except ValueError as error:
+        parser.error(str(error))
+    print("{} tables in {} ({:.1f}s)".format(len(needed), args.directory, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
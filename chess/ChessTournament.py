@@ -0,0 +1,387 @@
+"""
+Self-play tournaments between engine configurations, without a display and in parallel: games are played in a
+process pool, every finished game is appended to a JSON lines file as soon as it arrives, and the summary gives
+score and Elo difference (with 95% error margin) for every pairing, an SPRT for the first two engines and the
+aggregate nodes per second of every engine.
+
+Engines are given as NAME=KIND[:OPTION=VALUE,...]:
+    base=random                             ChessAIEngine.find_random_move, the baseline
+    new=search:movetime=0.1,depth=64,hash=16,book=book.bin,tablebases=tablebases
+Every pairing plays --games games. Openings are random legal plies from the starting position (--opening-plies),
+each opening is played twice with colors swapped (the last one once for an odd --games). With a time control
+(--tc BASE+INCREMENT in seconds) the engines have a clock, split it like ChessUci does and lose on time, otherwise
+they search movetime seconds per move.
+Games are drawn by stalemate, threefold repetition, the fifty move rule, insufficient material and --max-plies.
+
+Usage:
+    python main.py tournament --engine new=search:movetime=0.05 --engine base=random [--games 100] [--tc 10+0.1]
+                              [--workers N] [--output results.jsonl] [--pgn games.pgn] [--sprt ELO0 ELO1] [--json FILE]
+"""
+
+import argparse
+import io
+import itertools
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from chess import ChessAIEngine, ChessEngine, ChessPgn, ChessUci
+
+ENGINE_KINDS = ("random", "search")
+DEFAULT_MOVETIME = 0.1  # seconds per move without a time control
+DEFAULT_OPENING_PLIES = 4
+DEFAULT_MAX_PLIES = 300  # longer games are adjudicated as draws
+SPRT_ALPHA = 0.05
+SPRT_BETA = 0.05
+
+
+"""
+Engine configuration from NAME=KIND[:OPTION=VALUE,...], as a dict that can be sent to worker processes
+"""
+
+
+def parse_engine(spec):
+    name, _, definition = spec.partition("=")
+    kind, _, options = definition.partition(":")
+    if not name or kind not in ENGINE_KINDS:
+        raise ValueError("Engine must be NAME=KIND[:OPTION=VALUE,...] with KIND one of {}: {!r}".format(
+            ", ".join(ENGINE_KINDS), spec))
+    engine = {"name": name, "kind": kind, "movetime": DEFAULT_MOVETIME, "depth": 64, "hash": 16, "book": None,
+              "tablebases": None}
+    for option in filter(None, options.split(",")):
+        option_name, _, value = option.partition("=")
+        if option_name not in engine or option_name in ("name", "kind"):
+            raise ValueError("Unknown engine option {!r} in {!r}".format(option_name, spec))
+        engine[option_name] = float(value) if option_name == "movetime" else \
+            int(value) if option_name in ("depth", "hash") else value
+    return engine
+
+
+"""
+Time control "BASE+INCREMENT" in seconds as (base, increment), "40" means no increment
+"""
+
+
+def parse_time_control(text):
+    base, _, increment = text.partition("+")
+    return float(base), float(increment or 0)
+
+
+searchers = {}  # worker processes: Searcher of every engine name, created on first use
+
+
+def engine_move(engine, game_state, valid_moves, move_time, stats):
+    if engine["kind"] == "random":
+        return ChessAIEngine.find_random_move(valid_moves)
+    move = ChessAIEngine.book_move(game_state, valid_moves, engine["book"])
+    if move is not None:
+        return move
+    searcher = searchers.get(engine["name"])
+    if searcher is None:
+        searcher = searchers[engine["name"]] = ChessAIEngine.Searcher(engine["hash"])
+    searcher.tablebase = ChessAIEngine.open_tablebase(engine["tablebases"])
+    if searcher.tablebase is not None:
+        result = searcher.tablebase.best_move(game_state, valid_moves)
+        if result is not None:
+            return result[0]
+    move = searcher.search(game_state, valid_moves, move_time, engine["depth"])
+    stats["nodes"] += searcher.nodes
+    return move
+
+
+"""
+Worker process: plays one game and returns its record. game is a dict with index, white and black (engine dicts),
+opening (moves in long algebraic notation), time_control ((base, increment) or None), max_plies and seed.
+"""
+
+
+def play_game(game):
+    random.seed(game["seed"])  # find_random_move uses the random module
+    engines = (game["white"], game["black"])
+    stats = {engine["name"]: {"nodes": 0, "time": 0.0, "moves": 0} for engine in engines}
+    for engine in engines:
+        if engine["name"] in searchers:
+            searchers[engine["name"]].table.clear()  # games don't learn from each other
+
+    game_state = ChessEngine.Game_state()
+    for notation in game["opening"]:
+        game_state.make_move(next(move for move in game_state.get_valid_moves()
+                                  if move.get_chess_notation() == notation))
+    clocks = [game["time_control"][0], game["time_control"][0]] if game["time_control"] else None
+    result, reason = None, None
+    while result is None:
+        valid_moves = game_state.get_valid_moves()
+        if not valid_moves:
+            if game_state.check_mate:
+                result, reason = ("0-1" if game_state.white_to_move else "1-0"), "checkmate"
+            else:
+                result, reason = "1/2-1/2", "stalemate"
+            break
+        reason = game_state.draw_reason()
+        if reason is None and len(game_state.game_log) >= game["max_plies"]:
+            reason = "adjudication"
+        if reason is not None:
+            result = "1/2-1/2"
+            break
+        side = 0 if game_state.white_to_move else 1
+        engine = engines[side]
+        if clocks is None:
+            move_time = engine["movetime"]
+        else:
+            increment = int(game["time_control"][1] * 1000)
+            move_time = ChessUci.time_limit({"wtime": int(clocks[0] * 1000), "btime": int(clocks[1] * 1000),
+                                             "winc": increment, "binc": increment}, game_state.white_to_move)
+        engine_stats = stats[engine["name"]]
+        start = time.perf_counter()
+        move = engine_move(engine, game_state, valid_moves, move_time, engine_stats)
+        elapsed = time.perf_counter() - start
+        engine_stats["time"] += elapsed
+        engine_stats["moves"] += 1
+        if clocks is not None:
+            clocks[side] -= elapsed
+            if clocks[side] < 0:
+                result, reason = ("0-1" if side == 0 else "1-0"), "time forfeit"
+                break
+            clocks[side] += game["time_control"][1]
+        game_state.make_move(move)
+
+    pgn = io.StringIO()
+    ChessPgn.write_game(pgn, game_state, {"Event": "Self-play tournament", "Round": str(game["index"] + 1),
+                                          "White": engines[0]["name"], "Black": engines[1]["name"],
+                                          "Result": result, "Termination": reason})
+    return {"game": game["index"], "white": engines[0]["name"], "black": engines[1]["name"], "result": result,
+            "reason": reason, "plies": len(game_state.game_log), "opening": game["opening"],
+            "moves": [move.get_chess_notation() for move in game_state.game_log], "engines": stats,
+            "pgn": pgn.getvalue()}
+
+
+def random_opening(rng, plies):
+    game_state = ChessEngine.Game_state()
+    opening = []
+    for _ in range(plies):
+        valid_moves = game_state.get_valid_moves()
+        if not valid_moves:
+            break
+        move = rng.choice(valid_moves)
+        game_state.make_move(move)
+        opening.append(move.get_chess_notation())
+    return opening
+
+
+"""
+Games of the tournament in playing order, games for every pairing: openings played twice with colors swapped
+(for an odd number of games the last opening only once)
+"""
+
+
+def schedule(engines, games, opening_plies, time_control, max_plies, seed):
+    rng = random.Random(seed)
+    pairings = list(itertools.combinations(engines, 2))
+    scheduled = []
+    for round_index in range((games + 1) // 2):
+        for first, second in pairings:
+            opening = random_opening(rng, opening_plies)
+            colors = ((first, second), (second, first))
+            for white, black in colors[:games - 2 * round_index]:
+                scheduled.append({"index": len(scheduled), "white": white, "black": black, "opening": opening,
+                                  "time_control": time_control, "max_plies": max_plies,
+                                  "seed": rng.getrandbits(32)})
+    return scheduled
+
+
+"""
+Elo difference for a score of wins, draws and losses, with the 95% error margin: (elo, margin).
+None for elo when one side scored everything.
+"""
+
+
+def elo(wins, draws, losses):
+    games = wins + draws + losses
+    if games == 0:
+        return None, None
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+
+    def score_to_elo(value):
+        return -400 * math.log10(1 / value - 1)
+
+    if score <= 0 or score >= 1:
+        return None, None
+    error = 1.96 * math.sqrt(variance / games)
+    low, high = max(score - error, 1e-6), min(score + error, 1 - 1e-6)
+    return score_to_elo(score), (score_to_elo(high) - score_to_elo(low)) / 2
+
+
+"""
+Sequential probability ratio test of elo0 (H0) against elo1 (H1) for wins, draws and losses of the first engine,
+with the normal approximation of the log likelihood ratio. decision is "H1" (better by elo1), "H0" or None (go on).
+"""
+
+
+def sprt(wins, draws, losses, elo0, elo1, alpha=SPRT_ALPHA, beta=SPRT_BETA):
+    lower, upper = math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+    games = wins + draws + losses
+    llr = 0.0
+    if games:
+        if not (wins and draws and losses):  # half a game of every outcome, so that one sided scores have a variance
+            wins, draws, losses, games = wins + 0.5, draws + 0.5, losses + 0.5, games + 1.5
+        score = (wins + draws / 2) / games
+        variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+        score0 = 1 / (1 + 10 ** (-elo0 / 400))
+        score1 = 1 / (1 + 10 ** (-elo1 / 400))
+        llr = games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+    decision = "H1" if llr >= upper else "H0" if llr <= lower else None
+    return {"elo0": elo0, "elo1": elo1, "llr": llr, "lower": lower, "upper": upper, "decision": decision}
+
+
+class Standings:
+    def __init__(self, engines):
+        self.names = [engine["name"] for engine in engines]
+        self.pairs = {}  # (name, opponent) -> [wins, draws, losses] of name
+        self.engines = {name: {"games": 0, "nodes": 0, "time": 0.0, "moves": 0} for name in self.names}
+        self.reasons = {}
+        self.games = 0
+
+    def add(self, record):
+        self.games += 1
+        score = {"1-0": 0, "1/2-1/2": 1, "0-1": 2}[record["result"]]  # index into [wins, draws, losses] of white
+        self.pairs.setdefault((record["white"], record["black"]), [0, 0, 0])[score] += 1
+        self.pairs.setdefault((record["black"], record["white"]), [0, 0, 0])[2 - score] += 1
+        self.reasons[record["reason"]] = self.reasons.get(record["reason"], 0) + 1
+        for name, stats in record["engines"].items():
+            totals = self.engines[name]
+            totals["games"] += 1
+            for field in ("nodes", "time", "moves"):
+                totals[field] += stats[field]
+
+    def score(self, name, opponent):
+        return self.pairs.get((name, opponent), [0, 0, 0])
+
+    def summary(self, sprt_bounds=None):
+        pairings = []
+        for name, opponent in itertools.combinations(self.names, 2):
+            wins, draws, losses = self.score(name, opponent)
+            difference, margin = elo(wins, draws, losses)
+            pairings.append({"engine": name, "opponent": opponent, "wins": wins, "draws": draws, "losses": losses,
+                             "elo": difference, "margin": margin})
+        engines = {name: dict(totals, nps=totals["nodes"] / totals["time"] if totals["time"] else 0.0)
+                   for name, totals in self.engines.items()}
+        summary = {"games": self.games, "pairings": pairings, "engines": engines, "reasons": self.reasons}
+        if sprt_bounds is not None:
+            summary["sprt"] = sprt(*self.score(self.names[0], self.names[1]), *sprt_bounds)
+        return summary
+
+
+def format_summary(summary):
+    lines = ["{} games".format(summary["games"])]
+    for pairing in summary["pairings"]:
+        lines.append("{engine} vs {opponent}: +{wins} ={draws} -{losses}  elo {elo}".format(
+            **dict(pairing, elo="{:+.1f} +/- {:.1f}".format(pairing["elo"], pairing["margin"])
+                   if pairing["elo"] is not None else "n/a")))
+    for name, totals in summary["engines"].items():
+        lines.append("{}: {} nodes in {:.1f}s of search, {:.0f} nps".format(name, totals["nodes"], totals["time"],
+                                                                          totals["nps"]))
+    if "sprt" in summary:
+        test = summary["sprt"]
+        lines.append("SPRT elo0 {elo0} elo1 {elo1}: LLR {llr:.2f} ({lower:.2f}, {upper:.2f}) {result}".format(
+            result=test["decision"] or "continue", **test))
+    lines.append("endings: " + ", ".join("{} {}".format(reason, count)
+                                         for reason, count in sorted(summary["reasons"].items())))
+    return "\n".join(lines)
+
+
+"""
+Plays the scheduled games in a process pool, streaming finished games to output (JSON lines) and pgn files.
+With sprt_bounds the tournament stops as soon as the SPRT decides. Returns the summary.
+"""
+
+
+def run_tournament(engines, scheduled, workers=None, output=None, pgn=None, sprt_bounds=None, report_every=10):
+    standings = Standings(engines)
+    with ProcessPoolExecutor(workers) as executor:
+        queue = iter(scheduled)
+        running = set()
+        for game in itertools.islice(queue, 2 * (workers or os.cpu_count() or 1)):  # keep the pool busy, no more
+            running.add(executor.submit(play_game, game))
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                record = future.result()
+                standings.add(record)
+                if pgn is not None:
+                    pgn.write(record["pgn"] + "\n")
+                    pgn.flush()
+                if output is not None:
+                    output.write(json.dumps({key: value for key, value in record.items() if key != "pgn"}) + "\n")
+                    output.flush()
+                if standings.games % report_every == 0:
+                    print(", ".join(format_summary(standings.summary(sprt_bounds)).splitlines()[:2]), flush=True)
+            if sprt_bounds is not None and standings.summary(sprt_bounds)["sprt"]["decision"] is not None:
+                queue = iter(())  # decided, let the running games finish and stop
+            for game in itertools.islice(queue, len(done)):
+                running.add(executor.submit(play_game, game))
+    return standings.summary(sprt_bounds)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="tournament", description="self-play tournament between engines")
+    parser.add_argument("--engine", action="append", required=True, dest="engines",
+                        help="NAME=KIND[:OPTION=VALUE,...], at least two")
+    parser.add_argument("--games", type=int, default=100, help="games per pairing (default: %(default)s)")
+    parser.add_argument("--tc", help="time control BASE+INCREMENT in seconds, e.g. 10+0.1")
+    parser.add_argument("--opening-plies", type=int, default=DEFAULT_OPENING_PLIES,
+                        help="random plies before the engines take over (default: %(default)s)")
+    parser.add_argument("--max-plies", type=int, default=DEFAULT_MAX_PLIES,
+                        help="longer games are drawn (default: %(default)s)")
+    parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="append every finished game to this JSON lines file")
+    parser.add_argument("--pgn", help="append every finished game to this PGN file")
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"),
+                        help="SPRT of the first engine against the second, stops when decided")
+    parser.add_argument("--json", dest="json_file", help="write the summary as JSON to this file ('-' for stdout)")
+    args = parser.parse_args(argv)
+
+    try:
+        engines = [parse_engine(spec) for spec in args.engines]
+    except ValueError as error:
+        parser.error(str(error))
+    if len(engines) < 2 or len({engine["name"] for engine in engines}) != len(engines):
+        parser.error("at least two engines with different names are needed")
+    time_control = parse_time_control(args.tc) if args.tc else None
+    scheduled = schedule(engines, args.games, args.opening_plies, time_control, args.max_plies, args.seed)
+
+    output = open(args.output, "a") if args.output else None
+    pgn = open(args.pgn, "a") if args.pgn else None
+    start = time.perf_counter()
+    try:
+        summary = run_tournament(engines, scheduled, args.workers, output, pgn, args.sprt)
+    finally:
+        for file in (output, pgn):
+            if file is not None:
+                file.close()
+    summary["seconds"] = time.perf_counter() - start
+    print(format_summary(summary))
+    print("{:.1f}s, {:.2f} games/s".format(summary["seconds"], summary["games"] / summary["seconds"]))
+
+    if args.json_file:
+        report = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "engines": engines,
+            "time_control": args.tc,
+            "summary": summary,
+        }
+        if args.json_file == "-":
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json_file, "w") as file:
+                json.dump(report, file, indent=2)
+    return 0
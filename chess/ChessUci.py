@@ -0,0 +1,299 @@
+"""
+UCI (Universal Chess Interface) front end, for running the engine without a display: under GUIs such as cutechess
+or Arena, in engine tournaments and on servers. Supported commands:
+    uci, isready, ucinewgame, setoption name Hash|Book|Tablebases value ...,
+    position startpos|fen FEN [moves e2e4 ...],
+    go [depth N] [movetime MS] [wtime MS] [btime MS] [winc MS] [binc MS] [movestogo N] [infinite], stop, quit
+The search runs in a thread while commands keep being read, so stop and isready are answered right away
+(the searcher looks at its stop event at every node). Nothing imported here needs pygame.
+
+Usage:
+    python main.py uci [--hash MB] [--book book.bin] [--tablebases DIRECTORY]
+"""
+
+import argparse
+import sys
+import threading
+import time
+
+from chess import ChessAIEngine, ChessEngine
+
+ENGINE_NAME = "python-chess"
+DEFAULT_MOVES_TO_GO = 30  # moves the remaining time is divided between when the GUI doesn't say
+MOVE_OVERHEAD = 0.05  # seconds kept for sending the move
+INFINITE = 10 ** 9  # seconds, search time of go infinite and go depth
+MAX_PV_LENGTH = 32
+MIN_HASH_MB = 1  # limits of the Hash option, other sizes are clamped to them
+MAX_HASH_MB = 1024
+
+
+"""
+Limits of a go command, {"depth": 6, "wtime": 60000, ...}, "infinite" is True when given.
+A value that isn't an integer is skipped and passed to on_invalid(name, token) when given.
+"""
+
+
+def parse_go(tokens, on_invalid=None):
+    limits = {}
+    index = 0
+    while index < len(tokens):
+        name = tokens[index]
+        if name in ("infinite", "ponder"):
+            limits[name] = True
+        elif name in ("depth", "movetime", "wtime", "btime", "winc", "binc", "movestogo", "nodes", "mate") and \
+                index + 1 < len(tokens):
+            index += 1
+            try:
+                limits[name] = int(tokens[index])
+            except ValueError:
+                if on_invalid is not None:
+                    on_invalid(name, tokens[index])
+        index += 1
+    return limits
+
+
+"""
+Seconds to search for the limits of a go command, a share of the remaining time when the GUI sends clocks
+"""
+
+
+def time_limit(limits, white_to_move):
+    if "movetime" in limits:
+        return max(limits["movetime"] / 1000 - MOVE_OVERHEAD, 0.01)
+    time_left = limits.get("wtime" if white_to_move else "btime")
+    if time_left is None or limits.get("infinite"):
+        return INFINITE
+    increment = limits.get("winc" if white_to_move else "binc", 0)
+    moves_to_go = limits.get("movestogo", DEFAULT_MOVES_TO_GO)
+    limit = time_left / moves_to_go + increment * 0.8
+    return max(min(limit, time_left / 2) / 1000 - MOVE_OVERHEAD, 0.01)
+
+
+"""
+Search score (side to move perspective) as UCI score: "cp 35", or "mate 3" / "mate -2" in moves
+"""
+
+
+def score_to_uci(score):
+    if score > ChessAIEngine.MATE_BOUND:
+        return "mate {}".format((ChessAIEngine.CHECKMATE - score + 1) // 2)
+    if score < -ChessAIEngine.MATE_BOUND:
+        return "mate {}".format(-((ChessAIEngine.CHECKMATE + score) // 2))
+    return "cp {}".format(score)
+
+
+"""
+Principal variation: first_move followed by the best moves stored in the transposition table.
+Stops at a missing or illegal table move and at a repeated position, game_state is left as it was.
+"""
+
+
+def principal_variation(game_state, first_move, table, max_length=MAX_PV_LENGTH):
+    check_mate, stale_mate = game_state.check_mate, game_state.stale_mate
+    variation = [first_move]
+    game_state.make_move(first_move)
+    seen = {game_state.hash()}
+    while len(variation) < max_length:
+        entry = table.probe(game_state.hash())
+        if entry is None or not entry[3]:
+            break
+        move = next((move for move in game_state.get_valid_moves() if move.encode() == entry[3]), None)
+        if move is None:
+            break
+        game_state.make_move(move)
+        variation.append(move)
+        if game_state.hash() in seen:
+            break
+        seen.add(game_state.hash())
+    for _ in variation:
+        game_state.undo_move()
+    game_state.check_mate, game_state.stale_mate = check_mate, stale_mate
+    return variation
+
+
+class UciEngine:
+    def __init__(self, output=sys.stdout, table_size_mb=16, book_path=None, tablebase_directory=None):
+        self.output = output
+        self.output_lock = threading.Lock()  # the search thread writes info lines while commands are answered
+        self.table_size_mb = table_size_mb
+        self.book_path = book_path
+        self.tablebase_directory = tablebase_directory
+        self.searcher = ChessAIEngine.Searcher(table_size_mb)
+        self.game_state = self.new_game_state()
+        self.search_thread = None
+        self.stop_event = threading.Event()
+
+    @staticmethod
+    def new_game_state(fen=None):
+        return ChessEngine.Game_state() if fen is None else ChessEngine.Game_state.from_fen(fen)
+
+    def send(self, line):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    """
+    Reads commands until quit or the end of input
+    """
+
+    def run(self, input_file=sys.stdin):
+        while True:
+            line = input_file.readline()
+            if not line or not self.handle(line):
+                break
+        self.stop()
+
+    """
+    Handles one command line, returns False on quit
+    """
+
+    def handle(self, line):
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, arguments = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author python-chess contributors")
+            self.send("option name Hash type spin default {} min {} max {}".format(self.table_size_mb, MIN_HASH_MB,
+                                                                                  MAX_HASH_MB))
+            self.send("option name Book type string default {}".format(self.book_path or "<empty>"))
+            self.send("option name Tablebases type string default {}".format(self.tablebase_directory or "<empty>"))
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.stop()
+            self.set_option(arguments)
+        elif command == "ucinewgame":
+            self.stop()
+            self.searcher = ChessAIEngine.Searcher(self.table_size_mb)
+            self.game_state = self.new_game_state()
+        elif command == "position":
+            self.stop()
+            self.set_position(arguments)
+        elif command == "go":
+            self.stop()
+            self.go(parse_go(arguments, self.invalid_value))
+        elif command == "stop":
+            self.stop()
+        elif command == "quit":
+            return False
+        return True
+
+    def invalid_value(self, name, value):
+        self.send("info string invalid {} value {}".format(name, value))
+
+    def set_option(self, arguments):
+        if "name" not in arguments:
+            return
+        value_index = arguments.index("value") if "value" in arguments else len(arguments)
+        name = " ".join(arguments[arguments.index("name") + 1:value_index]).lower()
+        value = " ".join(arguments[value_index + 1:])
+        if value in ("", "<empty>"):
+            value = None
+        if name == "hash" and value is not None:
+            try:
+                size_mb = min(max(int(value), MIN_HASH_MB), MAX_HASH_MB)
+            except ValueError:
+                self.invalid_value("Hash", value)
+                return
+            self.table_size_mb = size_mb
+            self.searcher = ChessAIEngine.Searcher(self.table_size_mb)
+        elif name == "book":
+            self.book_path = value
+        elif name == "tablebases":
+            self.tablebase_directory = value
+        else:
+            self.send("info string unknown option {}".format(name))
+
+    def set_position(self, arguments):
+        moves_index = arguments.index("moves") if "moves" in arguments else len(arguments)
+        try:
+            if arguments and arguments[0] == "fen":
+                game_state = self.new_game_state(" ".join(arguments[1:moves_index]))
+            else:
+                game_state = self.new_game_state()
+        except ValueError as error:
+            self.send("info string {}".format(error))
+            return
+        for notation in arguments[moves_index + 1:]:
+            move = next((move for move in game_state.get_valid_moves() if move.get_chess_notation() == notation),
+                        None)
+            if move is None:
+                self.send("info string illegal move {}".format(notation))
+                break
+            game_state.make_move(move)
+        self.game_state = game_state
+
+    def go(self, limits):
+        self.stop_event = threading.Event()
+        self.search_thread = threading.Thread(target=self.search, args=(limits, self.stop_event), daemon=True)
+        self.search_thread.start()
+
+    """
+    Stops the running search (its bestmove is sent) and waits for it
+    """
+
+    def stop(self):
+        if self.search_thread is not None:
+            self.stop_event.set()
+            self.search_thread.join()
+            self.search_thread = None
+
+    """
+    Search thread: book move, tablebase move or iterative deepening search with an info line per depth,
+    then bestmove. With go infinite, bestmove waits for stop as the protocol requires.
+    """
+
+    def search(self, limits, stop_event):
+        game_state = self.game_state
+        valid_moves = game_state.get_valid_moves()
+        move = None
+        if valid_moves:
+            move = ChessAIEngine.book_move(game_state, valid_moves, self.book_path)
+            if move is not None:
+                self.send("info string book move")
+        tablebase = ChessAIEngine.open_tablebase(self.tablebase_directory)
+        if move is None and valid_moves and tablebase is not None:
+            result = tablebase.best_move(game_state, valid_moves)
+            if result is not None:
+                move = result[0]
+                wdl, plies = result[1]
+                score = ChessAIEngine.CHECKMATE - plies if wdl > 0 else \
+                    -ChessAIEngine.CHECKMATE + plies if wdl < 0 else ChessAIEngine.STALEMATE
+                self.send("info depth {} score {} pv {}".format(plies, score_to_uci(score), move.get_chess_notation()))
+        if move is None and valid_moves:
+            move = self.search_moves(game_state, valid_moves, limits, stop_event, tablebase)
+        if limits.get("infinite") or limits.get("ponder"):
+            stop_event.wait()
+        self.send("bestmove {}".format(move.get_chess_notation() if move is not None else "0000"))
+
+    def search_moves(self, game_state, valid_moves, limits, stop_event, tablebase):
+        searcher = self.searcher
+        searcher.tablebase = tablebase
+        start = time.perf_counter()
+
+        def report(depth, score, best_move):
+            elapsed = time.perf_counter() - start
+            variation = principal_variation(game_state, best_move, searcher.table)
+            self.send("info depth {} score {} nodes {} nps {} time {} pv {}".format(
+                depth, score_to_uci(score), searcher.nodes, int(searcher.nodes / elapsed) if elapsed > 0 else 0,
+                int(elapsed * 1000), " ".join(move.get_chess_notation() for move in variation)))
+
+        searcher.on_iteration = report
+        try:
+            return searcher.search(game_state, valid_moves, time_limit(limits, game_state.white_to_move),
+                                   max_depth=limits.get("depth", 64), stop_event=stop_event)
+        finally:
+            searcher.on_iteration = None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="uci", description="engine speaking UCI over stdin/stdout")
+    parser.add_argument("--hash", type=int, default=16, help="transposition table size in MB (default: %(default)s)")
+    parser.add_argument("--book", help="Polyglot opening book")
+    parser.add_argument("--tablebases", help="directory with endgame tablebases")
+    args = parser.parse_args(argv)
+    UciEngine(table_size_mb=args.hash, book_path=args.book, tablebase_directory=args.tablebases).run()
+    return 0
@@ -1,16 +1,61 @@
-# This is a sample Python script.
+"""
+Entry point. Without arguments the game window is started, command line tools are subcommands:
+    python main.py              play in the pygame window
+    python main.py perft ...    move generation correctness and speed test (see chess/ChessPerft.py)
+    python main.py pgn ...      PGN reading and writing throughput (see chess/ChessPgn.py)
+    python main.py book ...     build and probe Polyglot opening books (see chess/ChessBook.py)
+    python main.py tablebase .. generate endgame tablebases (see chess/ChessTablebaseGenerator.py)
+    python main.py uci ...      engine speaking UCI over stdin/stdout, for chess GUIs (see chess/ChessUci.py)
+    python main.py tournament . self-play games between engine configurations (see chess/ChessTournament.py)
+    python main.py search ...   time to depth of the single and multi process search (see chess/ChessAIEngine.py)
+    python main.py sprites ...  piece sprite load and blit benchmark (see chess/ChessSprites.py)
+    python main.py server ...   asyncio session server for many games and its load test (see chess/ChessServer.py)
+    python main.py archive ...  binary game archive: convert from PGN, random access, scan (see chess/ChessArchive.py)
+    python main.py index ...    search archived games by position or material (see chess/ChessPositionIndex.py)
+Tools are imported only when used, so they start fast and don't need pygame (except sprites).
+"""
 
-# Press Shift+F10 to execute it or replace it with your code.
-# Press Double Shift to search everywhere for classes, files, tool windows, actions, and settings.
+import sys
 
 
-def print_hi(name):
-    # Use a breakpoint in the code line below to debug your script.
-    print(f'Hi, {name}')  # Press Ctrl+F8 to toggle the breakpoint.
+def main(argv):
+    if argv and argv[0] == "perft":
+        from chess import ChessPerft
+        return ChessPerft.main(argv[1:])
+    if argv and argv[0] == "pgn":
+        from chess import ChessPgn
+        return ChessPgn.main(argv[1:])
+    if argv and argv[0] == "book":
+        from chess import ChessBook
+        return ChessBook.main(argv[1:])
+    if argv and argv[0] == "tablebase":
+        from chess import ChessTablebaseGenerator
+        return ChessTablebaseGenerator.main(argv[1:])
+    if argv and argv[0] == "uci":
+        from chess import ChessUci
+        return ChessUci.main(argv[1:])
+    if argv and argv[0] == "tournament":
+        from chess import ChessTournament
+        return ChessTournament.main(argv[1:])
+    if argv and argv[0] == "search":
+        from chess import ChessAIEngine
+        return ChessAIEngine.main(argv[1:])
+    if argv and argv[0] == "sprites":
+        from chess import ChessSprites
+        return ChessSprites.main(argv[1:])
+    if argv and argv[0] == "server":
+        from chess import ChessServer
+        return ChessServer.main(argv[1:])
+    if argv and argv[0] == "archive":
+        from chess import ChessArchive
+        return ChessArchive.main(argv[1:])
+    if argv and argv[0] == "index":
+        from chess import ChessPositionIndex
+        return ChessPositionIndex.main(argv[1:])
+    from chess import ChessMain
+    ChessMain.main()
+    return 0
 
 
-# Press the green button in the gutter to run the script.
-if __name__ == '__main__':
-    print_hi('PyCharm')
-
-# See PyCharm help at https://www.jetbrains.com/help/pycharm/
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
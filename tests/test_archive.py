@@ -0,0 +1,66 @@
+"""
+Binary game archive: games written from PGN and from Game_state come back with the same positions at every ply
+"""
+
+import io
+import random
+
+from chess import ChessArchive, ChessEngine, ChessPgn
+
+
+def random_games(count, seed=1, max_plies=80):
+    rng = random.Random(seed)
+    return [ChessPgn.random_game(rng, max_plies) for _ in range(count)]
+
+
+def fens(game_state):
+    moves = list(game_state.game_log)
+    for _ in moves:
+        game_state.undo_move()
+    result = [game_state.to_fen()]
+    for move in moves:
+        game_state.make_move(move)
+        result.append(game_state.to_fen())
+    return result
+
+
+def test_pgn_round_trip(tmp_path):
+    games = random_games(5)
+    pgn = io.StringIO()
+    for number, game_state in enumerate(games):
+        ChessPgn.write_game(pgn, game_state, {"Round": str(number + 1)})
+    pgn_path = tmp_path / "games.pgn"
+    pgn_path.write_text(pgn.getvalue(), encoding="utf-8")
+    archive_path = str(tmp_path / "games.pcga")
+    plies = sum(len(game_state.game_log) for game_state in games)
+    assert ChessArchive.convert_pgn([str(pgn_path)], archive_path) == (5, plies, 0)
+    with ChessArchive.GameArchive(archive_path) as archive:
+        assert len(archive) == 5
+        for number, game_state in enumerate(games):
+            expected = fens(game_state)
+            assert archive.plies(number) == len(expected) - 1
+            assert archive.headers(number)["Round"] == str(number + 1)
+            assert archive.result(number) == ChessPgn.game_result(game_state)
+            assert [state.to_fen() for state, _ in archive.replay(number)] == expected[1:]
+            ply = len(expected) // 2
+            assert archive.game_state(number, ply).to_fen() == expected[ply]
+
+
+def test_append_and_start_fen(tmp_path):
+    archive_path = str(tmp_path / "games.pcga")
+    first, second = random_games(2, seed=2)
+    with ChessArchive.ArchiveWriter(archive_path) as writer:
+        assert writer.add_game_state(first) == 0
+    rng = random.Random(3)
+    game_state = ChessEngine.Game_state.from_fen("4k3/8/8/8/8/8/4P3/R3K3 w Q - 0 1")
+    for _ in range(6):
+        game_state.make_move(rng.choice(game_state.get_valid_moves()))
+    with ChessArchive.ArchiveWriter(archive_path, append=True) as writer:
+        assert writer.add_game_state(second) == 1
+        assert writer.add_game_state(game_state) == 2
+    with ChessArchive.GameArchive(archive_path) as archive:
+        assert len(archive) == 3
+        for number, expected in enumerate((first, second, game_state)):
+            assert archive.start_fen(number) == fens(expected)[0]
+            assert archive.game_state(number).to_fen() == expected.to_fen()
+            assert archive.moves(number) == expected.game_log
@@ -0,0 +1,43 @@
+"""
+Polyglot keys and move codes, the keys are the test vectors of the Polyglot book format
+"""
+
+import pytest
+
+from chess import ChessBook, ChessEngine
+
+KEYS = [
+    ([], 0x463B96181691FC9C),
+    (["e2e4"], 0x823C9B50FD114196),
+    (["e2e4", "d7d5"], 0x0756B94461C50FB0),
+    (["e2e4", "d7d5", "e4e5"], 0x662FAFB965DB29D4),
+    (["e2e4", "d7d5", "e4e5", "f7f5"], 0x22A48B5A8E47FF78),
+    (["e2e4", "d7d5", "e4e5", "f7f5", "e1e2"], 0x652A607CA3F242C1),
+    (["e2e4", "d7d5", "e4e5", "f7f5", "e1e2", "e8f7"], 0x00FDD303C946BDD9),
+    (["a2a4", "b7b5", "h2h4", "b5b4", "c2c4"], 0x3C8123EA7B067637),
+    (["a2a4", "b7b5", "h2h4", "b5b4", "c2c4", "b4c3", "a1a3"], 0x5C3F9B829B279560),
+]
+
+
+def play(game_state, notations):
+    for notation in notations:
+        game_state.make_move(next(move for move in game_state.get_valid_moves()
+                                  if move.get_chess_notation() == notation))
+
+
+@pytest.mark.parametrize("moves, key", KEYS)
+def test_polyglot_key(moves, key):
+    game_state = ChessEngine.Game_state()
+    play(game_state, moves)
+    assert ChessBook.polyglot_key(game_state) == key
+
+
+def test_move_codes():
+    game_state = ChessEngine.Game_state.from_fen("r3k2r/1P6/8/8/8/8/8/R3K2R w KQkq - 0 1")
+    moves = game_state.get_valid_moves()
+    codes = {move.get_chess_notation(): ChessBook.encode_move(move) for move in moves}
+    assert codes["e1g1"] == ChessBook.encode_move(ChessEngine.Move((7, 4), (7, 7), game_state.board))  # king takes rook
+    assert codes["e1c1"] == ChessBook.encode_move(ChessEngine.Move((7, 4), (7, 0), game_state.board))
+    assert codes["b7a8n"] >> 12 == 1 and codes["b7a8q"] >> 12 == 4
+    for move in moves:
+        assert ChessBook.decode_move(ChessBook.encode_move(move), moves) == move
@@ -0,0 +1,76 @@
+"""
+Draw rules of Game_state: threefold repetition, fifty move rule and insufficient material
+"""
+
+from chess import ChessEngine
+
+KNIGHT_SHUFFLE = ["g1f3", "g8f6", "f3g1", "f6g8"]
+
+
+def play(game_state, notations):
+    for notation in notations:
+        game_state.make_move(next(move for move in game_state.get_valid_moves()
+                                  if move.get_chess_notation() == notation))
+
+
+def test_threefold_repetition():
+    game_state = ChessEngine.Game_state()
+    play(game_state, KNIGHT_SHUFFLE)
+    assert game_state.repetition_count() == 2
+    assert game_state.is_repetition()
+    assert game_state.draw_reason() is None
+    play(game_state, KNIGHT_SHUFFLE)
+    assert game_state.repetition_count() == 3
+    assert game_state.draw_reason() == "threefold repetition"
+
+
+def test_repetition_undo():
+    game_state = ChessEngine.Game_state()
+    play(game_state, KNIGHT_SHUFFLE * 2)
+    game_state.undo_move()
+    assert game_state.repetition_count() == 2
+    while game_state.game_log:
+        game_state.undo_move()
+    assert game_state.repetition_count() == 1
+    assert game_state.position_counts == {game_state.hash(): 1}
+
+
+def test_repetition_window_ends_at_pawn_move():
+    game_state = ChessEngine.Game_state()
+    play(game_state, KNIGHT_SHUFFLE + ["e2e3", "e7e6"] + KNIGHT_SHUFFLE)
+    assert game_state.repetition_count() == 2
+
+
+def test_enpassant_square_without_legal_capture_repeats():
+    game_state = ChessEngine.Game_state()
+    play(game_state, ["e2e4"] + ["g8f6", "g1f3", "f6g8", "f3g1"] * 2)
+    assert game_state.enpassant_possible == ()
+    assert game_state.repetition_count() == 3
+    assert game_state.draw_reason() == "threefold repetition"
+
+
+def test_enpassant_square_with_legal_capture_differs():
+    game_state = ChessEngine.Game_state.from_fen("4k3/8/8/8/3p4/8/4P3/4K3 w - - 0 1")
+    play(game_state, ["e2e4"] + ["e8d8", "e1d1", "d8e8", "d1e1"] * 2)
+    assert game_state.repetition_count() == 2
+
+
+def test_fifty_move_rule():
+    game_state = ChessEngine.Game_state.from_fen("4k3/8/8/8/8/8/4P3/R3K3 w - - 99 80")
+    assert game_state.draw_reason() is None
+    play(game_state, ["a1a2"])
+    assert game_state.halfmove_clock == 100
+    assert game_state.draw_reason() == "fifty move rule"
+    game_state.undo_move()
+    play(game_state, ["e2e3"])
+    assert game_state.halfmove_clock == 0
+    assert game_state.draw_reason() is None
+
+
+def test_insufficient_material():
+    for fen in ("4k3/8/8/8/8/8/8/4K3 w - - 0 1", "4k3/8/8/8/8/8/8/4KN2 w - - 0 1",
+                "4k3/8/8/3b4/8/8/8/4KB2 w - - 0 1"):
+        assert ChessEngine.Game_state.from_fen(fen).draw_reason() == "insufficient material"
+    for fen in ("4k3/8/8/8/8/8/8/3NKN2 w - - 0 1", "4k3/8/8/2b5/8/8/8/4KB2 w - - 0 1",
+                "4k3/8/8/8/8/8/4P3/4K3 w - - 0 1"):
+        assert ChessEngine.Game_state.from_fen(fen).draw_reason() is None
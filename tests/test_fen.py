@@ -0,0 +1,42 @@
+"""
+FEN import and export of Game_state
+"""
+
+import pytest
+
+from chess import ChessEngine, ChessPerft
+
+FENS = [fen for fen, _ in ChessPerft.POSITIONS.values()] + [
+    "rnbqkbnr/pppp1ppp/8/4p3/4P3/8/PPPP1PPP/RNBQKBNR w KQkq e6 0 2",
+    "8/8/8/8/8/8/8/K6k b - - 57 120",
+]
+
+
+@pytest.mark.parametrize("fen", FENS)
+def test_round_trip(fen):
+    game_state = ChessEngine.Game_state.from_fen(fen)
+    assert game_state.to_fen() == fen
+    assert game_state.hash() == game_state.compute_zobrist_key()
+
+
+def test_initial_position():
+    assert ChessEngine.Game_state().to_fen() == ChessPerft.POSITIONS["initial"][0]
+
+
+def test_fen_after_moves():
+    game_state = ChessEngine.Game_state()
+    for notation in ("e2e4", "c7c5", "g1f3"):
+        game_state.make_move(next(move for move in game_state.get_valid_moves()
+                                  if move.get_chess_notation() == notation))
+    assert game_state.to_fen() == "rnbqkbnr/pp1ppppp/8/2p5/4P3/5N2/PPPP1PPP/RNBQKB1R b KQkq - 1 2"
+    assert ChessEngine.Game_state.from_fen(game_state.to_fen()).hash() == game_state.hash()
+
+
+@pytest.mark.parametrize("fen", [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w KQkq - 0 1",
+    "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "rnbqkbnr/ppppxppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+])
+def test_invalid_fen(fen):
+    with pytest.raises(ValueError):
+        ChessEngine.Game_state.from_fen(fen)
@@ -0,0 +1,77 @@
+"""
+Position index: query results have to be the games found by replaying the whole archive
+"""
+
+import random
+
+import pytest
+
+from chess import ChessArchive, ChessEngine, ChessPgn, ChessPositionIndex
+
+
+def add_random_games(archive_path, count, seed, append=False):
+    rng = random.Random(seed)
+    with ChessArchive.ArchiveWriter(archive_path, append) as writer:
+        for _ in range(count):
+            writer.add_game_state(ChessPgn.random_game(rng, 60))
+
+
+def position_entry(game_state):
+    return (game_state.to_fen(), game_state.position_key(), ChessPositionIndex.pawn_key(game_state.board),
+            ChessPositionIndex.material_key(game_state.board))
+
+
+def replayed(archive):
+    games = []  # per game the positions as (FEN, position key, pawn key, material key), start position included
+    for game in range(len(archive)):
+        game_state = archive.game_state(game, 0)
+        positions = [position_entry(game_state)]
+        for state, _ in archive.replay(game, game_state):  # the same Game_state, updated in place
+            positions.append(position_entry(state))
+        games.append(positions)
+    return games
+
+
+def check_queries(archive_path, directory, seed):
+    rng = random.Random(seed)
+    with ChessArchive.GameArchive(archive_path) as archive, ChessPositionIndex.PositionIndex(directory) as index:
+        games = replayed(archive)
+        assert index.end_game() == len(games)
+        for _ in range(20):
+            fen = rng.choice(rng.choice(games))[0]
+            _, position, pawns, _ = next(entry for positions in games for entry in positions if entry[0] == fen)
+            assert index.find_position(fen) == [game for game, positions in enumerate(games)
+                                                if any(entry[1] == position for entry in positions)]
+            assert index.find_pawns(fen) == [game for game, positions in enumerate(games)
+                                             if any(entry[2] == pawns for entry in positions)]
+        material = ChessPositionIndex.material_key_from_text("KQRRBBNNPPPPPPPPvKQRRBBNNPPPPPPP")
+        assert index.find("material", material) == [game for game, positions in enumerate(games)
+                                                    if any(entry[3] == material for entry in positions)]
+        for fen in {entry[0] for positions in games for entry in positions}:
+            fields = fen.split()
+            if fields[3] != "-" and not ChessEngine.Game_state.from_fen(fen).enpassant_capture_legal():
+                assert index.find_position(fen) == index.find_position(" ".join(fields[:3] + ["-"] + fields[4:]))
+        assert index.query(position=games[0][0][0], material="KQRRBBNNPPPPPPPPvKQRRBBNNPPPPPPPP") == \
+            list(range(len(games)))
+
+
+def test_build_append_compact(tmp_path):
+    archive_path = str(tmp_path / "games.pcga")
+    directory = str(tmp_path / "index")
+    add_random_games(archive_path, 12, seed=1)
+    assert ChessPositionIndex.build(archive_path, directory, workers=1, chunk=5) == (0, 12)
+    check_queries(archive_path, directory, seed=1)
+    add_random_games(archive_path, 6, seed=2, append=True)
+    assert ChessPositionIndex.build(archive_path, directory, workers=1, chunk=5) == (12, 18)
+    assert ChessPositionIndex.build(archive_path, directory, workers=1) == (18, 18)
+    check_queries(archive_path, directory, seed=2)
+    assert ChessPositionIndex.compact(directory) == 2
+    check_queries(archive_path, directory, seed=3)
+
+
+def test_material_signature():
+    assert ChessPositionIndex.material_key_from_text("KRPvKR") == ChessPositionIndex.material_key_from_text("RPvR")
+    with pytest.raises(ValueError):
+        ChessPositionIndex.material_key_from_text("KRPKR")
+    with pytest.raises(ValueError):
+        ChessPositionIndex.material_key_from_text("KXvK")
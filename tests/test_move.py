@@ -0,0 +1,39 @@
+"""
+Move.encode() and Move.decode(): every legal move of the test positions survives the round trip
+"""
+
+import pytest
+
+from chess import ChessEngine, ChessPerft
+
+ENPASSANT_FEN = "rnbqkbnr/ppp1p1pp/8/3pPp2/8/8/PPPP1PPP/RNBQKBNR w KQkq f6 0 3"
+
+
+@pytest.mark.parametrize("fen", [fen for fen, _ in ChessPerft.POSITIONS.values()] + [ENPASSANT_FEN])
+def test_encode_decode(fen):
+    game_state = ChessEngine.Game_state.from_fen(fen)
+    moves = game_state.get_valid_moves()
+    codes = [move.encode() for move in moves]
+    assert len(set(codes)) == len(moves)
+    for move, code in zip(moves, codes):
+        assert 0 <= code < 1 << 16
+        decoded = ChessEngine.Move.decode(code, game_state.board)
+        assert decoded == move
+        assert decoded.piece_captured == move.piece_captured
+        assert decoded.is_enpassant_move == move.is_enpassant_move
+        assert decoded.is_castle_move == move.is_castle_move
+        assert decoded.promotion_piece == move.promotion_piece
+
+
+def test_enpassant_flag():
+    game_state = ChessEngine.Game_state.from_fen(ENPASSANT_FEN)
+    move = next(move for move in game_state.get_valid_moves() if move.is_enpassant_move)
+    assert move.get_chess_notation() == "e5f6"
+    assert ChessEngine.Move.decode(move.encode(), game_state.board).piece_captured == "bp"
+
+
+def test_under_promotions_are_different_moves():
+    game_state = ChessEngine.Game_state.from_fen("8/P6k/8/8/8/8/8/K7 w - - 0 1")
+    promotions = [move for move in game_state.get_valid_moves() if move.is_pawn_promotion]
+    assert sorted(move.get_chess_notation() for move in promotions) == ["a7a8b", "a7a8n", "a7a8q", "a7a8r"]
+    assert len({move.encode() for move in promotions}) == 4
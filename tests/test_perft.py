@@ -0,0 +1,35 @@
+"""
+Perft node counts of the standard test positions (ChessPerft.POSITIONS), any difference is a move generation or
+make/undo bug
+"""
+
+import pytest
+
+from chess import ChessEngine, ChessPerft
+
+DEPTH = 3
+
+
+@pytest.mark.parametrize("name", sorted(ChessPerft.POSITIONS))
+def test_perft(name):
+    fen, expected = ChessPerft.POSITIONS[name]
+    game_state = ChessEngine.Game_state.from_fen(fen)
+    game_state.disable_move_cache()
+    assert ChessPerft.perft(game_state, DEPTH) == expected[DEPTH - 1]
+
+
+@pytest.mark.parametrize("name", ["initial", "kiwipete"])
+def test_perft_bitboards(name):
+    fen, expected = ChessPerft.POSITIONS[name]
+    game_state = ChessEngine.Game_state.from_fen(fen)
+    game_state.disable_move_cache()
+    game_state.enable_bitboards()
+    assert ChessPerft.perft(game_state, DEPTH) == expected[DEPTH - 1]
+
+
+def test_perft_leaves_position_unchanged():
+    fen = ChessPerft.POSITIONS["kiwipete"][0]
+    game_state = ChessEngine.Game_state.from_fen(fen)
+    ChessPerft.perft(game_state, 2)
+    assert game_state.to_fen() == fen
+    assert game_state.hash() == game_state.compute_zobrist_key()
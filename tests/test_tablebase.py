@@ -0,0 +1,45 @@
+"""
+Generated KQK and KRK tables: longest mates and probe results (wdl, plies) of known positions
+"""
+
+import pytest
+
+from chess import ChessEngine, ChessTablebase, ChessTablebaseGenerator
+
+
+@pytest.fixture(scope="module")
+def tablebase(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tablebases"))
+    longest_mates = {}
+    for pieces in ("Q", "R"):
+        _, _, longest_mates[pieces] = ChessTablebaseGenerator.generate_table(pieces, directory)
+    assert longest_mates == {"Q": 10, "R": 16}
+    tablebase = ChessTablebase.Tablebase(directory)
+    yield tablebase
+    tablebase.close()
+
+
+@pytest.mark.parametrize("fen, result", [
+    ("7k/8/6K1/8/8/8/Q7/8 w - - 0 1", (1, 1)),  # Qa8 or Qg8 mates
+    ("7k/8/6K1/8/8/8/8/Q7 b - - 0 1", (-1, 2)),
+    ("Q6k/8/6K1/8/8/8/8/8 b - - 0 1", (-1, 0)),  # mated
+    ("k7/2Q5/1K6/8/8/8/8/8 b - - 0 1", (0, 0)),  # stalemate
+    ("8/8/8/8/8/8/8/K1k4q w - - 0 1", (-1, 4)),  # black is the strong side
+    ("8/8/8/3k4/8/8/8/KQ6 b - - 0 1", (-1, 18)),
+    ("8/8/8/3k4/8/8/8/KB6 b - - 0 1", (0, 0)),  # insufficient material, no table needed
+])
+def test_probe(tablebase, fen, result):
+    assert tablebase.probe(ChessEngine.Game_state.from_fen(fen)) == result
+
+
+def test_probe_not_covered(tablebase):
+    assert tablebase.probe(ChessEngine.Game_state()) is None
+    assert tablebase.probe(ChessEngine.Game_state.from_fen("8/8/8/3k4/8/8/8/KP6 w - - 0 1")) is None  # no KPK table
+
+
+def test_best_move_mates(tablebase):
+    game_state = ChessEngine.Game_state.from_fen("7k/8/6K1/8/8/8/Q7/8 w - - 0 1")
+    move, result = tablebase.best_move(game_state, game_state.get_valid_moves())
+    assert result == (1, 1)
+    game_state.make_move(move)
+    assert game_state.get_valid_moves() == [] and game_state.check_mate